@@ -0,0 +1,12 @@
+from .settings import *  # noqa
+
+# Load test a production-like configuration: debug mode records every SQL
+# query and enables query budgets, which turn pages over budget into errors.
+
+DEBUG = False
+
+ALLOWED_HOSTS = ["localhost", "127.0.0.1"]
+
+ROOT_URLCONF = "example.loadtest_urls"
+
+GALLERY_QUERY_BUDGETS = False
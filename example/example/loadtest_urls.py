@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.urls import re_path
+from django.views.static import serve
+
+from .urls import urlpatterns
+
+# Serve media files without debug mode, like a web server would.
+
+urlpatterns = [
+    re_path(r"^media/(?P<path>.*)$", serve, {"document_root": settings.MEDIA_ROOT}),
+] + urlpatterns
@@ -31,6 +31,7 @@ MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
 MIDDLEWARE = [
+    "gallery.middleware.QueryBudgetMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -38,6 +39,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "gallery.middleware.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "example.urls"
@@ -76,6 +78,8 @@ GALLERY_PHOTO_STORAGE = "example.storages.photo"
 
 GALLERY_CACHE_STORAGE = "example.storages.cache"
 
+GALLERY_PROFILE_STORAGE = "example.storages.profile"
+
 GALLERY_PATTERNS = (
     (
         "Photos",
@@ -14,3 +14,7 @@ def cache():
         location=settings.MEDIA_ROOT / "cache",
         base_url=settings.MEDIA_URL + "cache/",
     )
+
+
+def profile():
+    return FileSystemStorage(location=settings.BASE_DIR / "profiles")
@@ -4,6 +4,7 @@ from django.contrib import admin
 from django.urls import include, path
 
 urlpatterns = [
+    path("accounts/", include("django.contrib.auth.urls")),
     path("admin/", admin.site.urls),
     path("", include("gallery.urls", namespace="gallery")),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,544 @@
+"""
+Load test the sample application with concurrent simulated visitors.
+
+Usage: python loadtest.py [--server {inprocess,wsgi,asgi}] [--url URL]
+           [--settings MODULE]
+           [--visitors N] [--duration SECONDS] [--login USERNAME:PASSWORD]
+           [--anonymous-ratio RATIO] [--thumbnails N] [--connections N]
+           [--export-rate RATE] [--think SECONDS] [--output FILE]
+
+Run it from this directory once the sample application has albums.
+
+Each visitor loads the index, an album, thumbnails of this album, a photo,
+its neighbours, and occasionally exports the album, then starts again. Like
+browsers, visitors load images over --connections parallel connections.
+Visitors log in with the credentials passed with --login, except for a
+fraction of anonymous visitors set by --anonymous-ratio.
+
+--server selects how the sample application is served:
+
+- inprocess: call it with Django's test client, without HTTP;
+- wsgi: serve it with a threaded wsgiref server in this process;
+- asgi: serve it with uvicorn in a subprocess, which must be installed.
+
+The sample application runs with example.loadtest_settings, which disables
+debug mode and query budgets. Pass --settings example.settings to measure the
+development configuration instead.
+
+Visitors share the GIL with the application in the first two cases. To load
+test another server, for example gunicorn, start it and pass its URL with
+--url instead. Make sure it doesn't run in debug mode.
+
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import functools
+import html.parser
+import http.cookiejar
+import http.cookies
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import django
+
+ALBUM_RE = re.compile(r"/album/\d+/$")
+PHOTO_RE = re.compile(r"/photo/\d+/$")
+EXPORT_RE = re.compile(r"/export/\d+/$")
+
+LOGIN_PATH = "/accounts/login/"
+
+CHUNK_SIZE = 65536
+
+
+class Page(html.parser.HTMLParser):
+    """
+    Collect links and images of a HTML page.
+
+    """
+
+    def __init__(self, url, body=b""):
+        super().__init__()
+        self.url = url
+        self.links = []
+        self.images = []
+        self.feed(body.decode(errors="replace"))
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "a" and attrs.get("href"):
+            href = urllib.parse.urljoin(self.url, attrs["href"])
+            self.links.append((href, attrs.get("class")))
+        elif tag == "img" and attrs.get("src"):
+            self.images.append(urllib.parse.urljoin(self.url, attrs["src"]))
+
+    def find_links(self, pattern, classes=None):
+        return [
+            href
+            for href, class_ in self.links
+            if pattern.search(urllib.parse.urlsplit(href).path)
+            and (classes is None or class_ in classes)
+        ]
+
+
+class HTTPSession:
+    """
+    Browse a server over HTTP, keeping cookies.
+
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies)
+        )
+
+    def copy(self):
+        """
+        Return a session with the same cookies, for use in another thread.
+
+        """
+        session = HTTPSession(self.base_url)
+        for cookie in self.cookies:
+            session.cookies.set_cookie(cookie)
+        return session
+
+    def request(self, url, data=None):
+        """
+        Fetch ``url``, following redirects. Return the status code, the final
+        URL, and the body if it's HTML.
+
+        """
+        url = urllib.parse.urljoin(self.base_url, url)
+        if data is not None:
+            data = urllib.parse.urlencode(data).encode()
+        try:
+            response = self.opener.open(url, data, timeout=300)
+        except urllib.error.HTTPError as exc:
+            response = exc
+        with response:
+            html = response.headers.get_content_type() == "text/html"
+            chunks = []
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                if html:
+                    chunks.append(chunk)
+            return response.getcode(), response.geturl(), b"".join(chunks)
+
+
+class InProcessSession:
+    """
+    Browse the sample application with Django's test client.
+
+    """
+
+    base_url = "http://localhost/"
+
+    def __init__(self):
+        from django.test import Client
+
+        self.client = Client(HTTP_HOST="localhost", raise_request_exception=False)
+
+    def copy(self):
+        """
+        Return a session with the same cookies, for use in another thread.
+
+        """
+        session = InProcessSession()
+        session.client.cookies = http.cookies.SimpleCookie(self.client.cookies)
+        return session
+
+    def request(self, url, data=None):
+        url = urllib.parse.urljoin(self.base_url, url)
+        path = urllib.parse.urlsplit(url)._replace(scheme="", netloc="").geturl()
+        if data is None:
+            response = self.client.get(path, follow=True)
+        else:
+            response = self.client.post(path, data, follow=True)
+        html = response.get("Content-Type", "").startswith("text/html")
+        body = b""
+        if response.streaming:
+            for chunk in response.streaming_content:
+                if html:
+                    body += chunk
+        elif html:
+            body = response.content
+        if response.redirect_chain:
+            url = urllib.parse.urljoin(url, response.redirect_chain[-1][0])
+        return response.status_code, url, body
+
+
+class Visitor:
+    """
+    Browse the gallery until ``deadline`` and record timings of requests.
+
+    Like browsers, visitors load images of a page over several connections in
+    parallel, each with its own session.
+
+    """
+
+    def __init__(self, session, options, seed, record):
+        self.session = session
+        self.options = options
+        self.rng = random.Random(seed)
+        self.record = record
+
+    def log_in(self, username, password):
+        _, url, body = self.session.request(LOGIN_PATH)
+        match = re.search(rb'name="csrfmiddlewaretoken" value="([^"]+)"', body)
+        data = {"username": username, "password": password, "next": "/"}
+        if match is not None:
+            data["csrfmiddlewaretoken"] = match.group(1).decode()
+        _, url, _ = self.session.request(LOGIN_PATH, data)
+        if urllib.parse.urlsplit(url).path == LOGIN_PATH:
+            raise RuntimeError(f"Failed to log in as {username}")
+
+    def fetch(self, label, url, session=None):
+        if session is None:
+            session = self.session
+        start = time.perf_counter()
+        try:
+            status, url, body = session.request(url)
+        except Exception as exc:
+            self.record(label, time.perf_counter() - start, repr(exc))
+            return Page(url)
+        error = f"HTTP {status}" if status >= 400 else None
+        self.record(label, time.perf_counter() - start, error)
+        return Page(url, body)
+
+    def fetch_images(self, label, urls):
+        connections = self.connections[: len(urls)]
+        batches = [urls[index :: len(connections)] for index in range(len(connections))]
+
+        def fetch_batch(session, urls):
+            for url in urls:
+                self.fetch(label, url, session)
+
+        for future in [
+            self.executor.submit(fetch_batch, session, urls)
+            for session, urls in zip(connections, batches)
+        ]:
+            future.result()
+
+    def think(self):
+        if self.options.think:
+            time.sleep(self.rng.expovariate(1 / self.options.think))
+
+    def browse(self):
+        rng = self.rng
+        page = self.fetch("index", "/")
+        albums = page.find_links(ALBUM_RE)
+        if not albums:
+            return
+        self.think()
+
+        page = self.fetch("album", rng.choice(albums))
+        self.fetch_images("thumbnail", page.images[: self.options.thumbnails])
+        photos = page.find_links(PHOTO_RE)
+        exports = page.find_links(EXPORT_RE)
+        self.think()
+
+        if photos:
+            page = self.fetch("photo", rng.choice(photos))
+            self.fetch_images("image", page.images)
+            self.think()
+            for _ in range(2):
+                neighbours = page.find_links(PHOTO_RE, classes=["previous", "next"])
+                if not neighbours:
+                    break
+                page = self.fetch("photo", rng.choice(neighbours))
+                self.fetch_images("image", page.images)
+                self.think()
+
+        if exports and rng.random() < self.options.export_rate:
+            self.fetch("export", exports[0])
+            self.think()
+
+    def run(self, deadline):
+        # Connections share cookies of the session after logging in.
+        self.connections = [
+            self.session.copy() for _ in range(self.options.connections)
+        ]
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.options.connections)
+        try:
+            while time.monotonic() < deadline:
+                self.browse()
+        finally:
+            self.executor.shutdown()
+
+
+def percentile(durations, fraction):
+    """
+    Return the ``fraction`` percentile of sorted ``durations``, by nearest rank.
+
+    """
+    index = max(0, int(round(fraction * len(durations))) - 1)
+    return durations[index]
+
+
+def summarize(samples, elapsed):
+    results = {}
+    labels = ["total"] + sorted({label for label, _, _ in samples})
+    for label in labels:
+        durations = sorted(
+            duration
+            for label_, duration, _ in samples
+            if label == "total" or label_ == label
+        )
+        errors = sum(
+            1
+            for label_, _, error in samples
+            if error is not None and (label == "total" or label_ == label)
+        )
+        results[label] = {
+            "requests": len(durations),
+            "rps": len(durations) / elapsed,
+            "errors": errors,
+            "error_rate": errors / len(durations),
+            "p50": percentile(durations, 0.5),
+            "p90": percentile(durations, 0.9),
+            "p99": percentile(durations, 0.99),
+            "max": durations[-1],
+        }
+    return results
+
+
+def report(results, errors):
+    print()
+    print(
+        f"{'':<10} {'requests':>9} {'rps':>8} {'errors':>7} "
+        f"{'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"
+    )
+    for label, result in results.items():
+        print(
+            f"{label:<10} {result['requests']:9d} {result['rps']:8.1f} "
+            f"{result['error_rate']:7.1%} {result['p50']:8.3f} "
+            f"{result['p90']:8.3f} {result['p99']:8.3f} {result['max']:8.3f}"
+        )
+    if errors:
+        print()
+        print("Most frequent errors:")
+        for error, count in sorted(errors.items(), key=lambda item: -item[1])[:10]:
+            print(f"{count:6d} × {error}")
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The server exited while starting")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("The server didn't start")
+
+
+def start_wsgi_server():
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietWSGIRequestHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    class LoadTestWSGIServer(ThreadedWSGIServer):
+        # The default backlog of 5 connections delays connections by 1s.
+        request_queue_size = 128
+
+    server = LoadTestWSGIServer(("127.0.0.1", 0), QuietWSGIRequestHandler)
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/", server.shutdown
+
+
+def start_asgi_server(settings_module):
+    port = get_free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "example.asgi:application",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, "DJANGO_SETTINGS_MODULE": settings_module},
+    )
+    try:
+        wait_for_port(port, process)
+    except RuntimeError:
+        process.kill()
+        raise
+
+    def stop():
+        process.terminate()
+        process.wait()
+
+    return f"http://127.0.0.1:{port}/", stop
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--server", choices=["inprocess", "wsgi", "asgi"], default="wsgi"
+    )
+    parser.add_argument("--url", help="Load test a running server instead")
+    parser.add_argument("--settings", default="example.loadtest_settings")
+    parser.add_argument("--visitors", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument(
+        "--login",
+        action="append",
+        default=[],
+        metavar="USERNAME:PASSWORD",
+        help="Credentials of visitors (may be repeated)",
+    )
+    parser.add_argument("--anonymous-ratio", type=float)
+    parser.add_argument("--thumbnails", type=int, default=20)
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=6,
+        help="Parallel connections of each visitor for loading images",
+    )
+    parser.add_argument("--export-rate", type=float, default=0.05)
+    parser.add_argument("--think", type=float, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    credentials = []
+    for login in args.login:
+        username, sep, password = login.partition(":")
+        if not sep:
+            parser.error(f"Invalid --login: {login}")
+        credentials.append((username, password))
+    anonymous_ratio = args.anonymous_ratio
+    if anonymous_ratio is None:
+        anonymous_ratio = 0.5 if credentials else 1
+    elif anonymous_ratio < 1 and not credentials:
+        parser.error("Pass credentials with --login for authenticated visitors.")
+
+    stop = None
+    # The configuration of a server started separately is unknown.
+    debug = query_budgets = None
+    if args.url is None:
+        os.environ["DJANGO_SETTINGS_MODULE"] = args.settings
+        django.setup()
+        from django.conf import settings
+
+        debug = settings.DEBUG
+        query_budgets = getattr(settings, "GALLERY_QUERY_BUDGETS", debug)
+        if debug:
+            print("Warning: debug mode records SQL queries and slows down pages.")
+
+    if args.url is not None:
+        server = args.url
+        make_session = functools.partial(HTTPSession, args.url)
+    elif args.server == "asgi":
+        if importlib.util.find_spec("uvicorn") is None:
+            parser.error("Install uvicorn to use --server asgi.")
+        server = "uvicorn"
+        base_url, stop = start_asgi_server(args.settings)
+        make_session = functools.partial(HTTPSession, base_url)
+    elif args.server == "wsgi":
+        server = "wsgiref"
+        base_url, stop = start_wsgi_server()
+        make_session = functools.partial(HTTPSession, base_url)
+    else:
+        server = "test client"
+        make_session = InProcessSession
+
+    samples = []
+    errors = {}
+    lock = threading.Lock()
+
+    def record(label, duration, error):
+        with lock:
+            samples.append((label, duration, error))
+            if error is not None:
+                errors[error] = errors.get(error, 0) + 1
+
+    try:
+        visitors = []
+        anonymous = int(round(args.visitors * anonymous_ratio))
+        for index in range(args.visitors):
+            visitor = Visitor(make_session(), args, index, record)
+            if index >= anonymous:
+                visitor.log_in(*credentials[index % len(credentials)])
+            visitors.append(visitor)
+
+        print(
+            f"Load testing {server} with {args.visitors} visitors "
+            f"({anonymous} anonymous) for {args.duration:g}s..."
+        )
+        start = time.monotonic()
+        deadline = start + args.duration
+        threads = [
+            threading.Thread(target=visitor.run, args=(deadline,))
+            for visitor in visitors
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+    finally:
+        if stop is not None:
+            stop()
+
+    if not samples:
+        print("No requests were made.")
+        return
+    results = summarize(samples, elapsed)
+    report(results, errors)
+
+    if args.output is not None:
+        environment = {
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "server": server,
+            "settings": None if args.url is not None else args.settings,
+            "debug": debug,
+            "query_budgets": query_budgets,
+            "visitors": args.visitors,
+            "anonymous": anonymous,
+            "duration": elapsed,
+            "thumbnails": args.thumbnails,
+            "connections": args.connections,
+            "export_rate": args.export_rate,
+            "think": args.think,
+        }
+        with open(args.output, "w") as output:
+            json.dump({"environment": environment, "results": results}, output)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,228 @@
 import io
 
+from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.admin.widgets import FilteredSelectMultiple
-from django.contrib.auth.decorators import permission_required
+from django.contrib.auth.decorators import permission_required, user_passes_test
+from django.contrib.auth.models import User
 from django.core import management
 from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import (
+    Aggregate,
+    BooleanField,
+    Case,
+    CharField,
+    Count,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
 from django.forms.models import modelform_factory
-from django.http import HttpResponseRedirect
+from django.http import FileResponse, Http404, HttpResponseRedirect
 from django.shortcuts import render
-from django.template import Context, Template
+from django.templatetags.static import static
 from django.urls import path, reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html, format_html_join
 from django.utils.translation import gettext, gettext_lazy
 
-from .models import Album, AlbumAccessPolicy, Photo, PhotoAccessPolicy
+from .caching import bump_generation_on_commit
+from .models import (
+    Album,
+    AlbumAccessPolicy,
+    Photo,
+    PhotoAccessPolicy,
+    PhotoDateSummary,
+)
+from .profiling import is_enabled as profiling_enabled
+from .profiling import list_profiles
+from .resizers import get_resize
+from .search import get_search_backend
+from .storages import get_storage
+
+
+class GroupConcat(Aggregate):
+    """
+    Concatenate values with ", " as a separator, in order on PostgreSQL and
+    MySQL.
+
+    """
+
+    function = "GROUP_CONCAT"
+    template = "%(function)s(%(expressions)s, ', ')"
+    output_field = CharField()
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        template = (
+            "%(function)s(%(expressions)s ORDER BY %(expressions)s SEPARATOR ', ')"
+        )
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        function = "STRING_AGG"
+        template = "%(function)s(%(expressions)s, ', ' ORDER BY %(expressions)s)"
+        return self.as_sql(
+            compiler, connection, function=function, template=template, **extra_context
+        )
+
+
+def access_policy_names(policy_model, relation, policy_pk):
+    """
+    Return an expression listing the names of groups or users of a policy.
+
+    ``relation`` is ``"groups"`` or ``"users"``. ``policy_pk`` refers to the
+    primary key of the access policy in the outer query.
+
+    """
+    field = policy_model._meta.get_field(relation)
+    through = field.remote_field.through
+    policy_field_name = field.m2m_field_name()
+    if field.related_model is User:
+        name_field_name = User.USERNAME_FIELD
+    else:
+        name_field_name = "name"
+    name_lookup = f"{field.m2m_reverse_field_name()}__{name_field_name}"
+    names = (
+        through.objects.filter(**{policy_field_name: policy_pk})
+        .values(policy_field_name)
+        .annotate(names=GroupConcat(name_lookup))
+        .values("names")
+    )
+    return Coalesce(Subquery(names), Value(""))
+
+
+class InvalidatePageCacheMixin:
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_generation_on_commit()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_generation_on_commit()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_generation_on_commit()
+
+
+def set_access_policies(policy_model, model_name, queryset, form, batch_size=1000):
+    """
+    Set the access policy of all objects in ``queryset`` with set operations.
+
+    Queries filter on ``queryset`` with subqueries rather than lists of
+    primary keys. Rows are inserted in batches of ``batch_size``, so the
+    number of queries only grows with the number of batches.
+
+    """
+    values = {
+        name: value
+        for name, value in form.cleaned_data.items()
+        if name not in ("groups", "users")
+    }
+    policies = policy_model.objects.filter(**{f"{model_name}__in": queryset})
+    policies.update(**values)
+    missing_pks = queryset.filter(access_policy__isnull=True).values_list(
+        "pk", flat=True
+    )
+    policy_model.objects.bulk_create(
+        (
+            policy_model(**{f"{model_name}_id": pk}, **values)
+            for pk in missing_pks.iterator()
+        ),
+        batch_size=batch_size,
+    )
+    policy_pks = policies.values_list("pk", flat=True)
+    for name in ("groups", "users"):
+        field = policy_model._meta.get_field(name)
+        through = field.remote_field.through
+        policy_field_name = field.m2m_field_name() + "_id"
+        related_field_name = field.m2m_reverse_field_name() + "_id"
+        through.objects.filter(**{f"{policy_field_name}__in": policy_pks}).delete()
+        related_pks = [obj.pk for obj in form.cleaned_data[name]]
+        if not related_pks:
+            continue
+        through.objects.bulk_create(
+            (
+                through(**{policy_field_name: policy_pk, related_field_name: pk})
+                for policy_pk in policy_pks.iterator()
+                for pk in related_pks
+            ),
+            batch_size=batch_size,
+        )
+
+
+def get_approximate_count(queryset):
+    """
+    Return an approximate number of objects in ``queryset``, or ``None``.
+
+    Only unfiltered querysets are supported. On PostgreSQL, the count comes
+    from planner statistics. For photos, it comes from ``PhotoDateSummary``.
+
+    """
+    if queryset.query.where:
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 for tables that were never analyzed.
+        if row is not None and row[0] >= 0:
+            return int(row[0])
+    if queryset.model is Photo:
+        return PhotoDateSummary.objects.aggregate(total=Sum("count"))["total"]
+    return None
+
+
+class ApproximateCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        count = get_approximate_count(self.object_list)
+        if count is None:
+            count = super().count
+        return count
+
+
+class AccessPolicyChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # Annotate only the current page to keep counting objects cheap.
+        self.result_list = self.model_admin.annotate_access_policy(self.result_list)
+
+
+class AccessPolicyColumnsMixin:
+    """
+    Display access policies in changelists without a query for each row.
+
+    Subclasses must implement ``annotate_access_policy(queryset)``.
+
+    """
+
+    def get_changelist(self, request, **kwargs):
+        return AccessPolicyChangeList
+
+    def public(self, obj):
+        return obj.access_policy_public
+
+    public.boolean = True
+
+    def groups(self, obj):
+        return obj.access_policy_groups
+
+    def users(self, obj):
+        return obj.access_policy_users
 
 
 class SetAccessPolicyMixin:
@@ -35,31 +244,25 @@ class SetAccessPolicyMixin:
         if request.POST.get("set_access_policy"):
             form = form_class(request.POST)
             if form.is_valid():
-                queryset = queryset.select_related("access_policy")
+                policies = policy_model.objects.filter(
+                    **{f"{model_name}__in": queryset}
+                )
                 # Check permissions
                 has_add_perm = request.user.has_perm(f"gallery.add_{policy_model_name}")
                 has_change_perm = request.user.has_perm(
                     f"gallery.change_{policy_model_name}"
                 )
-                for obj in queryset:
-                    try:
-                        obj.access_policy
-                    except policy_model.DoesNotExist:
-                        if not has_add_perm:
-                            raise PermissionDenied
-                    else:
-                        if not has_change_perm:
-                            raise PermissionDenied
+                changed = policies.count()
+                created = queryset.count() - changed
+                if created and not has_add_perm:
+                    raise PermissionDenied
+                if changed and not has_change_perm:
+                    raise PermissionDenied
                 # Apply changes
-                created, changed = 0, 0
-                for obj in queryset:
-                    try:
-                        ap = obj.access_policy
-                        changed += 1
-                    except policy_model.DoesNotExist:
-                        ap = policy_model.objects.create(**{model_name: obj})
-                        created += 1
-                    form_class(request.POST, instance=ap).save()
+                with transaction.atomic():
+                    set_access_policies(policy_model, model_name, queryset, form)
+                # Bulk operations don't send signals.
+                bump_generation_on_commit()
                 message = gettext(
                     "Successfully created %(created)d and "
                     "changed %(changed)d access policies."
@@ -89,29 +292,16 @@ class SetAccessPolicyMixin:
         model_name = self.model._meta.model_name
         policy_model_name = policy_model._meta.model_name
         if request.POST.get("unset_access_policy"):
-            queryset = queryset.select_related("access_policy")
+            policies = policy_model.objects.filter(**{f"{model_name}__in": queryset})
             # Check permissions
             has_delete_perm = request.user.has_perm(
                 f"gallery.delete_{policy_model_name}"
             )
-            for obj in queryset:
-                try:
-                    obj.access_policy
-                except policy_model.DoesNotExist:
-                    pass
-                else:
-                    if not has_delete_perm:
-                        raise PermissionDenied
+            if not has_delete_perm and policies.exists():
+                raise PermissionDenied
             # Apply changes
-            deleted = 0
-            for obj in queryset:
-                try:
-                    ap = obj.access_policy
-                except policy_model.DoesNotExist:
-                    pass
-                else:
-                    ap.delete()
-                    deleted += 1
+            _, deleted_by_model = policies.delete()
+            deleted = deleted_by_model.get(policy_model._meta.label, 0)
             message = gettext("Successfully deleted %(deleted)d access policies.")
             message = message % {"deleted": deleted}
             self.message_user(request, message)
@@ -139,8 +329,14 @@ class AlbumAccessPolicyInline(AccessPolicyInline):
     model = AlbumAccessPolicy
 
 
-class AlbumAdmin(SetAccessPolicyMixin, admin.ModelAdmin):
+class AlbumAdmin(
+    InvalidatePageCacheMixin,
+    AccessPolicyColumnsMixin,
+    SetAccessPolicyMixin,
+    admin.ModelAdmin,
+):
     date_hierarchy = "date"
+    changelist_query_budget = 10
     inlines = (AlbumAccessPolicyInline,)
     list_display = (
         "display_name",
@@ -156,41 +352,33 @@ class AlbumAdmin(SetAccessPolicyMixin, admin.ModelAdmin):
     readonly_fields = ("dirpath",)
     search_fields = ("name", "dirpath")
 
-    def get_queryset(self, request):
-        return (
-            super()
-            .get_queryset(request)
-            .prefetch_related("access_policy__users")
-            .prefetch_related("access_policy__groups")
+    def annotate_access_policy(self, queryset):
+        no_access_policy = Q(access_policy__isnull=True)
+        policy_pk = OuterRef("access_policy__pk")
+        return queryset.annotate(
+            access_policy_public=F("access_policy__public"),
+            access_policy_groups=Case(
+                When(no_access_policy, then=Value("-")),
+                default=access_policy_names(AlbumAccessPolicy, "groups", policy_pk),
+            ),
+            access_policy_users=Case(
+                When(no_access_policy, then=Value("-")),
+                default=access_policy_names(AlbumAccessPolicy, "users", policy_pk),
+            ),
+            access_policy_inherit=F("access_policy__inherit"),
         )
 
-    def public(self, obj):
-        access_policy = obj.get_access_policy()
-        if access_policy:
-            return access_policy.public
-
-    public.boolean = True
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return get_search_backend().search_albums(queryset, search_term), False
 
-    def groups(self, obj):
-        access_policy = obj.get_access_policy()
-        if access_policy:
-            groups = access_policy.groups.all()
-            return ", ".join(str(group) for group in groups)
-        else:
-            return "-"
-
-    def users(self, obj):
-        access_policy = obj.get_access_policy()
-        if access_policy:
-            users = access_policy.users.all()
-            return ", ".join(str(user) for user in users)
-        else:
-            return "-"
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        get_search_backend().rebuild([obj.pk])
 
     def inherit(self, obj):
-        access_policy = obj.get_access_policy()
-        if access_policy:
-            return access_policy.inherit
+        return obj.access_policy_inherit
 
     inherit.boolean = True
 
@@ -202,64 +390,160 @@ class PhotoAccessPolicyInline(AccessPolicyInline):
     model = PhotoAccessPolicy
 
 
-class PhotoAdmin(SetAccessPolicyMixin, admin.ModelAdmin):
+class DuplicatesFilter(admin.SimpleListFilter):
+    title = gettext_lazy("duplicates")
+    parameter_name = "duplicates"
+
+    def lookups(self, request, model_admin):
+        return [("yes", gettext_lazy("Duplicates only"))]
+
+    def queryset(self, request, queryset):
+        if self.value() == "yes":
+            duplicate_hashes = (
+                Photo.objects.exclude(content_hash="")
+                .values("content_hash")
+                .annotate(count=Count("pk"))
+                .filter(count__gt=1)
+                .values("content_hash")
+            )
+            return queryset.filter(content_hash__in=duplicate_hashes)
+
+
+class PhotoAdmin(
+    InvalidatePageCacheMixin,
+    AccessPolicyColumnsMixin,
+    SetAccessPolicyMixin,
+    admin.ModelAdmin,
+):
     date_hierarchy = "date"
+    changelist_query_budget = 9
     inlines = (PhotoAccessPolicyInline,)
     list_display = ("display_name", "date", "preview", "public", "groups", "users")
+    list_filter = (DuplicatesFilter,)
+    list_select_related = ("album",)
     # Since date is mandatory on albums, '-album_date' avoids showing photos
     # without date first on some databases (PostgreSQL).
     ordering = ("-album__date", "-date", "-filename")
-    readonly_fields = ("filename",)
+    readonly_fields = ("filename", "content_hash", "duplicates")
     search_fields = ("album__name", "album__dirpath", "filename")
 
+    @property
+    def show_full_result_count(self):
+        return not getattr(settings, "GALLERY_ADMIN_APPROXIMATE_COUNTS", False)
+
+    def get_paginator(self, request, queryset, per_page, **kwargs):
+        if getattr(settings, "GALLERY_ADMIN_APPROXIMATE_COUNTS", False):
+            return ApproximateCountPaginator(queryset, per_page, **kwargs)
+        return super().get_paginator(request, queryset, per_page, **kwargs)
+
+    def get_ordering(self, request):
+        # Show duplicates next to one another.
+        if request.GET.get(DuplicatesFilter.parameter_name) == "yes":
+            return ("content_hash",) + self.ordering
+        return self.ordering
+
     def get_urls(self):
         return [
             path("scan/", scan_photos, name="gallery_scan_photos"),
+            path("profiles/", profiles, name="gallery_profiles"),
+            path("profiles/<slug:name>/", download_profile, name="gallery_profile"),
         ] + super().get_urls()
 
-    def get_queryset(self, request):
-        return (
-            super()
-            .get_queryset(request)
-            .prefetch_related("access_policy__users")
-            .prefetch_related("access_policy__groups")
-            .prefetch_related("album__access_policy__users")
-            .prefetch_related("album__access_policy__groups")
+    def annotate_access_policy(self, queryset):
+        # Mirror Photo.get_effective_access_policy.
+        own_access_policy = Q(access_policy__isnull=False)
+        album_access_policy = Q(
+            access_policy__isnull=True, album__access_policy__inherit=True
+        )
+        photo_policy_pk = OuterRef("access_policy__pk")
+        album_policy_pk = OuterRef("album__access_policy__pk")
+        return queryset.annotate(
+            access_policy_public=Case(
+                When(own_access_policy, then=F("access_policy__public")),
+                When(album_access_policy, then=F("album__access_policy__public")),
+                default=None,
+                output_field=BooleanField(null=True),
+            ),
+            access_policy_groups=Case(
+                When(
+                    own_access_policy,
+                    then=access_policy_names(
+                        PhotoAccessPolicy, "groups", photo_policy_pk
+                    ),
+                ),
+                When(
+                    album_access_policy,
+                    then=access_policy_names(
+                        AlbumAccessPolicy, "groups", album_policy_pk
+                    ),
+                ),
+                default=Value("-"),
+            ),
+            access_policy_users=Case(
+                When(
+                    own_access_policy,
+                    then=access_policy_names(
+                        PhotoAccessPolicy, "users", photo_policy_pk
+                    ),
+                ),
+                When(
+                    album_access_policy,
+                    then=access_policy_names(
+                        AlbumAccessPolicy, "users", album_policy_pk
+                    ),
+                ),
+                default=Value("-"),
+            ),
         )
 
-    preview_template = Template(
-        """
-<a href="{{ photo.get_absolute_url }}">
-<img src="{% url 'gallery:photo-resized' preset='thumb' pk=photo.pk %}"
-     width="128" height="128" alt="{{ photo }}" />
-</a>"""
-    )
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return get_search_backend().search_photos(queryset, search_term), False
 
     def preview(self, obj):
-        return self.preview_template.render(Context({"photo": obj}))
-
-    preview.allow_tags = True
-
-    def public(self, obj):
-        access_policy = obj.get_effective_access_policy()
-        if access_policy:
-            return access_policy.public
-
-    public.boolean = True
-
-    def groups(self, obj):
-        access_policy = obj.get_effective_access_policy()
-        if access_policy:
-            return ", ".join(str(group) for group in access_policy.groups.all())
+        resize = get_resize()
+        resize_nowait = getattr(resize, "nowait", None)
+        if resize_nowait is None:
+            url = reverse("gallery:photo-resized", args=["thumb", obj.pk])
         else:
-            return "-"
+            width, height, crop = settings.GALLERY_RESIZE_PRESETS["thumb"]
+            url = resize_nowait(obj, width, height, crop)
+        if url is None:
+            # The thumbnail is being created in the background.
+            url = static("img/placeholder.svg")
+        return format_html(
+            '<a href="{}"><img src="{}" width="128" height="128" alt="{}" /></a>',
+            obj.get_absolute_url(),
+            url,
+            obj,
+        )
 
-    def users(self, obj):
-        access_policy = obj.get_effective_access_policy()
-        if access_policy:
-            return ", ".join(str(user) for user in access_policy.users.all())
-        else:
+    def duplicates(self, obj):
+        if not obj.content_hash:
             return "-"
+        duplicates = (
+            Photo.objects.filter(content_hash=obj.content_hash)
+            .exclude(pk=obj.pk)
+            .select_related("album")
+            .order_by("album__dirpath", "filename")
+        )
+        return (
+            format_html_join(
+                ", ",
+                '<a href="{}">{}</a>',
+                (
+                    (
+                        reverse("admin:gallery_photo_change", args=[photo.pk]),
+                        photo.image_name,
+                    )
+                    for photo in duplicates
+                ),
+            )
+            or "-"
+        )
+
+    duplicates.short_description = gettext_lazy("duplicates")
 
 
 admin.site.register(Photo, PhotoAdmin)
@@ -280,3 +564,24 @@ def scan_photos(request):
         "title": gettext("Scan photos"),
     }
     return render(request, "admin/gallery/scan_photos.html", context)
+
+
+@user_passes_test(lambda user: user.is_superuser)
+def profiles(request):
+    context = {
+        "app_label": "gallery",
+        "title": gettext("Profiles"),
+        "profiles": list_profiles() if profiling_enabled() else [],
+    }
+    return render(request, "admin/gallery/profiles.html", context)
+
+
+@user_passes_test(lambda user: user.is_superuser)
+def download_profile(request, name):
+    if not profiling_enabled():
+        raise Http404
+    storage = get_storage("profile")
+    filename = f"{name}.prof"
+    if not storage.exists(filename):
+        raise Http404
+    return FileResponse(storage.open(filename), as_attachment=True, filename=filename)
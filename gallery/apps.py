@@ -5,3 +5,7 @@ from django.utils.translation import gettext_lazy as _
 class GalleryConfig(AppConfig):
     name = "gallery"
     verbose_name = _("Gallery")
+
+    def ready(self):
+        # Connect signal handlers for invalidating the page cache.
+        from . import caching  # noqa
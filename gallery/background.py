@@ -0,0 +1,15 @@
+import concurrent.futures
+import functools
+
+
+@functools.lru_cache()
+def get_executor(name, max_workers):
+    """
+    Return a thread pool for running background tasks of the given kind.
+
+    Each process has its own pools.
+
+    """
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix=f"gallery-{name}"
+    )
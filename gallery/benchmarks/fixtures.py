@@ -0,0 +1,220 @@
+import datetime
+import io
+import itertools
+import os
+import random
+import shutil
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import Album, AlbumAccessPolicy, Photo, PhotoAccessPolicy
+from ..search import get_search_backend
+from ..storages import get_storage
+
+BATCH_SIZE = 10000
+
+
+def get_photo_date(album, index):
+    date = datetime.datetime.combine(
+        album.date, datetime.time(index % 24, index % 60, index % 60)
+    )
+    # Like scanphotos, interpret dates in the default time zone.
+    if settings.USE_TZ:
+        date = timezone.make_aware(date, timezone.get_default_timezone())
+    return date
+
+
+def get_album_sizes(photos, albums, skewed, rng):
+    """
+    Return the number of photos in each album.
+
+    When ``skewed`` is true, sizes follow a Pareto distribution: most albums
+    are small and a few are very large.
+
+    """
+    if not skewed:
+        return [photos // albums + (index < photos % albums) for index in range(albums)]
+    weights = [rng.paretovariate(1.2) for _ in range(albums)]
+    total = sum(weights)
+    # Give each album at least one photo and distribute the rest.
+    sizes = [1 + int((photos - albums) * weight / total) for weight in weights]
+    for index in range(photos - sum(sizes)):
+        sizes[index % albums] += 1
+    return sizes
+
+
+# Photos and albums are named so that GALLERY_PATTERNS in benchmark settings
+# match them, making scanphotos consistent with the generated database.
+
+
+def get_album_dirpath(date, index):
+    return f"{date:%Y}/{date:%m_%d}_Album {index}"
+
+
+def get_photo_filename(date, index):
+    return f"{date:%Y-%m-%d_%H-%M-%S}_{index:07d}.jpg"
+
+
+def generate_gallery(photos, photos_per_album=100, seed=0, log=print, skewed=False):
+    """
+    Fill the database with a synthetic gallery containing ``photos`` photos.
+
+    Albums have ``photos_per_album`` photos on average and are spread over 20
+    years. If ``skewed`` is true, album sizes vary widely, as described in
+    ``get_album_sizes``. A third of albums is public, a third is shared with a
+    group and a user, and a third is private. One percent of photos have an
+    access policy.
+
+    Users ``user0`` to ``user9`` and groups ``group0`` to ``group2`` are
+    created. ``user0`` is a superuser. Passwords are ``pass``.
+
+    """
+    rng = random.Random(seed)
+
+    with transaction.atomic():
+        log("Creating users and groups...")
+        groups = [Group.objects.create(name=f"group{i}") for i in range(3)]
+        users = [
+            User.objects.create_user(f"user{i}", f"user{i}@gallery", "pass")
+            for i in range(10)
+        ]
+        users[0].is_superuser = users[0].is_staff = True
+        users[0].save()
+        for i, user in enumerate(users[1:]):
+            user.groups.add(groups[i % len(groups)])
+
+        log("Creating albums...")
+        start = datetime.date.today() - datetime.timedelta(days=20 * 365)
+        dates = (
+            start + datetime.timedelta(days=rng.randrange(20 * 365))
+            for _ in itertools.count()
+        )
+        Album.objects.bulk_create(
+            (
+                Album(
+                    category="Photos",
+                    dirpath=get_album_dirpath(date, index),
+                    date=date,
+                    name=f"Album {index}",
+                )
+                for index, date in zip(range(max(1, photos // photos_per_album)), dates)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        albums = list(Album.objects.order_by("pk"))
+        sizes = get_album_sizes(photos, len(albums), skewed, rng)
+
+        log("Creating album access policies...")
+        AlbumAccessPolicy.objects.bulk_create(
+            (
+                AlbumAccessPolicy(album=album, public=album.pk % 3 == 0)
+                for album in albums
+                if album.pk % 3 != 2
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        policies = AlbumAccessPolicy.objects.filter(public=False)
+        AlbumAccessPolicy.groups.through.objects.bulk_create(
+            (
+                AlbumAccessPolicy.groups.through(
+                    albumaccesspolicy_id=pk, group=groups[pk % len(groups)]
+                )
+                for pk in policies.values_list("pk", flat=True)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        AlbumAccessPolicy.users.through.objects.bulk_create(
+            (
+                AlbumAccessPolicy.users.through(
+                    albumaccesspolicy_id=pk, user=users[pk % len(users)]
+                )
+                for pk in policies.values_list("pk", flat=True)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+        log(f"Creating {photos} photos...")
+        photo_albums = itertools.chain.from_iterable(
+            itertools.repeat(album, size) for album, size in zip(albums, sizes)
+        )
+        Photo.objects.bulk_create(
+            (
+                Photo(
+                    album=album,
+                    filename=get_photo_filename(get_photo_date(album, index), index),
+                    date=get_photo_date(album, index),
+                )
+                for index, album in enumerate(photo_albums)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+        log("Creating photo access policies...")
+        PhotoAccessPolicy.objects.bulk_create(
+            (
+                PhotoAccessPolicy(photo_id=pk, public=rng.random() < 0.5)
+                for pk in Photo.objects.values_list("pk", flat=True).iterator()
+                if pk % 100 == 0
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+
+def make_jpeg(width, height, seed=0):
+    """
+    Return the contents of a JPEG image of ``width`` x ``height`` pixels.
+
+    """
+    from PIL import Image
+
+    rng = random.Random(seed)
+    # Scale up random pixels to get an image that compresses like a photo.
+    image = Image.new("RGB", (min(width, 64), min(height, 64)))
+    image.putdata(
+        [
+            (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            for _ in range(image.width * image.height)
+        ]
+    )
+    image = image.resize((width, height), Image.BICUBIC)
+    output = io.BytesIO()
+    image.save(output, format="JPEG")
+    return output.getvalue()
+
+
+def generate_photo_files(storage, log=print):
+    """
+    Save a small JPEG image in ``storage`` for each photo in the database.
+
+    Images are identical except for trailing bytes, which make their hashes
+    unique. Image decoders ignore data after the end of a JPEG image.
+
+    """
+    log("Creating photo files...")
+    image = make_jpeg(32, 24)
+    photos = Photo.objects.select_related("album").only("album__dirpath", "filename")
+    for photo in photos.iterator(chunk_size=BATCH_SIZE):
+        storage.save(photo.image_name, io.BytesIO(image + str(photo.pk).encode()))
+
+
+def prepare_gallery(photos, regenerate=False, skewed=False, files=False, log=print):
+    """
+    Generate a synthetic gallery unless the database already contains one with
+    ``photos`` photos.
+
+    When ``files`` is true, also create photo files if they don't exist.
+
+    """
+    storage = get_storage("photo")
+    call_command("migrate", verbosity=0)
+    if regenerate or Photo.objects.count() != photos:
+        call_command("flush", interactive=False, verbosity=0)
+        shutil.rmtree(storage.location, ignore_errors=True)
+        generate_gallery(photos, log=log, skewed=skewed)
+        get_search_backend().rebuild()
+    if files and not os.path.isdir(storage.location):
+        generate_photo_files(storage, log=log)
@@ -0,0 +1,122 @@
+"""
+Show query plans for the queries behind the main pages of the gallery.
+
+Usage: python -m gallery.benchmarks.queryplans [--photos N] [--regenerate]
+
+The first run generates a synthetic gallery, which takes a few minutes with
+the default of one million photos.
+
+"""
+
+import argparse
+import os
+
+import django
+
+
+def get_index_names():
+    from django.apps import apps
+
+    return [
+        index.name
+        for model in apps.get_app_config("gallery").get_models()
+        for index in model._meta.indexes
+    ]
+
+
+def explain(sql):
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}")
+        return [str(row[-1]) for row in cursor.fetchall()]
+
+
+def show_query_plans(client, url, index_names):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(url)
+    assert response.status_code == 200, f"{url} returned {response.status_code}"
+    print(f"=== {url} - {len(context)} queries")
+    for query in context.captured_queries:
+        sql = query["sql"]
+        # Skip queries for sessions, users and permissions.
+        if '"gallery_' not in sql:
+            continue
+        plan = explain(sql)
+        used = [name for name in index_names if any(name in line for line in plan)]
+        print()
+        print(sql if len(sql) <= 200 else sql[:197] + "...")
+        for line in plan:
+            print(f"    {line}")
+        print(f"    indexes: {', '.join(used) or '-'}")
+    print()
+
+
+def get_sample_urls(client, username):
+    """
+    Log ``client`` in as ``username`` and return URLs of the main pages.
+
+    """
+    from django.contrib.auth.models import AnonymousUser, User
+    from django.urls import reverse
+
+    from ..models import Album
+
+    if username is None:
+        albums = Album.objects.allowed_for_user(AnonymousUser())
+    else:
+        user = User.objects.get(username=username)
+        client.force_login(user)
+        if user.is_superuser:
+            albums = Album.objects.all()
+        else:
+            albums = Album.objects.allowed_for_user(user, include_public=False)
+    # Pick an album in the middle of the gallery, with photos.
+    album = albums.filter(photo__isnull=False).order_by("date")[albums.count() // 2]
+    photo = album.photo_set.all()[0]
+    urls = [
+        reverse("gallery:index"),
+        reverse("gallery:index") + "?q=album",
+        reverse("gallery:year", args=[album.date.year]),
+        reverse("gallery:album", args=[album.pk]),
+        reverse("gallery:photo", args=[photo.pk]),
+    ]
+    if username == "user0":
+        urls += [
+            reverse("admin:gallery_album_changelist"),
+            reverse("admin:gallery_photo_changelist"),
+        ]
+    return urls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=1_000_000)
+    parser.add_argument("--regenerate", action="store_true")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gallery.benchmarks.settings")
+    django.setup()
+
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    from .fixtures import prepare_gallery
+
+    setup_test_environment()
+    prepare_gallery(args.photos, args.regenerate)
+
+    index_names = get_index_names()
+    for username in [None, "user1", "user0"]:
+        print(f"##### {username or 'anonymous'}")
+        print()
+        client = Client()
+        for url in get_sample_urls(client, username):
+            show_query_plans(client, url, index_names)
+
+
+if __name__ == "__main__":
+    main()
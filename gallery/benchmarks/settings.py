@@ -0,0 +1,38 @@
+import os
+
+from ..test_settings import *  # noqa
+
+# Benchmarks run against a persistent database because generating large
+# galleries takes time. Set GALLERY_BENCHMARK_DB_ENGINE and _NAME to run them
+# on another database, e.g. PostgreSQL.
+
+DATABASES = {
+    "default": {
+        "ENGINE": os.environ.get(
+            "GALLERY_BENCHMARK_DB_ENGINE", "django.db.backends.sqlite3"
+        ),
+        "NAME": os.environ.get(
+            "GALLERY_BENCHMARK_DB_NAME", BASE_DIR / "benchmark.sqlite3"  # noqa
+        ),
+    }
+}
+
+# Photo files for the synthetic gallery are stored in the filesystem, next to
+# the database. Resized versions and exports are created in a temporary cache.
+
+GALLERY_PHOTO_STORAGE = "gallery.benchmarks.storages.PhotoStorage"
+
+GALLERY_CACHE_STORAGE = "gallery.test_storages.MemoryStorage"
+
+GALLERY_PATTERNS = (
+    (
+        "Photos",
+        r"(?P<a_year>\d{4})/(?P<a_month>\d{2})_(?P<a_day>\d{2})_(?P<a_name>[^/]+)/"
+        r"(?P<p_year>\d{4})-(?P<p_month>\d{2})-(?P<p_day>\d{2})_"
+        r"(?P<p_hour>\d{2})-(?P<p_minute>\d{2})-(?P<p_second>\d{2})_\d+\.jpg",
+    ),
+)
+
+# Fail when views exceed their query budget on large galleries.
+
+GALLERY_QUERY_BUDGETS = True
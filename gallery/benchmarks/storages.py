@@ -0,0 +1,21 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+class PhotoStorage(FileSystemStorage):
+    """
+    Storage for the photo files of the synthetic gallery.
+
+    Set GALLERY_BENCHMARK_PHOTOS_DIR to store them in another directory.
+
+    """
+
+    def __init__(self):
+        super().__init__(
+            location=os.environ.get(
+                "GALLERY_BENCHMARK_PHOTOS_DIR",
+                settings.BASE_DIR / "benchmark-photos",
+            )
+        )
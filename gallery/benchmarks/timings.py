@@ -0,0 +1,277 @@
+"""
+Time the main operations of the gallery and write results to a JSON file.
+
+Usage: python -m gallery.benchmarks.timings [--photos N] [--skewed] [--regenerate]
+           [--repeat N] [--output FILE] [--compare FILE]
+           [--latency SECONDS] [--bandwidth BYTES_PER_SECOND]
+
+The first run generates a synthetic gallery with photo files, which takes a
+few minutes with the default of one hundred thousand photos.
+
+Compare results across commits with --compare, passing the output of a
+previous run.
+
+Simulate a remote photo storage with --latency and --bandwidth.
+
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import django
+
+
+def measure(func, repeat):
+    """
+    Call ``func`` ``repeat`` times and return a summary of durations.
+
+    """
+    durations = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - t)
+    return {
+        "runs": repeat,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+        "max": max(durations),
+    }
+
+
+def benchmark(results, name, func, repeat):
+    results[name] = measure(func, repeat)
+    print(f"{name:<60} {results[name]['median']:10.4f}s")
+
+
+def scanphotos(*args):
+    from django.core.management import call_command
+
+    call_command("scanphotos", *args, verbosity=0, stdout=io.StringIO())
+
+
+def benchmark_scan(results, repeat):
+    from django.db import transaction
+
+    from ..models import Album
+    from ..storages import get_storage
+    from .fixtures import get_album_dirpath, get_photo_filename, make_jpeg
+
+    benchmark(results, "scanphotos --full", lambda: scanphotos("--full"), repeat)
+    benchmark(results, "scanphotos, no changes", scanphotos, repeat)
+
+    # Add one percent of photos in new albums, then roll back the scan.
+    storage = get_storage("photo")
+    image = make_jpeg(32, 24)
+    date = datetime.datetime(2000, 1, 1)
+    new_photos = max(1, Album.objects.count() // 100) * 100
+    names = [
+        os.path.join(
+            get_album_dirpath(date.date(), f"New {index // 100}"),
+            get_photo_filename(date, index),
+        )
+        for index in range(new_photos)
+    ]
+    for index, name in enumerate(names):
+        storage.save(name, io.BytesIO(image + f"new{index}".encode()))
+
+    def scan_and_roll_back():
+        with transaction.atomic():
+            scanphotos()
+            transaction.set_rollback(True)
+
+    try:
+        benchmark(
+            results,
+            f"scanphotos, {new_photos} new photos",
+            scan_and_roll_back,
+            repeat,
+        )
+    finally:
+        for name in names:
+            storage.delete(name)
+        # The storage may be simulated and not provide path().
+        for index in range(0, new_photos, 100):
+            os.rmdir(os.path.join(storage.location, os.path.dirname(names[index])))
+        # Photos of the synthetic gallery are more recent.
+        os.rmdir(os.path.join(storage.location, f"{date:%Y}"))
+
+
+def benchmark_views(results, repeat):
+    from django.test import Client
+
+    from .queryplans import get_sample_urls
+
+    # URLs depend on the synthetic gallery; name results after pages instead.
+    pages = [
+        "index",
+        "search",
+        "year",
+        "album",
+        "photo",
+        "admin albums",
+        "admin photos",
+    ]
+    for username in [None, "user1", "user0"]:
+        client = Client()
+        for page, url in zip(pages, get_sample_urls(client, username)):
+
+            def get():
+                response = client.get(url)
+                assert response.status_code == 200, f"{url} returned {response}"
+
+            get()  # warm up caches
+            name = f"{page} page as {username or 'anonymous'}"
+            benchmark(results, name, get, repeat)
+
+
+def benchmark_export(results, repeat):
+    from django.contrib.auth.models import User
+    from django.db.models import Count
+    from django.test import Client, override_settings
+    from django.urls import reverse
+
+    from ..models import Album
+    from ..test_storages import MemoryStorage
+
+    client = Client()
+    client.force_login(User.objects.get(username="user0"))
+    albums = Album.objects.annotate(photos=Count("photo")).order_by("photos")
+    album_count = albums.count()
+    for label, album in [
+        ("median", albums[album_count // 2]),
+        ("largest", albums[album_count - 1]),
+    ]:
+        url = reverse("gallery:album-export", args=[album.pk])
+        for mode in ["stream", "build"]:
+
+            def export():
+                # Use an empty cache storage to build the archive every time.
+                with override_settings(
+                    GALLERY_EXPORT_MODE=mode, GALLERY_CACHE_STORAGE=MemoryStorage()
+                ):
+                    response = client.get(url)
+                    if response.streaming:
+                        for _ in response.streaming_content:
+                            pass
+                assert response.status_code in (200, 302), f"{url} returned {response}"
+
+            name = f"export {label} album ({album.photos} photos), {mode} mode"
+            benchmark(results, name, export, repeat)
+
+
+def benchmark_resize(results, repeat):
+    from ..resizers.pillow import make_thumbnail
+    from ..test_storages import MemoryStorage
+    from .fixtures import make_jpeg
+
+    image_storage = MemoryStorage()
+    image_storage.save("original.jpg", io.BytesIO(make_jpeg(3000, 2000)))
+    for width, height, crop in [(128, 128, True), (1280, 1280, False)]:
+
+        def resize():
+            make_thumbnail(
+                "original.jpg",
+                "resized.jpg",
+                width,
+                height,
+                crop,
+                image_storage,
+                MemoryStorage(),
+            )
+
+        name = f"resize 3000x2000 to {width}x{height}{', cropped' if crop else ''}"
+        benchmark(results, name, resize, repeat)
+
+
+def get_environment(args):
+    from django.db import connection
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL,
+        )
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "photos": args.photos,
+        "skewed": args.skewed,
+        "repeat": args.repeat,
+        "latency": args.latency,
+        "bandwidth": args.bandwidth,
+    }
+
+
+def compare(results, previous):
+    print()
+    print(f"{'':<60} {'before':>10} {'after':>10} {'ratio':>7}")
+    for name, result in results.items():
+        if name not in previous:
+            continue
+        before, after = previous[name]["median"], result["median"]
+        print(f"{name:<60} {before:10.4f} {after:10.4f} {after / before:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=100_000)
+    parser.add_argument("--skewed", action="store_true")
+    parser.add_argument("--regenerate", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--bandwidth", type=int)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gallery.benchmarks.settings")
+    django.setup()
+
+    from django.test.utils import override_settings, setup_test_environment
+
+    from ..storages import get_storage
+    from ..test_storages import SimulatedStorage
+    from .fixtures import prepare_gallery
+
+    setup_test_environment()
+    prepare_gallery(args.photos, args.regenerate, args.skewed, files=True)
+
+    if args.latency or args.bandwidth:
+        photo_storage = SimulatedStorage(
+            get_storage("photo"), latency=args.latency, bandwidth=args.bandwidth
+        )
+        override_settings(GALLERY_PHOTO_STORAGE=photo_storage).enable()
+
+    results = {}
+    benchmark_scan(results, args.repeat)
+    benchmark_views(results, args.repeat)
+    benchmark_export(results, args.repeat)
+    benchmark_resize(results, args.repeat)
+
+    with open(args.output, "w") as output:
+        json.dump({"environment": get_environment(args), "results": results}, output)
+    print(f"Results written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import cc_delim_re
+from django.utils.translation import get_language
+
+from .models import AlbumAccessPolicy, PhotoAccessPolicy
+
+GENERATION_KEY = "gallery:generation"
+
+
+def get_cache():
+    return caches[getattr(settings, "GALLERY_CACHE_ALIAS", "default")]
+
+
+def get_generation():
+    """
+    Return the current generation of the gallery.
+
+    The generation changes whenever the contents of the gallery or access
+    policies change. It's a timestamp in microseconds, so it never goes back
+    to a previous value, even if the cache loses it.
+
+    """
+    generation = get_cache().get(GENERATION_KEY)
+    if generation is None:
+        generation = bump_generation()
+    return generation
+
+
+def bump_generation():
+    generation = int(time.time() * 1_000_000)
+    get_cache().set(GENERATION_KEY, generation, None)
+    return generation
+
+
+def bump_generation_on_commit():
+    # Bumping before the transaction commits would allow concurrent requests
+    # to cache pages built from the previous state with the new generation.
+    transaction.on_commit(bump_generation)
+
+
+def get_scope(user, can_view_all, show_public):
+    """
+    Return a string identifying what ``user`` is allowed to see.
+
+    Users with the same scope see the same albums and photos.
+
+    """
+    if can_view_all:
+        return "all"
+    if not user.is_authenticated:
+        return "anonymous"
+    cache = get_cache()
+    key = f"gallery:scope:{get_generation()}:{user.pk}"
+    scope = cache.get(key)
+    if scope is None:
+        has_user_grants = (
+            AlbumAccessPolicy.users.through.objects.filter(user=user).exists()
+            or PhotoAccessPolicy.users.through.objects.filter(user=user).exists()
+        )
+        if has_user_grants:
+            scope = f"user:{user.pk}"
+        else:
+            group_pks = sorted(user.groups.values_list("pk", flat=True))
+            scope = "groups:" + ",".join(str(pk) for pk in group_pks)
+        cache.set(key, scope)
+    if show_public:
+        scope += ":public"
+    return scope
+
+
+def get_etag(request, scope, *extra):
+    """
+    Return an ETag for a page.
+
+    It depends on the generation of the gallery, the visibility scope, the
+    URL, the language, and any ``extra`` values influencing the response.
+    Computing it doesn't require querying the database, except the first
+    time ``get_scope`` runs for a user in a given generation.
+
+    There's no Last-Modified timestamp: it couldn't depend on the scope, so
+    clients would get 304 responses after their access changed.
+
+    """
+    generation = get_generation()
+    hsh = hashlib.md5()
+    for value in (generation, scope, request.get_full_path(), get_language()):
+        hsh.update(str(value).encode() + b"\0")
+    for value in extra:
+        hsh.update(str(value).encode() + b"\0")
+    return f'"{hsh.hexdigest()}"'
+
+
+def get_page_cache_key(etag):
+    version = etag.strip('"')
+    return f"gallery:page:{version}"
+
+
+# The ETag, hence the cache key, accounts for the user and the language.
+SHARED_VARY_HEADERS = {"accept-language", "cookie"}
+
+
+def is_page_cacheable(request, response):
+    """
+    Tell whether ``response`` can be shared by all users of its scope.
+
+    Like Django's cache middleware, don't cache responses setting cookies or
+    varying on other headers. Also don't cache responses containing a CSRF
+    token, which is specific to the user.
+
+    """
+    if response.status_code != 200 or response.cookies:
+        return False
+    # Django < 4.0 sets CSRF_COOKIE_USED.
+    if request.META.get("CSRF_COOKIE_NEEDS_UPDATE") or request.META.get(
+        "CSRF_COOKIE_USED"
+    ):
+        return False
+    vary = {
+        header.strip().lower() for header in cc_delim_re.split(response.get("Vary", ""))
+    }
+    return vary <= SHARED_VARY_HEADERS | {""}
+
+
+@receiver(post_save, sender=AlbumAccessPolicy)
+@receiver(post_save, sender=PhotoAccessPolicy)
+@receiver(post_delete, sender=AlbumAccessPolicy)
+@receiver(post_delete, sender=PhotoAccessPolicy)
+@receiver(m2m_changed, sender=AlbumAccessPolicy.groups.through)
+@receiver(m2m_changed, sender=AlbumAccessPolicy.users.through)
+@receiver(m2m_changed, sender=PhotoAccessPolicy.groups.through)
+@receiver(m2m_changed, sender=PhotoAccessPolicy.users.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_on_access_change(**kwargs):
+    if kwargs.get("action", "post_").startswith("post_"):
+        bump_generation_on_commit()
@@ -0,0 +1,515 @@
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+import zipfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .background import get_executor
+from .caching import get_cache
+from .metrics import EXPORT_BYTES, EXPORT_SECONDS
+from .storages import get_local_path, read_mapped
+
+logger = logging.getLogger(__name__)
+
+# Size of chunks read from the photo storage when streaming archives.
+CHUNK_SIZE = 1024 * 1024
+
+# Maximum size of photos prefetched but not written to archives yet.
+PREFETCH_MEMORY = 256 * 1024 * 1024
+
+
+def get_snapshot(album, photos):
+    """
+    Return (pk, filename, image_name) 3-uples for ``photos`` of ``album``.
+
+    ``photos`` is evaluated once, so the archive matches its name even if
+    photos are added or removed concurrently.
+
+    """
+    return [
+        (pk, filename, os.path.join(album.dirpath, filename))
+        for pk, filename in photos.values_list("pk", "filename")
+    ]
+
+
+def get_export_name(album_pk, snapshot, preset=None):
+    """
+    Return the name of the archive for ``snapshot`` in the cache storage.
+
+    """
+    hsh = hashlib.md5()
+    hsh.update(str(settings.SECRET_KEY).encode())
+    hsh.update(str(album_pk).encode())
+    for pk, _, _ in snapshot:
+        hsh.update(str(pk).encode())
+    if preset is not None:
+        hsh.update(str(settings.GALLERY_RESIZE_PRESETS[preset]).encode())
+    return os.path.join("export", hsh.hexdigest() + ".zip")
+
+
+def get_manifest_name(album_pk, preset=None):
+    """
+    Return the name of the manifest of the latest archive of an album.
+
+    """
+    hsh = hashlib.md5()
+    hsh.update(str(settings.SECRET_KEY).encode())
+    hsh.update(b"manifest")
+    hsh.update(str(album_pk).encode())
+    hsh.update(str(preset).encode())
+    return os.path.join("export", hsh.hexdigest() + ".json")
+
+
+def get_entries(snapshot):
+    """
+    Return (name in archive, name in photo storage) 2-uples for ``snapshot``.
+
+    """
+    return [(filename, image_name) for _, filename, image_name in snapshot]
+
+
+def select_photos(photos, album_pks=None, start=None, end=None):
+    """
+    Filter ``photos`` for exporting several albums at once.
+
+    ``album_pks`` restricts the export to a list of albums. ``start`` and
+    ``end`` restrict it to albums whose date is in this range, inclusive.
+
+    """
+    if album_pks is not None:
+        photos = photos.filter(album__in=album_pks)
+    if start is not None:
+        photos = photos.filter(album__date__gte=start)
+    if end is not None:
+        photos = photos.filter(album__date__lte=end)
+    return photos.select_related("album").order_by(
+        "album__date",
+        "album__name",
+        "album__dirpath",
+        "album__category",
+        "date",
+        "filename",
+    )
+
+
+def iter_selection_entries(photos, chunk_size=2000):
+    """
+    Yield (name in archive, name in photo storage) 2-uples for ``photos``.
+
+    Each album gets a folder in the archive, matching its directory in the
+    photo storage. The query is evaluated in chunks of ``chunk_size`` photos.
+
+    """
+    for photo in photos.iterator(chunk_size=chunk_size):
+        image_name = photo.image_name
+        yield image_name, image_name
+
+
+def prefetch(storage, names, workers, memory_budget=PREFETCH_MEMORY):
+    """
+    Yield the contents of files ``names`` from ``storage``, in order.
+
+    Up to ``workers`` files are read concurrently. When files read ahead of
+    the consumer take more than ``memory_budget`` bytes, reading pauses.
+
+    """
+    names = iter(names)
+    pending = collections.deque()
+
+    def buffered():
+        return sum(
+            len(future.result())
+            for future in pending
+            if future.done() and future.exception() is None
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        while True:
+            while len(pending) < workers and buffered() < memory_budget:
+                try:
+                    name = next(names)
+                except StopIteration:
+                    break
+                pending.append(executor.submit(read_mapped, storage, name))
+            if not pending:
+                break
+            yield pending.popleft().result()
+
+
+def iter_photos(entries, image_storage):
+    """
+    Yield (name in archive, contents) 2-uples for ``entries``.
+
+    Photos are prefetched when GALLERY_EXPORT_PREFETCH is greater than 1.
+
+    """
+    workers = getattr(settings, "GALLERY_EXPORT_PREFETCH", 1)
+    if workers > 1:
+        # entries may be an iterator; don't consume it ahead of prefetching.
+        entries, image_entries = itertools.tee(entries)
+        image_names = (image_name for _, image_name in image_entries)
+        contents = prefetch(image_storage, image_names, workers)
+        for (name, _), data in zip(entries, contents):
+            yield name, data
+    else:
+        for name, image_name in entries:
+            yield name, read_mapped(image_storage, image_name)
+
+
+def iter_photo_chunks(entries, image_storage):
+    """
+    Yield (name in archive, iterator of chunks) 2-uples for ``entries``.
+
+    Chunks of each photo must be consumed before moving to the next photo.
+
+    Photos stored locally are memory-mapped and chunks are slices of the
+    mapping, avoiding a copy.
+
+    """
+    if getattr(settings, "GALLERY_EXPORT_PREFETCH", 1) > 1:
+        for name, data in iter_photos(entries, image_storage):
+            yield name, iter_slices(data)
+    else:
+        for name, image_name in entries:
+            if get_local_path(image_storage, image_name) is not None:
+                yield name, iter_slices(read_mapped(image_storage, image_name))
+            else:
+                with image_storage.open(image_name) as source:
+                    chunks = iter(functools.partial(source.read, CHUNK_SIZE), b"")
+                    yield name, chunks
+
+
+def iter_slices(data):
+    view = memoryview(data)
+    return (
+        view[start : start + CHUNK_SIZE] for start in range(0, len(view), CHUNK_SIZE)
+    )
+
+
+def get_resized_photos(album, snapshot):
+    """
+    Return ``Photo`` instances for ``snapshot``, with their content hashes.
+
+    Resized names depend on content hashes, which aren't in the snapshot. Call
+    this in the request, so background jobs don't query the database.
+
+    """
+    from .models import Photo
+
+    content_hashes = dict(
+        Photo.objects.filter(pk__in=[pk for pk, _, _ in snapshot]).values_list(
+            "pk", "content_hash"
+        )
+    )
+    return [
+        Photo(
+            pk=pk,
+            album=album,
+            filename=filename,
+            content_hash=content_hashes.get(pk, ""),
+        )
+        for pk, filename, _ in snapshot
+    ]
+
+
+def get_resized_entries(photos, preset):
+    """
+    Return (name in archive, name in cache storage) 2-uples for ``photos``.
+
+    ``photos`` are returned by ``get_resized_photos``. Resized versions of
+    photos are created with Pillow when they don't exist in the cache storage
+    yet. Up to GALLERY_EXPORT_RESIZE_WORKERS photos are resized concurrently.
+
+    """
+    from .resizers.pillow import make_resized
+
+    width, height, crop = settings.GALLERY_RESIZE_PRESETS[preset]
+    workers = getattr(settings, "GALLERY_EXPORT_RESIZE_WORKERS", 4)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        resized_names = executor.map(
+            lambda photo: make_resized(photo, width, height, crop), photos
+        )
+        return [
+            (photo.filename, resized_name)
+            for photo, resized_name in zip(photos, resized_names)
+        ]
+
+
+def build_archive(
+    fileobj, entries, image_storage, progress=None, previous=None, reusable=()
+):
+    """
+    Write a zip archive containing ``entries`` to ``fileobj``.
+
+    If ``progress`` is provided, it's called with the size of each photo
+    after adding it to the archive.
+
+    Entries whose name is in ``reusable`` are copied from the ``previous``
+    archive, a ``ZipFile``, instead of being read from ``image_storage``.
+
+    """
+    new_entries = [entry for entry in entries if entry[0] not in reusable]
+    photos = iter_photos(new_entries, image_storage)
+    with zipfile.ZipFile(fileobj, "w") as archive:
+        for name, _ in entries:
+            if name in reusable:
+                data = previous.read(name)
+            else:
+                _, data = next(photos)
+            archive.writestr(name, data)
+            if progress is not None:
+                progress(len(data))
+
+
+def read_manifest(storage, manifest_name):
+    """
+    Return the manifest saved as ``manifest_name`` in ``storage``, or ``None``.
+
+    A manifest is a dictionary with the following keys: ``zip_name`` — the
+    name of the archive in ``storage`` — and ``entries`` — the entries of the
+    archive, as lists of two items.
+
+    """
+    if not storage.exists(manifest_name):
+        return None
+    with storage.open(manifest_name) as manifest_file:
+        return json.loads(manifest_file.read())
+
+
+def write_manifest(storage, manifest_name, zip_name, entries):
+    manifest = {"zip_name": zip_name, "entries": [list(entry) for entry in entries]}
+    if storage.exists(manifest_name):
+        storage.delete(manifest_name)
+    storage.save(manifest_name, ContentFile(json.dumps(manifest).encode()))
+
+
+def save_archive(
+    zip_name, entries, image_storage, zip_storage, manifest_name=None, progress=None
+):
+    """
+    Build the archive ``zip_name`` and save it to ``zip_storage``.
+
+    When ``manifest_name`` is provided, photos that didn't change since the
+    archive described by this manifest are copied from it, and the manifest
+    is updated to describe the new archive.
+
+    """
+    manifest = None
+    if manifest_name is not None:
+        manifest = read_manifest(zip_storage, manifest_name)
+    reusable = set()
+    if manifest is not None and zip_storage.exists(manifest["zip_name"]):
+        previous_entries = {tuple(entry) for entry in manifest["entries"]}
+        reusable = {
+            name
+            for name, image_name in entries
+            if (name, image_name) in previous_entries
+        }
+
+    with contextlib.ExitStack() as stack:
+        previous = None
+        if reusable:
+            previous_zip = stack.enter_context(zip_storage.open(manifest["zip_name"]))
+            previous = stack.enter_context(zipfile.ZipFile(previous_zip))
+        # Create the archive in a temporary file to avoid holding it in memory
+        temp_zip = stack.enter_context(tempfile.TemporaryFile(suffix=".zip"))
+        with EXPORT_SECONDS.time(mode="build"):
+            build_archive(
+                temp_zip, entries, image_storage, progress, previous, reusable
+            )
+        EXPORT_BYTES.observe(temp_zip.tell(), mode="build")
+        temp_zip.seek(0)
+        if not zip_storage.exists(zip_name):
+            zip_storage.save(zip_name, temp_zip)
+
+    if manifest_name is not None:
+        write_manifest(zip_storage, manifest_name, zip_name, entries)
+
+
+class StreamBuffer:
+    """
+    File-like object collecting the output of ``ZipFile`` for streaming.
+
+    Since it isn't seekable, ``ZipFile`` writes sizes and checksums after the
+    data of each entry rather than seeking back to the header.
+
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_archive(entries, image_storage):
+    """
+    Yield chunks of a zip archive containing ``entries``.
+
+    Photos are read chunk by chunk and stored without compression, so memory
+    usage doesn't depend on the size of photos or of the archive. When they
+    are prefetched, memory usage is bounded by the prefetch budget.
+
+    """
+    start = time.perf_counter()
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for name, chunks in iter_photo_chunks(entries, image_storage):
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            with archive.open(info, "w") as target:
+                for chunk in chunks:
+                    target.write(chunk)
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
+    # This includes time spent by the client reading the archive.
+    EXPORT_SECONDS.observe(time.perf_counter() - start, mode="stream")
+    EXPORT_BYTES.observe(buffer.tell(), mode="stream")
+
+
+def tee_to_storage(chunks, storage, name):
+    """
+    Yield ``chunks`` and save them to ``storage`` as ``name`` when complete.
+
+    """
+    with tempfile.TemporaryFile(suffix=".zip") as temp_zip:
+        for chunk in chunks:
+            temp_zip.write(chunk)
+            yield chunk
+        temp_zip.seek(0)
+        if not storage.exists(name):
+            storage.save(name, temp_zip)
+
+
+# Background jobs store their state in the cache so that every process can
+# report their progress. If a job doesn't make progress for this duration,
+# for example because its process died, it's considered abandoned and a new
+# request starts it again.
+JOB_TIMEOUT = 600
+
+
+def get_job_id(zip_name):
+    return os.path.splitext(os.path.basename(zip_name))[0]
+
+
+def get_job_zip_name(job_id):
+    return os.path.join("export", job_id + ".zip")
+
+
+def get_job_key(job_id):
+    return f"gallery:export:{job_id}"
+
+
+def get_job(job_id):
+    """
+    Return the state of a background export job, or ``None``.
+
+    The state is a dictionary with the following keys: ``status`` — one of
+    ``"running"``, ``"done"``, or ``"failed"`` — ``files_done``,
+    ``files_total``, ``bytes_done``, and ``attempt``, which counts restarts.
+    ``files_total`` is ``None`` until the job prepares its entries.
+
+    """
+    return get_cache().get(get_job_key(job_id))
+
+
+def start_job(zip_name, entries, image_storage, zip_storage, manifest_name=None):
+    """
+    Build the archive ``zip_name`` in the background, unless it's in progress.
+
+    ``entries`` may be a callable returning entries, in order to prepare them
+    in the background too, for example when creating resized versions.
+
+    Return the identifier of the job.
+
+    """
+    cache = get_cache()
+    job_id = get_job_id(zip_name)
+    key = get_job_key(job_id)
+    previous_state = cache.get(key)
+    state = {
+        "status": "running",
+        "files_done": 0,
+        "files_total": None if callable(entries) else len(entries),
+        "bytes_done": 0,
+        "attempt": 0,
+    }
+    if previous_state is None:
+        started = cache.add(key, state, JOB_TIMEOUT)
+    elif previous_state["status"] == "running":
+        started = False
+    else:
+        # Restart failed jobs and jobs whose archive was removed from the
+        # cache. The cache has no compare-and-swap operation. Instead, only
+        # the request that adds the restart key of the finished attempt
+        # replaces its state, so concurrent requests don't start two jobs.
+        attempt = previous_state.get("attempt", 0)
+        started = cache.add(f"{key}:restart:{attempt}", True, JOB_TIMEOUT)
+        if started:
+            state["attempt"] = attempt + 1
+            cache.set(key, state, JOB_TIMEOUT)
+    if started:
+        max_workers = getattr(settings, "GALLERY_EXPORT_WORKERS", 2)
+        executor = get_executor("export", max_workers)
+        executor.submit(
+            run_job,
+            job_id,
+            state,
+            zip_name,
+            entries,
+            image_storage,
+            zip_storage,
+            manifest_name,
+        )
+    return job_id
+
+
+def run_job(
+    job_id, state, zip_name, entries, image_storage, zip_storage, manifest_name=None
+):
+    cache = get_cache()
+    key = get_job_key(job_id)
+
+    def progress(size):
+        state["files_done"] += 1
+        state["bytes_done"] += size
+        cache.set(key, state, JOB_TIMEOUT)
+
+    try:
+        if callable(entries):
+            entries = entries()
+            state["files_total"] = len(entries)
+            cache.set(key, state, JOB_TIMEOUT)
+        save_archive(
+            zip_name, entries, image_storage, zip_storage, manifest_name, progress
+        )
+    except Exception:
+        logger.exception("Failed to export %s", zip_name)
+        state["status"] = "failed"
+    else:
+        state["status"] = "done"
+    cache.set(key, state, JOB_TIMEOUT)
@@ -0,0 +1,89 @@
+import datetime
+import time
+
+from django.contrib.auth.models import User
+from django.core.management import base
+from django.utils.dateparse import parse_date
+
+from ...exports import iter_selection_entries, select_photos, stream_archive
+from ...models import Photo
+from ...storages import get_storage
+
+
+def date(value):
+    result = parse_date(value)
+    if result is None:
+        raise ValueError(f"Invalid date: {value}")
+    return result
+
+
+class Command(base.BaseCommand):
+    help = "Export photos from several albums to a zip archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the zip archive")
+        parser.add_argument(
+            "--album",
+            action="append",
+            type=int,
+            dest="album_pks",
+            help="Export this album (may be repeated)",
+        )
+        parser.add_argument("--year", type=int, help="Export albums from this year")
+        parser.add_argument(
+            "--start", type=date, help="Export albums from this date (YYYY-MM-DD)"
+        )
+        parser.add_argument(
+            "--end", type=date, help="Export albums until this date (YYYY-MM-DD)"
+        )
+        parser.add_argument(
+            "--user",
+            help="Export only photos this user can see (default: all photos)",
+        )
+
+    def handle(self, **options):
+        self.verbosity = int(options["verbosity"])
+
+        start, end = options["start"], options["end"]
+        if options["year"] is not None:
+            try:
+                start = datetime.date(options["year"], 1, 1)
+                end = datetime.date(options["year"], 12, 31)
+            except (OverflowError, ValueError):
+                raise base.CommandError(
+                    f"Invalid year: {options['year']} "
+                    f"(must be between {datetime.MINYEAR} and {datetime.MAXYEAR})"
+                )
+        if options["album_pks"] is None and start is None and end is None:
+            raise base.CommandError("Select albums with --album, --year, or dates.")
+
+        if options["user"] is None:
+            photos = Photo.objects.all()
+        else:
+            try:
+                user = User.objects.get_by_natural_key(options["user"])
+            except User.DoesNotExist:
+                raise base.CommandError(f"Unknown user: {options['user']}")
+            photos = Photo.objects.allowed_for_user(user)
+        photos = select_photos(photos, options["album_pks"], start, end)
+
+        t = time.time()
+
+        with open(options["output"], "wb") as output:
+            entries = iter_selection_entries(photos)
+            for chunk in stream_archive(
+                self.log_entries(entries), get_storage("photo")
+            ):
+                output.write(chunk)
+
+        dt = time.time() - t
+        self.write_out(f"Done ({dt:02f}s)", verbosity=1)
+
+    def log_entries(self, entries):
+        for name, image_name in entries:
+            self.write_out(f"Adding {name}", verbosity=2)
+            yield name, image_name
+
+    def write_out(self, message, verbosity):
+        if self.verbosity >= verbosity:
+            self.stdout.write(message + "\n")
@@ -1,5 +1,8 @@
 import collections
+import concurrent.futures
 import datetime
+import hashlib
+import itertools
 import os
 import re
 import time
@@ -10,8 +13,11 @@ from django.core.management import base
 from django.db import transaction
 from django.utils import timezone
 
-from ...models import Album, Photo
-from ...storages import get_storage
+from ...caching import bump_generation_on_commit
+from ...metrics import SCAN_SECONDS
+from ...models import Album, Photo, PhotoDateSummary
+from ...search import get_search_backend
+from ...storages import get_storage, read_mapped
 
 
 class Command(base.BaseCommand):
@@ -34,13 +40,30 @@ class Command(base.BaseCommand):
         t = time.time()
 
         self.write_out("Scanning photos...", verbosity=1)
-        albums = scan_photo_storage(self)
+        with SCAN_SECONDS.time(phase="scan"):
+            albums = scan_photo_storage(self)
 
         self.write_out("Synchronizing albums...", verbosity=1)
-        synchronize_albums(albums, self)
+        with SCAN_SECONDS.time(phase="albums"):
+            synchronize_albums(albums, self)
 
         self.write_out("Synchronizing photos...", verbosity=1)
-        synchronize_photos(albums, self)
+        with SCAN_SECONDS.time(phase="photos"):
+            synchronize_photos(albums, self)
+
+        self.write_out("Hashing photos...", verbosity=1)
+        with SCAN_SECONDS.time(phase="hash"):
+            hash_photos(self)
+
+        self.write_out("Updating search index...", verbosity=1)
+        with SCAN_SECONDS.time(phase="search"):
+            get_search_backend().rebuild()
+
+        self.write_out("Counting photos...", verbosity=1)
+        with SCAN_SECONDS.time(phase="count"):
+            PhotoDateSummary.objects.refresh()
+
+        bump_generation_on_commit()
 
         dt = time.time() - t
         self.write_out(f"Done ({dt:02f}s)", verbosity=1)
@@ -233,3 +256,48 @@ def synchronize_photos(albums, command):
                 )
                 photo.date = date
                 photo.save()
+
+
+def get_content_hash(storage, name):
+    return hashlib.sha256(read_mapped(storage, name)).hexdigest()
+
+
+def hash_photos(command, batch_size=1000):
+    """
+    Store the hash of the contents of photos in the database.
+
+    Only photos without a hash are hashed, unless ``command.full_sync`` is
+    set. Up to GALLERY_SCAN_WORKERS photos are hashed concurrently.
+
+    """
+    photo_storage = get_storage("photo")
+    photos = Photo.objects.select_related("album").only(
+        "album__dirpath", "filename", "content_hash"
+    )
+    pending = photos if command.full_sync else photos.filter(content_hash="")
+    # Fetch pks before updating hashes, because updating rows of a queryset
+    # while iterating over it is unsafe, notably on SQLite.
+    pks = iter(list(pending.order_by("pk").values_list("pk", flat=True)))
+
+    def hash_photo(photo):
+        # Storage backends raise various exceptions for missing or unreadable
+        # files. Don't let one photo abort hashing the others.
+        try:
+            return get_content_hash(photo_storage, photo.image_name)
+        except Exception as exc:
+            command.write_err(f"Failed to hash {photo.image_name}: {exc}", verbosity=1)
+
+    workers = getattr(settings, "GALLERY_SCAN_WORKERS", 4)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        while True:
+            batch_pks = list(itertools.islice(pks, batch_size))
+            if not batch_pks:
+                break
+            batch = list(photos.filter(pk__in=batch_pks).order_by("pk"))
+            changed = []
+            for photo, content_hash in zip(batch, executor.map(hash_photo, batch)):
+                if content_hash is not None and content_hash != photo.content_hash:
+                    photo.content_hash = content_hash
+                    changed.append(photo)
+            Photo.objects.bulk_update(changed, ["content_hash"])
+            command.write_out(f"Hashed {len(batch)} photos", verbosity=2)
@@ -0,0 +1,200 @@
+"""
+In-process metrics, exposed in the Prometheus text format.
+
+Metrics are recorded only when the GALLERY_METRICS setting is ``True``. Each
+process has its own metrics.
+
+"""
+
+import bisect
+import contextlib
+import math
+import threading
+import time
+
+from django.conf import settings
+
+registry = []
+
+
+def is_enabled():
+    return getattr(settings, "GALLERY_METRICS", False)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", r"\\").replace('"', r"\"")
+        value = value.replace("\n", r"\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def get_key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            lines.extend(self.render_value(list(zip(self.labelnames, key)), value))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not is_enabled():
+            return
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.get_key(labels), 0)
+
+    def render_value(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {format_value(value)}"]
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        if not is_enabled():
+            return
+        key = self.get_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the block, in seconds.
+
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels):
+        counts, _ = self.values.get(self.get_key(labels), ((), 0))
+        return sum(counts)
+
+    def render_value(self, labels, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            bucket_labels = labels + [("le", format_value(bound))]
+            lines.append(
+                f"{self.name}_bucket{format_labels(bucket_labels)} {cumulative}"
+            )
+        lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+def render():
+    """
+    Return all metrics in the Prometheus text exposition format.
+
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+RESIZE_SECONDS = Histogram(
+    "gallery_resize_seconds",
+    "Time spent getting the URL of a resized photo.",
+    ["preset"],
+)
+
+RESIZE_CACHE_LOOKUPS = Counter(
+    "gallery_resize_cache_lookups_total",
+    "Lookups of resized photos in the cache storage.",
+    ["result"],
+)
+
+THUMBNAIL_SECONDS = Histogram(
+    "gallery_thumbnail_seconds",
+    "Time spent creating resized photos with Pillow.",
+    ["phase"],
+)
+
+STORAGE_SECONDS = Histogram(
+    "gallery_storage_seconds",
+    "Time spent in calls to storages.",
+    ["storage", "method"],
+)
+
+EXPORT_SECONDS = Histogram(
+    "gallery_export_seconds",
+    "Time spent building zip archives.",
+    ["mode"],
+)
+
+EXPORT_BYTES = Histogram(
+    "gallery_export_bytes",
+    "Size of zip archives.",
+    ["mode"],
+    buckets=[2**power for power in range(20, 40, 2)],
+)
+
+ACCESS_CONTROL_SECONDS = Histogram(
+    "gallery_access_control_seconds",
+    "Time spent in queries filtered by allowed_for_user.",
+    ["model"],
+)
+
+SCAN_SECONDS = Histogram(
+    "gallery_scan_seconds",
+    "Time spent in each phase of scanning photos.",
+    ["phase"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600),
+)
@@ -0,0 +1,145 @@
+import collections
+import contextlib
+import logging
+
+from django.conf import settings
+from django.db import connections
+
+from .profiling import Profile, is_enabled, should_profile
+
+logger = logging.getLogger(__name__)
+
+
+def query_budget(max_queries):
+    """
+    Declare the maximum number of SQL queries of a function-based view.
+
+    Class-based views declare it with a ``query_budget`` attribute and model
+    admins with a ``changelist_query_budget`` attribute.
+
+    Budgets allow about 25% more queries than the largest count measured on
+    the synthetic gallery of ``gallery.benchmarks``, and at least two more, so
+    that harmless changes don't exceed them while N+1 queries do.
+
+    """
+
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+
+    return decorator
+
+
+def get_query_budget(view_func):
+    model_admin = getattr(view_func, "model_admin", None)
+    if model_admin is not None:
+        if view_func.__name__ == "changelist_view":
+            return getattr(model_admin, "changelist_query_budget", None)
+        return None
+    view_class = getattr(view_func, "view_class", None)
+    return getattr(view_class or view_func, "query_budget", None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """
+    Execute wrapper recording SQL queries.
+
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def get_duplicates(self):
+        """
+        Return (count, SQL) 2-uples for queries executed more than once.
+
+        """
+        counts = collections.Counter(self.queries)
+        return [(count, sql) for sql, count in counts.most_common() if count > 1]
+
+
+class QueryBudgetMiddleware:
+    """
+    Check that views don't execute more SQL queries than their budget.
+
+    Queries executed by middleware placed after this one are counted too.
+
+    This is enabled when the GALLERY_QUERY_BUDGETS setting is ``True``, which
+    is its default value when ``DEBUG`` is ``True``.
+
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, "GALLERY_QUERY_BUDGETS", settings.DEBUG):
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+
+        budget = getattr(request, "query_budget", None)
+        if budget is not None and len(counter.queries) > budget:
+            message = (
+                f"{request.path} executed {len(counter.queries)} queries, "
+                f"exceeding its budget of {budget}."
+            )
+            duplicates = counter.get_duplicates()
+            if duplicates:
+                message += " Duplicate queries:"
+                for count, sql in duplicates[:10]:
+                    message += f"\n{count} × {sql}"
+            raise QueryBudgetExceeded(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func)
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sample of requests to views of the gallery.
+
+    This is enabled by the GALLERY_PROFILING_RATE and GALLERY_PROFILING_HEADER
+    settings. When they aren't set, it only checks them on each request.
+
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        profile = getattr(request, "gallery_profile", None)
+        if profile is not None:
+            profile.stop(response)
+            try:
+                profile.save()
+            except Exception:
+                logger.exception("Failed to save profile of %s", request.path)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not is_enabled() or request.resolver_match.app_name != "gallery":
+            return
+        if not should_profile(request):
+            return
+        profile = Profile(request)
+        try:
+            profile.start()
+        except ValueError:
+            # Another profiler is active.
+            return
+        request.gallery_profile = profile
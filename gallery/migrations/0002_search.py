@@ -0,0 +1,55 @@
+from django.db import DatabaseError, migrations, transaction
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            if ('ENABLE_FTS5',) not in cursor.fetchall():
+                return
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE gallery_search USING fts5("
+            "album_id UNINDEXED, photo_id UNINDEXED, text, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'unaccent'")
+            has_unaccent = cursor.fetchone() is not None
+        if not has_unaccent:
+            # Creating the extension requires privileges that the database
+            # user may not have. Search is accent-sensitive without it.
+            try:
+                with transaction.atomic(using=connection.alias):
+                    schema_editor.execute('CREATE EXTENSION unaccent')
+            except DatabaseError:
+                pass
+        schema_editor.execute(
+            'CREATE TABLE gallery_search ('
+            'album_id integer NOT NULL, photo_id integer NULL, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX gallery_search_album_id ON gallery_search (album_id)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX gallery_search_document '
+            'ON gallery_search USING gin (document)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS gallery_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.13 on 2026-10-19 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0002_search"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="album",
+            index=models.Index(
+                fields=["date", "name", "dirpath", "category"],
+                name="gallery_album_ordering",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="albumaccesspolicy",
+            index=models.Index(
+                fields=["album", "public", "inherit"], name="gallery_album_ap_lookup"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                fields=["album", "date", "filename"],
+                name="gallery_photo_album_ordering",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                fields=["date", "filename"], name="gallery_photo_ordering"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photoaccesspolicy",
+            index=models.Index(
+                fields=["photo", "public"], name="gallery_photo_ap_lookup"
+            ),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.13 on 2026-10-19 06:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0003_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PhotoDateSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("year", models.PositiveSmallIntegerField(null=True)),
+                ("month", models.PositiveSmallIntegerField(null=True)),
+                ("count", models.PositiveIntegerField()),
+            ],
+            options={
+                "verbose_name": "photo date summary",
+                "verbose_name_plural": "photo date summaries",
+                "ordering": ("year", "month"),
+                "unique_together": {("year", "month")},
+            },
+        ),
+    ]
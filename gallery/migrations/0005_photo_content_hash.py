@@ -0,0 +1,24 @@
+# Generated by Django 4.1.13 on 2026-10-19 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0004_photodatesummary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=64,
+                verbose_name="content hash",
+            ),
+        ),
+    ]
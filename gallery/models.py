@@ -1,12 +1,15 @@
 import os
+import time
 
 from django.conf import settings
 from django.contrib.auth.models import Group, User
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import ExtractMonth, ExtractYear
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
+from .metrics import ACCESS_CONTROL_SECONDS, RESIZE_SECONDS
 from .resizers import get_resize
 
 
@@ -29,7 +32,49 @@ class AccessPolicy(models.Model):
         return False
 
 
-class AlbumManager(models.Manager):
+class AccessControlQuerySet(models.QuerySet):
+    """
+    Record the duration of queries filtered by ``allowed_for_user`` in
+    metrics and profiles.
+
+    """
+
+    access_control_model = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone.access_control_model = self.access_control_model
+        return clone
+
+    def _fetch_all(self):
+        if self._result_cache is None and self.access_control_model is not None:
+            self._fetch_allowed()
+        super()._fetch_all()
+
+    def _fetch_allowed(self):
+        start = time.perf_counter()
+        # Like QuerySet._fetch_all, without prefetching related objects.
+        self._result_cache = list(self._iterable_class(self))
+        ACCESS_CONTROL_SECONDS.observe(
+            time.perf_counter() - start, model=self.access_control_model
+        )
+
+    def count(self):
+        if self._result_cache is not None or self.access_control_model is None:
+            return super().count()
+        return self._count_allowed()
+
+    def _count_allowed(self):
+        with ACCESS_CONTROL_SECONDS.time(model=self.access_control_model):
+            return super().count()
+
+    def with_access_control(self):
+        clone = self._chain()
+        clone.access_control_model = self.model._meta.model_name
+        return clone
+
+
+class AlbumManager(models.Manager.from_queryset(AccessControlQuerySet)):
     def allowed_for_user(self, user, include_public=True):
         album_cond = Q()
         if include_public:
@@ -37,7 +82,7 @@ class AlbumManager(models.Manager):
         if user.is_authenticated:
             album_cond |= Q(access_policy__users=user)
             album_cond |= Q(access_policy__groups__user=user)
-        return self.filter(album_cond).distinct()
+        return self.filter(album_cond).distinct().with_access_control()
 
 
 class Album(models.Model):
@@ -49,6 +94,12 @@ class Album(models.Model):
     objects = AlbumManager()
 
     class Meta:
+        indexes = [
+            models.Index(
+                fields=["date", "name", "dirpath", "category"],
+                name="gallery_album_ordering",
+            ),
+        ]
         ordering = ("date", "name", "dirpath", "category")
         unique_together = ("dirpath", "category")
         verbose_name = _("album")
@@ -112,6 +163,13 @@ class AlbumAccessPolicy(AccessPolicy):
     )
 
     class Meta:
+        indexes = [
+            # Covering index for joins in allowed_for_user.
+            models.Index(
+                fields=["album", "public", "inherit"],
+                name="gallery_album_ap_lookup",
+            ),
+        ]
         verbose_name = _("album access policy")
         verbose_name_plural = _("album access policies")
 
@@ -119,7 +177,7 @@ class AlbumAccessPolicy(AccessPolicy):
         return f"Access policy for {self.album}"
 
 
-class PhotoManager(models.Manager):
+class PhotoManager(models.Manager.from_queryset(AccessControlQuerySet)):
     def allowed_for_user(self, user):
         inherit = Q(access_policy__isnull=True, album__access_policy__inherit=True)
         photo_cond = Q(access_policy__public=True)
@@ -129,17 +187,33 @@ class PhotoManager(models.Manager):
             photo_cond |= Q(access_policy__groups__user=user)
             album_cond |= Q(album__access_policy__users=user)
             album_cond |= Q(album__access_policy__groups__user=user)
-        return self.filter(photo_cond | (inherit & album_cond)).distinct()
+        qs = self.filter(photo_cond | (inherit & album_cond)).distinct()
+        return qs.with_access_control()
 
 
 class Photo(models.Model):
     album = models.ForeignKey(Album, on_delete=models.CASCADE)
     filename = models.CharField(max_length=100, verbose_name="file name")
     date = models.DateTimeField(null=True, blank=True)
+    # Computed by the scanphotos management command. Blank until then.
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        db_index=True,
+        verbose_name="content hash",
+    )
 
     objects = PhotoManager()
 
     class Meta:
+        indexes = [
+            models.Index(
+                fields=["album", "date", "filename"],
+                name="gallery_photo_album_ordering",
+            ),
+            models.Index(fields=["date", "filename"], name="gallery_photo_ordering"),
+        ]
         ordering = ("date", "filename")
         permissions = (
             ("view", "Can see all photos"),
@@ -209,7 +283,8 @@ class Photo(models.Model):
     def resized_url(self, preset):
         resize = get_resize()
         width, height, crop = settings.GALLERY_RESIZE_PRESETS[preset]
-        return resize(self, width, height, crop)
+        with RESIZE_SECONDS.time(preset=preset):
+            return resize(self, width, height, crop)
 
 
 class PhotoAccessPolicy(AccessPolicy):
@@ -218,8 +293,51 @@ class PhotoAccessPolicy(AccessPolicy):
     )
 
     class Meta:
+        indexes = [
+            # Covering index for joins in allowed_for_user.
+            models.Index(fields=["photo", "public"], name="gallery_photo_ap_lookup"),
+        ]
         verbose_name = _("photo access policy")
         verbose_name_plural = _("photo access policies")
 
     def __str__(self):
         return f"Access policy for {self.photo}"
+
+
+class PhotoDateSummaryManager(models.Manager):
+    def refresh(self):
+        counts = (
+            Photo.objects.annotate(year=ExtractYear("date"), month=ExtractMonth("date"))
+            .values("year", "month")
+            .annotate(count=Count("pk"))
+            .order_by()
+        )
+        # Concurrent readers never see an empty or partial summary.
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            self.bulk_create(self.model(**row) for row in counts)
+
+
+class PhotoDateSummary(models.Model):
+    """
+    Number of photos for each month, maintained by ``scanphotos``.
+
+    Photos without a date are counted with a ``year`` and a ``month`` of
+    ``None``.
+
+    """
+
+    year = models.PositiveSmallIntegerField(null=True)
+    month = models.PositiveSmallIntegerField(null=True)
+    count = models.PositiveIntegerField()
+
+    objects = PhotoDateSummaryManager()
+
+    class Meta:
+        ordering = ("year", "month")
+        unique_together = ("year", "month")
+        verbose_name = _("photo date summary")
+        verbose_name_plural = _("photo date summaries")
+
+    def __str__(self):
+        return f"{self.year}-{self.month}: {self.count}"
@@ -0,0 +1,216 @@
+"""
+Profiling of a sample of gallery requests.
+
+When the GALLERY_PROFILING_RATE setting is positive, ``ProfilingMiddleware``
+profiles this fraction of requests. When GALLERY_PROFILING_HEADER is ``True``,
+it also profiles requests with a valid ``X-Gallery-Profile`` header.
+
+Profiles are saved to the storage defined by GALLERY_PROFILE_STORAGE, with a
+summary of the time spent in the main phases of the gallery. Only the
+GALLERY_PROFILING_RETENTION most recent profiles are kept.
+
+"""
+
+import cProfile
+import datetime
+import io
+import json
+import marshal
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+
+HEADER = "HTTP_X_GALLERY_PROFILE"
+
+TOKEN_MAX_AGE = 86400
+
+TOKEN_SALT = "gallery.profiling"
+
+
+def get_rate():
+    return getattr(settings, "GALLERY_PROFILING_RATE", 0)
+
+
+def accepts_header():
+    return getattr(settings, "GALLERY_PROFILING_HEADER", False)
+
+
+def get_retention():
+    return getattr(settings, "GALLERY_PROFILING_RETENTION", 1000)
+
+
+def is_enabled():
+    return bool(get_rate()) or accepts_header()
+
+
+def get_token():
+    """
+    Return a value of the ``X-Gallery-Profile`` header valid for one day.
+
+    """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign("profile")
+
+
+def has_valid_token(request):
+    token = request.META.get(HEADER)
+    if token is None:
+        return False
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def should_profile(request):
+    rate = get_rate()
+    if rate and random.random() < rate:
+        return True
+    return accepts_header() and has_valid_token(request)
+
+
+def get_phases():
+    """
+    Return functions in which the main phases of the gallery spend time.
+
+    """
+    from django.template.base import Template
+    from django.urls import reverse
+
+    from .models import AccessControlQuerySet
+    from .storages import InstrumentedStorage
+    from .views import AlbumListWithPreviewMixin
+
+    return {
+        "access control": [
+            AccessControlQuerySet._fetch_allowed,
+            AccessControlQuerySet._count_allowed,
+        ],
+        "previews": [AlbumListWithPreviewMixin.set_previews],
+        "url reversing": [reverse],
+        "templates": [Template.render],
+        "storage": [InstrumentedStorage.timed],
+    }
+
+
+def get_phase_durations(stats):
+    """
+    Sum the cumulative time of functions of each phase in ``stats``.
+
+    Phases may overlap, for example when templates reverse URLs.
+
+    """
+    durations = {}
+    for phase, functions in get_phases().items():
+        duration = 0
+        for function in functions:
+            code = function.__code__
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            if key in stats:
+                duration += stats[key][3]
+        durations[phase] = duration
+    return durations
+
+
+class Profile:
+    """
+    Profile of a request, from the view to the response.
+
+    Only the thread handling the request is profiled, not resizing photos in
+    the background.
+
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self, response):
+        self.profiler.disable()
+        self.duration = time.perf_counter() - self.start_time
+        self.profiler.create_stats()
+        self.response = response
+
+    def get_summary(self):
+        user = getattr(self.request, "user", None)
+        return {
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "method": self.request.method,
+            "path": self.request.get_full_path(),
+            "status": self.response.status_code,
+            "user": user.get_username() if user is not None else "",
+            "duration": self.duration,
+            "phases": get_phase_durations(self.profiler.stats),
+        }
+
+    def save(self):
+        """
+        Save the profile and its summary. Return the name of the profile.
+
+        The profile can be loaded with ``pstats.Stats``.
+
+        """
+        from .storages import get_storage
+
+        storage = get_storage("profile")
+        # Names sort chronologically regardless of the server's time zone.
+        now = datetime.datetime.now(datetime.timezone.utc)
+        name = f"{now:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        stats = marshal.dumps(self.profiler.stats)
+        storage.save(f"{name}.prof", io.BytesIO(stats))
+        summary = json.dumps(self.get_summary(), indent=2).encode()
+        storage.save(f"{name}.json", io.BytesIO(summary))
+        delete_old_profiles()
+        return name
+
+
+def get_profile_names(storage):
+    """
+    Return names of profiles in ``storage``, most recent first.
+
+    """
+    _, filenames = storage.listdir("")
+    return sorted(
+        (filename[:-5] for filename in filenames if filename.endswith(".json")),
+        reverse=True,
+    )
+
+
+def delete_old_profiles():
+    """
+    Delete profiles beyond the GALLERY_PROFILING_RETENTION most recent ones.
+
+    """
+    from .storages import get_storage
+
+    retention = get_retention()
+    if retention is None:
+        return
+    storage = get_storage("profile")
+    for name in get_profile_names(storage)[retention:]:
+        storage.delete(f"{name}.prof")
+        storage.delete(f"{name}.json")
+
+
+def list_profiles(limit=100):
+    """
+    Return summaries of the ``limit`` most recent profiles.
+
+    """
+    from .storages import get_storage
+
+    storage = get_storage("profile")
+    profiles = []
+    for name in get_profile_names(storage)[:limit]:
+        with storage.open(f"{name}.json") as file:
+            summary = json.loads(file.read())
+        summary["name"] = name
+        profiles.append(summary)
+    return profiles
@@ -1,31 +1,99 @@
 import hashlib
 import io
+import logging
 import os.path
+import threading
 
 from django.conf import settings
 from PIL import Image, ImageFile
 
-from ..storages import get_storage
+from ..background import get_executor
+from ..metrics import RESIZE_CACHE_LOOKUPS, THUMBNAIL_SECONDS
+from ..storages import get_local_path, get_storage
+
+logger = logging.getLogger(__name__)
 
 
 def resize(photo, width, height, crop=True):
+    resized_name = make_resized(photo, width, height, crop)
+    return get_storage("cache").url(resized_name)
+
+
+# Names of resized versions being created in the background by this process.
+pending_resized_names = set()
+pending_resized_names_lock = threading.Lock()
+
+
+def resize_nowait(photo, width, height, crop=True):
+    """
+    Return the URL of a resized version of a photo, or ``None``.
+
+    If the resized version doesn't exist, return ``None`` immediately and
+    create it in the background, unless this is already in progress.
+
+    """
+    resized_name = get_resized_name(photo, width, height, crop)
+    cache_storage = get_storage("cache")
+    if cache_storage.exists(resized_name):
+        RESIZE_CACHE_LOOKUPS.inc(result="hit")
+        return cache_storage.url(resized_name)
+    RESIZE_CACHE_LOOKUPS.inc(result="miss")
+    with pending_resized_names_lock:
+        if resized_name in pending_resized_names:
+            return None
+        pending_resized_names.add(resized_name)
+    max_workers = getattr(settings, "GALLERY_RESIZE_WORKERS", 2)
+    executor = get_executor("resize", max_workers)
+    executor.submit(make_resized_in_background, photo, width, height, crop)
+    return None
+
+
+resize.nowait = resize_nowait
+
+
+def make_resized_in_background(photo, width, height, crop):
+    resized_name = get_resized_name(photo, width, height, crop)
+    try:
+        make_resized(photo, width, height, crop)
+    except Exception:
+        logger.exception("Failed to resize %s", photo.image_name)
+    finally:
+        with pending_resized_names_lock:
+            pending_resized_names.discard(resized_name)
+
+
+def make_resized(photo, width, height, crop):
+    """
+    Create a resized version of a photo unless it exists in the cache storage.
+
+    Return its name in the cache storage.
+
+    """
     image_name = photo.image_name
     resized_name = get_resized_name(photo, width, height, crop)
     photo_storage = get_storage("photo")
     cache_storage = get_storage("cache")
-    if not cache_storage.exists(resized_name):
+    if cache_storage.exists(resized_name):
+        RESIZE_CACHE_LOOKUPS.inc(result="hit")
+    else:
+        RESIZE_CACHE_LOOKUPS.inc(result="miss")
         make_thumbnail(
             image_name, resized_name, width, height, crop, photo_storage, cache_storage
         )
-    return cache_storage.url(resized_name)
+    return resized_name
 
 
 def get_resized_name(photo, width, height, crop):
-    prefix = photo.album.date.strftime("%y%m")
     hsh = hashlib.md5()
     hsh.update(str(settings.SECRET_KEY).encode())
-    hsh.update(str(photo.album.pk).encode())
-    hsh.update(str(photo.pk).encode())
+    if photo.content_hash:
+        # Photos with identical contents share resized versions.
+        prefix = photo.content_hash[:2]
+        hsh.update(photo.content_hash.encode())
+    else:
+        prefix = photo.album.date.strftime("%y%m")
+        hsh.update(str(photo.album.pk).encode())
+        hsh.update(str(photo.pk).encode())
     hsh.update(str((width, height, crop)).encode())
     ext = os.path.splitext(photo.filename)[1].lower()
     return os.path.join(prefix, hsh.hexdigest() + ext)
@@ -61,8 +129,34 @@ def make_thumbnail(
 
     options = getattr(settings, "GALLERY_RESIZE_OPTIONS", {})
 
-    # Load the image
-    image = Image.open(image_storage.open(image_name))
+    # Decoding includes resizing because Pillow decodes JPEG images at a
+    # reduced scale when it makes thumbnails.
+    with THUMBNAIL_SECONDS.time(phase="decode"):
+        image, format = decode_thumbnail(
+            image_name, thumb_width, thumb_height, crop, image_storage
+        )
+
+    # Save the thumbnail
+    with THUMBNAIL_SECONDS.time(phase="encode"):
+        thumb_bytes_io = io.BytesIO()
+        image.save(thumb_bytes_io, format, **options.get(image.format, {}))
+    thumb_bytes_io.seek(0)
+    thumb_storage.save(resized_name, thumb_bytes_io)
+
+
+def decode_thumbnail(image_name, thumb_width, thumb_height, crop, image_storage):
+    """
+    Return a resized image and the format of the original image.
+
+    """
+    # Load the image; let Pillow open local files itself, which avoids
+    # copying them through a Python file object and lets it memory-map
+    # uncompressed formats.
+    image_path = get_local_path(image_storage, image_name)
+    if image_path is None:
+        image = Image.open(image_storage.open(image_name))
+    else:
+        image = Image.open(image_path)
     format = image.format
 
     if format == "JPEG":
@@ -91,9 +185,4 @@ def make_thumbnail(
 
     # Resize
     image.thumbnail((thumb_width, thumb_height), Image.ANTIALIAS)
-
-    # Save the thumbnail
-    thumb_bytes_io = io.BytesIO()
-    image.save(thumb_bytes_io, format, **options.get(image.format, {}))
-    thumb_bytes_io.seek(0)
-    thumb_storage.save(resized_name, thumb_bytes_io)
+    return image, format
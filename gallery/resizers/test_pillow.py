@@ -6,8 +6,8 @@ from PIL import Image, ImageDraw
 
 from ..models import Album, Photo
 from ..storages import get_storage
-from ..test_storages import MemoryStorage
-from .pillow import make_thumbnail, resize
+from ..test_storages import MemoryStorage, SimulatedStorage
+from .pillow import get_resized_name, make_resized, make_thumbnail, resize
 
 
 def make_image(name, width, height, storage, *, format="JPEG", mode="RGB"):
@@ -43,6 +43,34 @@ class ResizeTests(TestCase):
         im = Image.open(get_storage("cache").open(thumb_name))
         self.assertEqual(im.size, (16, 16))
 
+    def test_resize_storage_calls(self):
+        photo_storage = SimulatedStorage(MemoryStorage())
+        cache_storage = SimulatedStorage(MemoryStorage())
+        with self.settings(
+            GALLERY_PHOTO_STORAGE=photo_storage, GALLERY_CACHE_STORAGE=cache_storage
+        ):
+            make_image(self.photo.image_name, 48, 36, photo_storage.storage)
+            make_resized(self.photo, 16, 16, True)
+            self.assertEqual(photo_storage.calls, {"open": 1})
+            self.assertEqual(cache_storage.calls, {"exists": 1, "save": 1})
+            make_resized(self.photo, 16, 16, True)
+            self.assertEqual(photo_storage.calls, {"open": 1})
+            self.assertEqual(cache_storage.calls, {"exists": 2, "save": 1})
+
+    def test_resized_name_of_duplicates(self):
+        date = datetime.date(2023, 2, 1)
+        other_album = Album(category="default", dirpath="other", date=date)
+        copy = Photo(album=other_album, filename="copy.JPG")
+        self.assertNotEqual(
+            get_resized_name(self.photo, 16, 16, True),
+            get_resized_name(copy, 16, 16, True),
+        )
+        self.photo.content_hash = copy.content_hash = "0123abcd" * 8
+        self.assertEqual(
+            get_resized_name(self.photo, 16, 16, True),
+            get_resized_name(copy, 16, 16, True),
+        )
+
 
 class ThumbnailTests(TestCase):
     def setUp(self):
@@ -0,0 +1,33 @@
+import functools
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+
+default_backends = {
+    "postgresql": "gallery.search.postgresql.PostgreSQLSearchBackend",
+    "sqlite": "gallery.search.sqlite.SQLiteSearchBackend",
+}
+
+
+def has_search_index():
+    # The migration doesn't create the index when SQLite lacks FTS5.
+    return "gallery_search" in connection.introspection.table_names()
+
+
+@functools.lru_cache()
+def get_search_backend():
+    backend = getattr(settings, "GALLERY_SEARCH_BACKEND", None)
+    if backend is None:
+        backend = default_backends.get(connection.vendor)
+        if backend is None or not has_search_index():
+            backend = "gallery.search.simple.SimpleSearchBackend"
+    return import_string(backend)()
+
+
+@receiver(setting_changed)
+def clear_get_search_backend_cache(**kwargs):
+    if kwargs["setting"] == "GALLERY_SEARCH_BACKEND":
+        get_search_backend.cache_clear()
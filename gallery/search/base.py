@@ -0,0 +1,31 @@
+import re
+
+
+class SearchBackend:
+    """
+    Base class for search backends.
+
+    Search backends filter querysets of albums and photos. Albums match
+    on their name, their directory path and the file names of their photos.
+    Photos match on their file name and on the name and directory path of
+    their album. Each word of the query must match, possibly as a prefix.
+
+    Backends relying on an index must refresh it in ``rebuild``.
+
+    """
+
+    def get_words(self, query):
+        # Underscores are word separators in directory paths and file names.
+        return re.findall(r"[^\W_]+", query)
+
+    def search_albums(self, queryset, query):
+        raise NotImplementedError
+
+    def search_photos(self, queryset, query):
+        raise NotImplementedError
+
+    def rebuild(self, album_pks=None):
+        """
+        Refresh the index for the given albums or for all albums.
+
+        """
@@ -0,0 +1,92 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.functional import cached_property
+
+from .base import SearchBackend
+
+
+class PostgreSQLSearchBackend(SearchBackend):
+    """
+    Search with a GIN-indexed tsvector column on PostgreSQL.
+
+    The index is the ``gallery_search`` table. It has the same structure as
+    with the SQLite backend. Search ignores accents when the ``unaccent``
+    extension is installed.
+
+    """
+
+    @cached_property
+    def unaccent(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'unaccent'")
+            return cursor.fetchone() is not None
+
+    def get_document(self, text):
+        # Replace punctuation commonly found in paths with spaces before
+        # parsing, else PostgreSQL recognizes file paths as single tokens.
+        text = f"translate({text}, '/_-.', '    ')"
+        if self.unaccent:
+            text = f"unaccent({text})"
+        return f"to_tsvector('simple', {text})"
+
+    def get_condition(self):
+        tsquery = "unaccent(%s)" if self.unaccent else "%s"
+        return f"document @@ to_tsquery('simple', {tsquery})"
+
+    def get_tsquery(self, query):
+        return " & ".join(f"{word}:*" for word in self.get_words(query))
+
+    def search_albums(self, queryset, query):
+        tsquery = self.get_tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=RawSQL(
+                "SELECT album_id FROM gallery_search "
+                f"WHERE {self.get_condition()} AND photo_id IS NULL",
+                [tsquery],
+            )
+        )
+
+    def search_photos(self, queryset, query):
+        tsquery = self.get_tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=RawSQL(
+                "SELECT photo_id FROM gallery_search "
+                f"WHERE {self.get_condition()} AND photo_id IS NOT NULL",
+                [tsquery],
+            )
+        )
+
+    def rebuild(self, album_pks=None):
+        if album_pks is None:
+            delete_where, where, params = "", "", []
+        else:
+            delete_where = "WHERE album_id = ANY(%s)"
+            where = "WHERE a.id = ANY(%s)"
+            params = [list(album_pks)]
+        album_text = (
+            "a.name || ' ' || a.dirpath || ' ' "
+            "|| COALESCE(string_agg(p.filename, ' '), '')"
+        )
+        photo_text = "a.name || ' ' || a.dirpath || ' ' || p.filename"
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM gallery_search {delete_where}", params)
+            cursor.execute(
+                "INSERT INTO gallery_search (album_id, photo_id, document) "
+                f"SELECT a.id, NULL, {self.get_document(album_text)} "
+                "FROM gallery_album a "
+                "LEFT JOIN gallery_photo p ON p.album_id = a.id "
+                f"{where} GROUP BY a.id",
+                params,
+            )
+            cursor.execute(
+                "INSERT INTO gallery_search (album_id, photo_id, document) "
+                f"SELECT a.id, p.id, {self.get_document(photo_text)} "
+                "FROM gallery_album a "
+                "JOIN gallery_photo p ON p.album_id = a.id "
+                f"{where}",
+                params,
+            )
@@ -0,0 +1,39 @@
+import functools
+import operator
+
+from django.db.models import Q
+
+from .base import SearchBackend
+
+
+class SimpleSearchBackend(SearchBackend):
+    """
+    Search without an index.
+
+    This backend works on all databases. It performs full table scans.
+
+    """
+
+    def search_albums(self, queryset, query):
+        words = self.get_words(query)
+        if not words:
+            return queryset.none()
+        conditions = [
+            Q(name__icontains=word)
+            | Q(dirpath__icontains=word)
+            | Q(photo__filename__icontains=word)
+            for word in words
+        ]
+        return queryset.filter(functools.reduce(operator.and_, conditions)).distinct()
+
+    def search_photos(self, queryset, query):
+        words = self.get_words(query)
+        if not words:
+            return queryset.none()
+        conditions = [
+            Q(album__name__icontains=word)
+            | Q(album__dirpath__icontains=word)
+            | Q(filename__icontains=word)
+            for word in words
+        ]
+        return queryset.filter(functools.reduce(operator.and_, conditions))
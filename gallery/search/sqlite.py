@@ -0,0 +1,74 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .base import SearchBackend
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    Search with a FTS5 index on SQLite.
+
+    The index is the ``gallery_search`` virtual table. It contains a row for
+    each album, with the file names of all its photos, and a row for each
+    photo, with the name and directory path of its album.
+
+    """
+
+    def get_match(self, query):
+        return " ".join(f'"{word}"*' for word in self.get_words(query))
+
+    def search_albums(self, queryset, query):
+        match = self.get_match(query)
+        if not match:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=RawSQL(
+                "SELECT album_id FROM gallery_search "
+                "WHERE gallery_search MATCH %s AND photo_id IS NULL",
+                [match],
+            )
+        )
+
+    def search_photos(self, queryset, query):
+        match = self.get_match(query)
+        if not match:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=RawSQL(
+                "SELECT photo_id FROM gallery_search "
+                "WHERE gallery_search MATCH %s AND photo_id IS NOT NULL",
+                [match],
+            )
+        )
+
+    def rebuild(self, album_pks=None):
+        if album_pks is None:
+            where, params = "", []
+        else:
+            album_pks = list(album_pks)
+            if not album_pks:
+                return
+            where = "WHERE album_id IN (%s)" % ", ".join(["%s"] * len(album_pks))
+            params = album_pks
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM gallery_search {where}", params)
+            cursor.execute(
+                "INSERT INTO gallery_search (album_id, photo_id, text) "
+                "SELECT album_id, NULL, name || ' ' || dirpath || ' ' "
+                "|| COALESCE(group_concat(filename, ' '), '') "
+                "FROM (SELECT a.id AS album_id, a.name, a.dirpath, p.filename "
+                "FROM gallery_album a "
+                "LEFT JOIN gallery_photo p ON p.album_id = a.id) "
+                f"{where} GROUP BY album_id",
+                params,
+            )
+            cursor.execute(
+                "INSERT INTO gallery_search (album_id, photo_id, text) "
+                "SELECT album_id, photo_id, name || ' ' || dirpath || ' ' || filename "
+                "FROM (SELECT a.id AS album_id, p.id AS photo_id, "
+                "a.name, a.dirpath, p.filename "
+                "FROM gallery_album a "
+                "JOIN gallery_photo p ON p.album_id = a.id) "
+                f"{where}",
+                params,
+            )
@@ -1,12 +1,25 @@
+import collections
 import functools
+import mmap
+import os
+import posixpath
 import re
+import shutil
+import tempfile
+import threading
+import time
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage
 from django.dispatch import receiver
 from django.test.signals import setting_changed
 from django.utils.module_loading import import_string
 
+from .metrics import STORAGE_SECONDS
+from .profiling import is_enabled as profiling_enabled
+
 
 @functools.lru_cache()
 def get_storage(name):
@@ -15,14 +28,299 @@ def get_storage(name):
         storage = getattr(settings, storage_setting)
     except AttributeError:
         raise ImproperlyConfigured(f"Please define {storage_setting}")
+    # To make testing ealier, the setting can be set to the storage itself.
     if isinstance(storage, str):
-        return import_string(storage)()
-    else:
-        # To make testing ealier, the setting can be set to the storage itself.
-        return storage
+        storage = import_string(storage)()
+    if getattr(settings, "GALLERY_METRICS", False) or profiling_enabled():
+        storage = InstrumentedStorage(storage, name)
+    caching = getattr(settings, "GALLERY_STORAGE_CACHING", {}).get(name)
+    if caching is not None:
+        storage = CachingStorage(
+            storage,
+            timeout=caching.get("TIMEOUT", 60),
+            max_entries=caching.get("MAX_ENTRIES", 1000),
+        )
+    return storage
 
 
 @receiver(setting_changed)
 def clear_get_storage_cache(**kwargs):
-    if re.match(r"^GALLERY_[A-Z]+_STORAGE$", kwargs["setting"]):
+    if re.match(
+        r"^GALLERY_([A-Z]+_STORAGE|STORAGE_CACHING|METRICS|PROFILING_[A-Z]+)$",
+        kwargs["setting"],
+    ):
         get_storage.cache_clear()
+
+
+def get_local_path(storage, name):
+    """
+    Return the path of ``name`` in ``storage`` on the local filesystem.
+
+    Return ``None`` if ``storage`` doesn't store files locally.
+
+    """
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def read_mapped(storage, name):
+    """
+    Return the contents of ``name`` in ``storage`` as a bytes-like object.
+
+    When ``storage`` stores files locally, the file is memory-mapped rather
+    than copied into memory. The mapping is released when the returned object
+    is garbage collected.
+
+    """
+    path = get_local_path(storage, name)
+    if path is None:
+        with storage.open(name) as file:
+            return file.read()
+    with open(path, "rb") as file:
+        # Empty files cannot be memory-mapped.
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class InstrumentedStorage:
+    """
+    Wrap a storage to record the duration of calls in metrics and profiles.
+
+    ``open`` is timed, but not reading the file. Other methods are delegated
+    to the wrapped storage.
+
+    """
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def timed(self, method, *args):
+        with STORAGE_SECONDS.time(storage=self.name, method=method):
+            return getattr(self.storage, method)(*args)
+
+    def open(self, name, mode="rb"):
+        return self.timed("open", name, mode)
+
+    def save(self, name, content, max_length=None):
+        return self.timed("save", name, content, max_length)
+
+    def delete(self, name):
+        return self.timed("delete", name)
+
+    def exists(self, name):
+        return self.timed("exists", name)
+
+    def listdir(self, path):
+        return self.timed("listdir", path)
+
+    def size(self, name):
+        return self.timed("size", name)
+
+    def url(self, name):
+        return self.timed("url", name)
+
+
+class CachingStorage:
+    """
+    Wrap a storage to memoize the results of ``listdir``, ``exists``, and
+    ``url`` for ``timeout`` seconds.
+
+    Up to ``max_entries`` results are kept, evicting the least recently used.
+    Only positive results of ``exists`` are cached, since a file may be
+    created by another process. Saving or deleting a file through the wrapper
+    invalidates results for this file and its parent directories.
+
+    ``hits`` and ``misses`` count lookups in the cache.
+
+    Other methods are delegated to the wrapped storage.
+
+    """
+
+    def __init__(self, storage, timeout=60, max_entries=1000):
+        self.storage = storage
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def cached(self, method, name, cache_if=lambda value: True):
+        key = (method, name)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = getattr(self.storage, method)(name)
+        if cache_if(value):
+            with self.lock:
+                self.entries[key] = (now + self.timeout, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, name):
+        keys = [("exists", name), ("url", name)]
+        while name:
+            name = posixpath.dirname(name)
+            keys.append(("listdir", name))
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def exists(self, name):
+        return self.cached("exists", name, cache_if=bool)
+
+    def listdir(self, path):
+        return self.cached("listdir", path)
+
+    def url(self, name):
+        return self.cached("url", name)
+
+    def save(self, name, content, max_length=None):
+        name = self.storage.save(name, content, max_length)
+        self.invalidate(name)
+        return name
+
+    def delete(self, name):
+        self.storage.delete(name)
+        self.invalidate(name)
+
+
+class TieredStorage(Storage):
+    """
+    Keep local copies of files of a ``shared`` storage in ``location``.
+
+    Files are written to the local directory and to the shared storage. Files
+    read from the shared storage are copied to the local directory. When the
+    local copies take more than ``max_size`` bytes, the least recently used
+    ones are removed.
+
+    Several processes may share the same local directory.
+
+    ``hits`` and ``misses`` count reads served from local copies or not.
+
+    """
+
+    def __init__(self, shared, location, max_size):
+        self.shared = shared
+        self.local = FileSystemStorage(location=location)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Size of local copies, computed when it's first needed.
+        self.local_size = None
+        self.hits = 0
+        self.misses = 0
+
+    def copy_to_local(self, name, content):
+        path = self.local.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file then rename it so that other processes
+        # never see a partial file.
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                shutil.copyfileobj(content, temp_file)
+                size = temp_file.tell()
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        with self.lock:
+            if self.local_size is not None:
+                self.local_size += size
+            if self.local_size is None or self.local_size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used local copies until they fit.
+
+        """
+        files = []
+        for dirpath, _, filenames in os.walk(self.local.location):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:  # removed concurrently
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        local_size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if local_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:  # removed concurrently
+                pass
+            local_size -= size
+        self.local_size = local_size
+
+    def _open(self, name, mode="rb"):
+        path = self.local.path(name)
+        try:
+            # Record the access for evicting least recently used files.
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            with self.shared.open(name) as source:
+                self.copy_to_local(name, source)
+        else:
+            self.hits += 1
+        try:
+            return File(open(path, mode))
+        except FileNotFoundError:  # evicted concurrently
+            return self.shared.open(name, mode)
+
+    def _save(self, name, content):
+        name = self.shared.save(name, content)
+        content.seek(0)
+        self.copy_to_local(name, content)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        return self.shared.get_available_name(name, max_length)
+
+    def delete(self, name):
+        self.shared.delete(name)
+        self.local.delete(name)
+
+    def exists(self, name):
+        return self.local.exists(name) or self.shared.exists(name)
+
+    def listdir(self, path):
+        return self.shared.listdir(path)
+
+    def path(self, name):
+        """
+        Return the path of the local copy of a file, creating it if needed.
+
+        """
+        self.open(name).close()
+        return self.local.path(name)
+
+    def size(self, name):
+        try:
+            return os.path.getsize(self.local.path(name))
+        except FileNotFoundError:
+            return self.shared.size(name)
+
+    def url(self, name):
+        return self.shared.url(name)
@@ -0,0 +1,35 @@
+from django import template
+from django.urls import reverse
+
+from ..signing import get_ttl, sign_url
+
+register = template.Library()
+
+
+def get_photo_url(view_name, **kwargs):
+    url = reverse(view_name, kwargs=kwargs)
+    if get_ttl() is not None:
+        url = sign_url(url)
+    return url
+
+
+@register.simple_tag
+def resized_photo_url(photo, preset):
+    """
+    Return the URL of a resized photo, signed if GALLERY_SIGNED_URLS_TTL is set.
+
+    The context must ensure that the user is allowed to view the photo.
+
+    """
+    return get_photo_url("gallery:photo-resized", preset=preset, pk=photo.pk)
+
+
+@register.simple_tag
+def original_photo_url(photo):
+    """
+    Return the URL of a photo, signed if GALLERY_SIGNED_URLS_TTL is set.
+
+    The context must ensure that the user is allowed to view the photo.
+
+    """
+    return get_photo_url("gallery:photo-original", pk=photo.pk)
@@ -0,0 +1,88 @@
+import datetime
+
+from django import template
+from django.conf import settings
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+from django.contrib.admin.views.main import IGNORED_PARAMS
+from django.utils import formats
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+from ..models import Photo, PhotoDateSummary
+
+register = template.Library()
+
+
+def can_use_date_summary(cl):
+    if not getattr(settings, "GALLERY_ADMIN_APPROXIMATE_COUNTS", False):
+        return False
+    if cl.model is not Photo or cl.date_hierarchy != "date" or cl.query:
+        return False
+    # The summary doesn't account for other filters.
+    return all(
+        param.startswith("date__") for param in cl.params if param not in IGNORED_PARAMS
+    )
+
+
+def photo_date_hierarchy(cl):
+    """
+    Display the date hierarchy, with years and months from PhotoDateSummary.
+
+    This avoids scanning the entire table of photos when it's large.
+
+    """
+    if not can_use_date_summary(cl):
+        return date_hierarchy(cl)
+
+    year_field = "date__year"
+    month_field = "date__month"
+    year_lookup = cl.params.get(year_field)
+    # Days of a month are cheap enough to look up in the table of photos.
+    if cl.params.get(month_field) or cl.params.get("date__day"):
+        return date_hierarchy(cl)
+
+    def link(filters):
+        return cl.get_query_string(filters, ["date__"])
+
+    summary = PhotoDateSummary.objects.filter(year__isnull=False)
+    if not year_lookup:
+        years = list(summary.values_list("year", flat=True).distinct())
+        if len(years) != 1:
+            return {
+                "show": True,
+                "back": None,
+                "choices": [
+                    {"link": link({year_field: str(year)}), "title": str(year)}
+                    for year in years
+                ],
+            }
+        year_lookup = years[0]
+
+    months = summary.filter(year=year_lookup).values_list("month", flat=True)
+    return {
+        "show": True,
+        "back": {"link": link({}), "title": _("All dates")},
+        "choices": [
+            {
+                "link": link({year_field: year_lookup, month_field: month}),
+                "title": capfirst(
+                    formats.date_format(
+                        datetime.date(int(year_lookup), month, 1), "YEAR_MONTH_FORMAT"
+                    )
+                ),
+            }
+            for month in months
+        ],
+    }
+
+
+@register.tag(name="photo_date_hierarchy")
+def photo_date_hierarchy_tag(parser, token):
+    return InclusionAdminNode(
+        parser,
+        token,
+        func=photo_date_hierarchy,
+        template_name="date_hierarchy.html",
+        takes_context=False,
+    )
@@ -1,19 +1,38 @@
 import datetime
+import functools
 import io
 import sys
 import unittest
+from unittest import mock
 
 from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
-from django.contrib.auth.models import Permission, User
+from django.contrib.auth.models import Group, Permission, User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from .models import Album, AlbumAccessPolicy, Photo, PhotoAccessPolicy
+from . import admin
+from .models import (
+    Album,
+    AlbumAccessPolicy,
+    Photo,
+    PhotoAccessPolicy,
+    PhotoDateSummary,
+)
+from .resizers.pillow import get_resized_name, pending_resized_names
+from .resizers.test_pillow import make_image
 from .storages import get_storage
+from .test_storages import MemoryStorage
 
 
 class AdminTests(TestCase):
     def setUp(self):
+        # Don't create thumbnails of missing photos in the background.
+        patcher = mock.patch("gallery.resizers.pillow.get_executor")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(pending_resized_names.clear)
         today = datetime.date.today()
         self.album = Album.objects.create(category="default", dirpath="foo", date=today)
         self.album2 = Album.objects.create(
@@ -32,6 +51,96 @@ class AdminTests(TestCase):
     def test_photo_changelist(self):
         self.client.get(reverse("admin:gallery_photo_changelist"))
 
+    def get_changelist_rows(self, model_name):
+        url = reverse(f"admin:gallery_{model_name}_changelist")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        rows = {
+            str(obj): (
+                obj.access_policy_public,
+                obj.access_policy_groups,
+                obj.access_policy_users,
+            )
+            for obj in response.context["cl"].result_list
+        }
+        return rows, len(queries)
+
+    def test_album_changelist_access_policy_columns(self):
+        group = Group.objects.create(name="group")
+        self.album.access_policy.groups.add(group)
+        self.album.access_policy.users.add(self.user)
+        rows, queries = self.get_changelist_rows("album")
+        self.assertEqual(
+            rows, {"foo": (True, "group", "user"), "foo2": (None, "-", "-")}
+        )
+        for index in range(20):
+            album = Album.objects.create(
+                category="default", dirpath=f"album{index}", date=self.album.date
+            )
+            AlbumAccessPolicy.objects.create(album=album).groups.add(group)
+        self.assertEqual(self.get_changelist_rows("album")[1], queries)
+
+    def test_photo_changelist_access_policy_columns(self):
+        group = Group.objects.create(name="group")
+        self.photo.access_policy.groups.add(group)
+        album_access_policy = AlbumAccessPolicy.objects.create(
+            album=self.album2, public=False, inherit=True
+        )
+        album_access_policy.users.add(self.user)
+        Photo.objects.create(album=self.album2, filename="inherited")
+        rows, queries = self.get_changelist_rows("photo")
+        self.assertEqual(
+            rows,
+            {
+                "bar": (True, "group", ""),
+                "bar2": (None, "-", "-"),
+                "inherited": (False, "", "user"),
+            },
+        )
+        for index in range(20):
+            Photo.objects.create(album=self.album2, filename=f"photo{index}")
+        self.assertEqual(self.get_changelist_rows("photo")[1], queries)
+
+    def test_photo_changelist_approximate_counts(self):
+        self.photo.date = datetime.datetime(2018, 5, 1, 12)
+        self.photo.save()
+        self.photo2.date = datetime.datetime(2019, 6, 1, 12)
+        self.photo2.save()
+        PhotoDateSummary.objects.refresh()
+        # Photos added since the last refresh aren't counted.
+        Photo.objects.create(album=self.album, filename="new")
+        url = reverse("admin:gallery_photo_changelist")
+        with self.settings(GALLERY_ADMIN_APPROXIMATE_COUNTS=True):
+            response = self.client.get(url)
+            self.assertEqual(response.context["cl"].result_count, 2)
+            self.assertContains(response, "?date__year=2018")
+            self.assertContains(response, "?date__year=2019")
+            response = self.client.get(url, {"date__year": "2019"})
+            self.assertContains(response, "?date__month=6&amp;date__year=2019")
+            # Filtered querysets are counted exactly.
+            self.assertEqual(response.context["cl"].result_count, 1)
+
+    @mock.patch("gallery.resizers.pillow.get_executor")
+    def test_photo_changelist_preview(self, get_executor):
+        url = reverse("admin:gallery_photo_changelist")
+        with self.settings(
+            GALLERY_PHOTO_STORAGE=MemoryStorage(), GALLERY_CACHE_STORAGE=MemoryStorage()
+        ):
+            for photo in [self.photo, self.photo2]:
+                make_image(photo.image_name, 48, 36, get_storage("photo"))
+            response = self.client.get(url)
+            self.assertContains(response, "/static/img/placeholder.svg")
+            submit = get_executor.return_value.submit
+            self.assertEqual(submit.call_count, 2)
+            # Thumbnails being created aren't queued again.
+            self.client.get(url)
+            self.assertEqual(submit.call_count, 2)
+            for call in submit.call_args_list:
+                call[0][0](*call[0][1:])
+            response = self.client.get(url)
+            resized_name = get_resized_name(self.photo, 128, 128, True)
+            self.assertContains(response, "/url/of/" + resized_name)
+
     def test_album_change(self):
         self.client.get(reverse("admin:gallery_album_change", args=[self.album.pk]))
 
@@ -43,6 +152,27 @@ class AdminTests(TestCase):
         get_storage("photo").save("test", io.BytesIO(b"test"))
         self.client.post(reverse("admin:gallery_scan_photos"))
 
+    def test_duplicates(self):
+        content_hash = "0123abcd" * 8
+        Photo.objects.filter(pk__in=[self.photo.pk, self.photo2.pk]).update(
+            content_hash=content_hash
+        )
+        Photo.objects.create(album=self.album2, filename="bar", content_hash="other")
+        response = self.client.get(
+            reverse("admin:gallery_photo_changelist"), {"duplicates": "yes"}
+        )
+        self.assertEqual(
+            {photo.pk for photo in response.context["cl"].result_list},
+            {self.photo.pk, self.photo2.pk},
+        )
+        response = self.client.get(
+            reverse("admin:gallery_photo_change", args=[self.photo.pk])
+        )
+        self.assertContains(
+            response,
+            reverse("admin:gallery_photo_change", args=[self.photo2.pk]),
+        )
+
     def test_set_album_access_policy(self):
         response = self.client.post(
             reverse("admin:gallery_album_changelist"),
@@ -229,6 +359,102 @@ class AdminTests(TestCase):
         with self.assertRaises(AlbumAccessPolicy.DoesNotExist):
             Album.objects.get(pk=self.album.pk).access_policy
 
+    def set_photo_access_policy(self, photos, **data):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post(
+                    reverse("admin:gallery_photo_changelist"),
+                    {
+                        "action": "set_access_policy",
+                        ACTION_CHECKBOX_NAME: [str(photo.pk) for photo in photos],
+                        "set_access_policy": "Set access policy",
+                        **data,
+                    },
+                )
+        self.assertRedirects(response, reverse("admin:gallery_photo_changelist"))
+        self.assertTrue(callbacks)
+        return len(queries)
+
+    def test_set_photo_access_policy_in_bulk(self):
+        group = Group.objects.create(name="group")
+        data = {"groups": [str(group.pk)], "users": [str(self.user.pk)]}
+        few_queries = self.set_photo_access_policy([self.photo, self.photo2], **data)
+        photos = [
+            Photo.objects.create(album=self.album2, filename=f"photo{index}.jpg")
+            for index in range(20)
+        ]
+        many_queries = self.set_photo_access_policy(
+            [self.photo, self.photo2] + photos, **data
+        )
+        self.assertEqual(many_queries, few_queries)
+        self.assertEqual(PhotoAccessPolicy.objects.count(), 22)
+        self.assertEqual(
+            PhotoAccessPolicy.objects.filter(groups=group, users=self.user).count(),
+            22,
+        )
+        # Existing access policies are updated.
+        self.assertFalse(PhotoAccessPolicy.objects.get(photo=self.photo).public)
+
+        self.set_photo_access_policy([self.photo], public=True)
+        policy = PhotoAccessPolicy.objects.get(photo=self.photo)
+        self.assertTrue(policy.public)
+        self.assertQuerysetEqual(policy.groups.all(), [])
+        self.assertQuerysetEqual(policy.users.all(), [])
+        self.assertQuerysetEqual(
+            PhotoAccessPolicy.objects.get(photo=self.photo2).users.all(), [self.user]
+        )
+
+    def test_set_photo_access_policy_in_batches(self):
+        group = Group.objects.create(name="group")
+        data = {"groups": [str(group.pk)], "users": [str(self.user.pk)]}
+        photos = [
+            Photo.objects.create(album=self.album2, filename=f"photo{index}.jpg")
+            for index in range(20)
+        ]
+        set_access_policies = functools.partial(admin.set_access_policies, batch_size=5)
+        with mock.patch("gallery.admin.set_access_policies", set_access_policies):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(
+                    reverse("admin:gallery_photo_changelist"),
+                    {
+                        "action": "set_access_policy",
+                        ACTION_CHECKBOX_NAME: [str(photo.pk) for photo in photos],
+                        "set_access_policy": "Set access policy",
+                        **data,
+                    },
+                )
+        self.assertEqual(
+            PhotoAccessPolicy.objects.filter(groups=group, users=self.user).count(),
+            20,
+        )
+        # Policies, groups and users are inserted in batches of five.
+        inserts = [
+            query["sql"] for query in queries if query["sql"].startswith("INSERT")
+        ]
+        self.assertEqual(len(inserts), 12)
+        # Rows are deleted with a subquery rather than a list of primary keys.
+        deletes = [
+            query["sql"] for query in queries if query["sql"].startswith("DELETE")
+        ]
+        self.assertEqual(len(deletes), 2)
+        for sql in deletes:
+            self.assertIn("SELECT", sql)
+
+    def test_unset_photo_access_policy_in_bulk(self):
+        PhotoAccessPolicy.objects.create(photo=self.photo2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                reverse("admin:gallery_photo_changelist"),
+                {
+                    "action": "unset_access_policy",
+                    ACTION_CHECKBOX_NAME: [str(self.photo.pk), str(self.photo2.pk)],
+                    "unset_access_policy": "Unset access policy",
+                },
+            )
+        self.assertRedirects(response, reverse("admin:gallery_photo_changelist"))
+        self.assertTrue(callbacks)
+        self.assertFalse(PhotoAccessPolicy.objects.exists())
+
     # See https://code.djangoproject.com/ticket/24258
     if (3, 0) <= sys.version_info[:2] < (3, 3):  # pragma: no cover
         test_set_album_access_policy = unittest.expectedFailure(
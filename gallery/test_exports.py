@@ -0,0 +1,344 @@
+import datetime
+import io
+import os
+import tempfile
+import time
+import zipfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from .caching import get_cache
+from .exports import (
+    build_archive,
+    get_job,
+    get_snapshot,
+    prefetch,
+    read_manifest,
+    run_job,
+    save_archive,
+    start_job,
+    stream_archive,
+    tee_to_storage,
+)
+from .models import Album, AlbumAccessPolicy, Photo
+from .test_storages import MemoryStorage, SimulatedStorage
+
+
+class PrefetchTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        memory_storage = MemoryStorage()
+        self.storage = SimulatedStorage(memory_storage, latency=0.05)
+        self.names = [f"album/photo{index}.jpg" for index in range(8)]
+        for name in self.names:
+            memory_storage.save(name, io.BytesIO(name.encode()))
+
+    def time_prefetch(self, workers):
+        t = time.perf_counter()
+        contents = list(prefetch(self.storage, self.names, workers))
+        dt = time.perf_counter() - t
+        self.assertEqual(contents, [name.encode() for name in self.names])
+        return dt
+
+    def test_speedup(self):
+        serial = self.time_prefetch(1)
+        for workers in [2, 4, 8]:
+            with self.subTest(workers=workers):
+                speedup = serial / self.time_prefetch(workers)
+                self.assertGreater(speedup, workers * 0.6)
+
+    def test_memory_budget(self):
+        contents = list(prefetch(self.storage, self.names, 4, memory_budget=1))
+        self.assertEqual(contents, [name.encode() for name in self.names])
+
+    def test_stream_archive_from_iterator(self):
+        entries = ((name.split("/")[1], name) for name in self.names)
+        with self.settings(GALLERY_EXPORT_PREFETCH=4):
+            data = b"".join(stream_archive(entries, self.storage))
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(len(archive.namelist()), 8)
+            self.assertEqual(archive.read("photo3.jpg"), b"album/photo3.jpg")
+
+    def test_build_archive(self):
+        entries = [(name.split("/")[1], name) for name in self.names]
+        with self.settings(GALLERY_EXPORT_PREFETCH=4):
+            temp_zip = io.BytesIO()
+            build_archive(temp_zip, entries, self.storage)
+            streamed_zip = io.BytesIO(b"".join(stream_archive(entries, self.storage)))
+        for data in [temp_zip, streamed_zip]:
+            with zipfile.ZipFile(data) as archive:
+                self.assertEqual(archive.namelist(), [name for name, _ in entries])
+                self.assertEqual(archive.read("photo3.jpg"), b"album/photo3.jpg")
+        # Each photo is opened once per archive.
+        self.assertEqual(self.storage.calls, {"open": 16})
+
+
+class StreamArchiveTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = MemoryStorage()
+        self.storage.save("album/photo1.jpg", io.BytesIO(b"photo1" * 1000))
+        self.storage.save("album/photo2.jpg", io.BytesIO(b"photo2" * 1000))
+        self.entries = [
+            ("photo1.jpg", "album/photo1.jpg"),
+            ("photo2.jpg", "album/photo2.jpg"),
+        ]
+
+    def assertValidArchive(self, data):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ["photo1.jpg", "photo2.jpg"])
+            self.assertEqual(archive.read("photo2.jpg"), b"photo2" * 1000)
+            for info in archive.infolist():
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+
+    def test_stream_archive(self):
+        data = b"".join(stream_archive(self.entries, self.storage))
+        self.assertValidArchive(data)
+
+    def test_stream_archive_in_chunks(self):
+        chunks = list(stream_archive(self.entries, self.storage))
+        self.assertGreater(len(chunks), 2)
+        self.assertValidArchive(b"".join(chunks))
+
+    def test_stream_archive_from_local_files(self):
+        with tempfile.TemporaryDirectory() as location:
+            storage = FileSystemStorage(location)
+            for _, image_name in self.entries:
+                storage.save(image_name, self.storage.open(image_name))
+            for prefetch_workers in [1, 4]:
+                with self.settings(GALLERY_EXPORT_PREFETCH=prefetch_workers):
+                    data = b"".join(stream_archive(self.entries, storage))
+                self.assertValidArchive(data)
+
+    def test_tee_to_storage(self):
+        cache_storage = MemoryStorage()
+        chunks = stream_archive(self.entries, self.storage)
+        data = b"".join(tee_to_storage(chunks, cache_storage, "export/album.zip"))
+        self.assertEqual(cache_storage.open("export/album.zip").read(), data)
+        self.assertValidArchive(data)
+
+    def test_tee_to_storage_interrupted(self):
+        cache_storage = MemoryStorage()
+        chunks = stream_archive(self.entries, self.storage)
+        chunks = tee_to_storage(chunks, cache_storage, "export/album.zip")
+        next(chunks)
+        chunks.close()
+        self.assertFalse(cache_storage.exists("export/album.zip"))
+
+
+class SaveArchiveTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.image_storage = MemoryStorage()
+        self.image_storage.save("album/photo1.jpg", io.BytesIO(b"photo1"))
+        self.image_storage.save("album/photo2.jpg", io.BytesIO(b"photo2"))
+        self.zip_storage = MemoryStorage()
+
+    def test_snapshot(self):
+        album = Album.objects.create(
+            category="default", dirpath="album", date=datetime.date(2019, 6, 1)
+        )
+        photo = Photo.objects.create(album=album, filename="photo1.jpg")
+        with self.assertNumQueries(1):
+            snapshot = get_snapshot(album, album.photo_set.all())
+        self.assertEqual(snapshot, [(photo.pk, "photo1.jpg", "album/photo1.jpg")])
+
+    def test_write_manifest(self):
+        entries = [("photo1.jpg", "album/photo1.jpg")]
+        save_archive(
+            "export/1.zip",
+            entries,
+            self.image_storage,
+            self.zip_storage,
+            "export/m.json",
+        )
+        self.assertEqual(
+            read_manifest(self.zip_storage, "export/m.json"),
+            {
+                "zip_name": "export/1.zip",
+                "entries": [["photo1.jpg", "album/photo1.jpg"]],
+            },
+        )
+
+    def test_reuse_previous_archive(self):
+        entries = [("photo1.jpg", "album/photo1.jpg")]
+        save_archive(
+            "export/1.zip",
+            entries,
+            self.image_storage,
+            self.zip_storage,
+            "export/m.json",
+        )
+        # If photo1.jpg was read again from the image storage, this would fail.
+        self.image_storage.delete("album/photo1.jpg")
+        entries.append(("photo2.jpg", "album/photo2.jpg"))
+        save_archive(
+            "export/2.zip",
+            entries,
+            self.image_storage,
+            self.zip_storage,
+            "export/m.json",
+        )
+        with zipfile.ZipFile(self.zip_storage.open("export/2.zip")) as archive:
+            self.assertEqual(archive.read("photo1.jpg"), b"photo1")
+            self.assertEqual(archive.read("photo2.jpg"), b"photo2")
+        self.assertEqual(
+            read_manifest(self.zip_storage, "export/m.json")["zip_name"], "export/2.zip"
+        )
+
+    def test_dont_reuse_missing_archive(self):
+        entries = [("photo1.jpg", "album/photo1.jpg")]
+        save_archive(
+            "export/1.zip",
+            entries,
+            self.image_storage,
+            self.zip_storage,
+            "export/m.json",
+        )
+        self.zip_storage.delete("export/1.zip")
+        save_archive(
+            "export/2.zip",
+            entries,
+            self.image_storage,
+            self.zip_storage,
+            "export/m.json",
+        )
+        with zipfile.ZipFile(self.zip_storage.open("export/2.zip")) as archive:
+            self.assertEqual(archive.read("photo1.jpg"), b"photo1")
+
+
+class BackgroundJobTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.image_storage = MemoryStorage()
+        self.image_storage.save("album/photo.jpg", io.BytesIO(b"photo" * 1000))
+        self.zip_storage = MemoryStorage()
+        self.entries = [("photo.jpg", "album/photo.jpg")]
+
+    @mock.patch("gallery.exports.get_executor")
+    def test_concurrent_requests_share_job(self, get_executor):
+        job_id_1 = start_job(
+            "export/abc.zip", self.entries, self.image_storage, self.zip_storage
+        )
+        job_id_2 = start_job(
+            "export/abc.zip", self.entries, self.image_storage, self.zip_storage
+        )
+        self.assertEqual(job_id_1, "abc")
+        self.assertEqual(job_id_2, "abc")
+        get_executor.return_value.submit.assert_called_once()
+
+    @mock.patch("gallery.exports.get_executor")
+    def test_run_job(self, get_executor):
+        start_job("export/abc.zip", self.entries, self.image_storage, self.zip_storage)
+        run_job(*get_executor.return_value.submit.call_args[0][1:])
+        self.assertEqual(
+            get_job("abc"),
+            {
+                "status": "done",
+                "files_done": 1,
+                "files_total": 1,
+                "bytes_done": 5000,
+                "attempt": 0,
+            },
+        )
+        self.assertTrue(self.zip_storage.exists("export/abc.zip"))
+
+    @mock.patch("gallery.exports.get_executor")
+    def test_run_job_with_deferred_entries(self, get_executor):
+        start_job(
+            "export/abc.zip", lambda: self.entries, self.image_storage, self.zip_storage
+        )
+        self.assertIsNone(get_job("abc")["files_total"])
+        run_job(*get_executor.return_value.submit.call_args[0][1:])
+        self.assertEqual(get_job("abc")["files_total"], 1)
+        self.assertTrue(self.zip_storage.exists("export/abc.zip"))
+
+    @mock.patch("gallery.exports.get_executor")
+    def test_failed_job_restarts(self, get_executor):
+        self.entries.append(("missing.jpg", "album/missing.jpg"))
+        start_job("export/abc.zip", self.entries, self.image_storage, self.zip_storage)
+        with self.assertLogs("gallery.exports"):
+            run_job(*get_executor.return_value.submit.call_args[0][1:])
+        self.assertEqual(get_job("abc")["status"], "failed")
+        start_job("export/abc.zip", self.entries, self.image_storage, self.zip_storage)
+        self.assertEqual(get_executor.return_value.submit.call_count, 2)
+        self.assertEqual(get_job("abc")["status"], "running")
+        self.assertEqual(get_job("abc")["attempt"], 1)
+
+    @mock.patch("gallery.exports.get_executor")
+    def test_concurrent_requests_restart_job_once(self, get_executor):
+        self.entries.append(("missing.jpg", "album/missing.jpg"))
+        start_job("export/abc.zip", self.entries, self.image_storage, self.zip_storage)
+        with self.assertLogs("gallery.exports"):
+            run_job(*get_executor.return_value.submit.call_args[0][1:])
+        failed_state = get_job("abc")
+        # Both requests read the failed state before either restarts the job.
+        with mock.patch.object(get_cache(), "get", return_value=failed_state):
+            for _ in range(2):
+                start_job(
+                    "export/abc.zip",
+                    self.entries,
+                    self.image_storage,
+                    self.zip_storage,
+                )
+        self.assertEqual(get_executor.return_value.submit.call_count, 2)
+        self.assertEqual(get_job("abc")["status"], "running")
+
+
+class ExportPhotosCommandTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.album = Album.objects.create(
+            category="default", dirpath="2019/album", date=datetime.date(2019, 6, 1)
+        )
+        AlbumAccessPolicy.objects.create(album=self.album, public=True, inherit=True)
+        Photo.objects.create(album=self.album, filename="photo.jpg")
+        other_album = Album.objects.create(
+            category="default", dirpath="2020/album", date=datetime.date(2020, 6, 1)
+        )
+        Photo.objects.create(album=other_album, filename="photo.jpg")
+        self.storage = MemoryStorage()
+        self.storage.save("2019/album/photo.jpg", io.BytesIO(b"2019"))
+        self.storage.save("2020/album/photo.jpg", io.BytesIO(b"2020"))
+
+    def export(self, *args):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output = os.path.join(temp_dir, "export.zip")
+            with self.settings(GALLERY_PHOTO_STORAGE=self.storage):
+                call_command("exportphotos", output, *args, verbosity=0)
+            with zipfile.ZipFile(output) as archive:
+                return {name: archive.read(name) for name in archive.namelist()}
+
+    def test_export_year(self):
+        self.assertEqual(
+            self.export("--year", "2019"), {"2019/album/photo.jpg": b"2019"}
+        )
+
+    def test_export_date_range(self):
+        self.assertEqual(
+            self.export("--start", "2019-01-01", "--end", "2021-01-01"),
+            {"2019/album/photo.jpg": b"2019", "2020/album/photo.jpg": b"2020"},
+        )
+
+    def test_export_for_user(self):
+        User.objects.create_user("user", "user@gallery", "pass")
+        self.assertEqual(
+            self.export("--start", "2019-01-01", "--user", "user"),
+            {"2019/album/photo.jpg": b"2019"},
+        )
+
+    def test_export_requires_selection(self):
+        with self.assertRaises(CommandError):
+            call_command("exportphotos", "export.zip", verbosity=0)
+
+    def test_export_invalid_year(self):
+        for year in ["0", str(10**30)]:
+            with self.subTest(year=year):
+                with self.assertRaisesMessage(CommandError, "Invalid year"):
+                    call_command("exportphotos", "export.zip", "--year", year)
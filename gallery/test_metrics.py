@@ -0,0 +1,142 @@
+import datetime
+import io
+
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import metrics
+from .exports import save_archive
+from .models import Album, AlbumAccessPolicy, Photo
+from .resizers.pillow import make_resized
+from .resizers.test_pillow import make_image
+from .storages import get_storage
+from .test_storages import MemoryStorage
+
+
+class MetricsTestsMixin:
+    def setUp(self):
+        super().setUp()
+        for metric in metrics.registry:
+            metric.clear()
+
+
+class MetricTests(MetricsTestsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.counter = metrics.Counter("test_total", "Test counter.", ["label"])
+        self.histogram = metrics.Histogram(
+            "test_seconds", "Test histogram.", ["label"], buckets=[0.1, 1]
+        )
+        self.addCleanup(metrics.registry.remove, self.counter)
+        self.addCleanup(metrics.registry.remove, self.histogram)
+
+    @override_settings(GALLERY_METRICS=True)
+    def test_counter(self):
+        self.counter.inc(label="a")
+        self.counter.inc(2, label='"b"\n')
+        self.assertEqual(self.counter.get(label="a"), 1)
+        self.assertEqual(
+            self.counter.render(),
+            [
+                "# HELP test_total Test counter.",
+                "# TYPE test_total counter",
+                'test_total{label="\\"b\\"\\n"} 2.0',
+                'test_total{label="a"} 1.0',
+            ],
+        )
+
+    @override_settings(GALLERY_METRICS=True)
+    def test_histogram(self):
+        self.histogram.observe(0.05, label="a")
+        self.histogram.observe(0.5, label="a")
+        self.histogram.observe(5, label="a")
+        self.assertEqual(self.histogram.get_count(label="a"), 3)
+        self.assertEqual(
+            self.histogram.render(),
+            [
+                "# HELP test_seconds Test histogram.",
+                "# TYPE test_seconds histogram",
+                'test_seconds_bucket{label="a",le="0.1"} 1',
+                'test_seconds_bucket{label="a",le="1.0"} 2',
+                'test_seconds_bucket{label="a",le="+Inf"} 3',
+                'test_seconds_sum{label="a"} 5.55',
+                'test_seconds_count{label="a"} 3',
+            ],
+        )
+
+    @override_settings(GALLERY_METRICS=True)
+    def test_invalid_labels(self):
+        with self.assertRaises(ValueError):
+            self.counter.inc(other="a")
+
+    def test_disabled(self):
+        self.counter.inc(label="a")
+        with self.histogram.time(label="a"):
+            pass
+        self.assertEqual(self.counter.get(label="a"), 0)
+        self.assertEqual(self.histogram.get_count(label="a"), 0)
+
+
+class MetricsViewTests(MetricsTestsMixin, TestCase):
+    def test_disabled(self):
+        response = self.client.get(reverse("gallery:metrics"))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(GALLERY_METRICS=True)
+    def test_enabled(self):
+        response = self.client.get(reverse("gallery:metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8"
+        )
+        self.assertIn(
+            "# TYPE gallery_resize_seconds histogram", response.content.decode()
+        )
+
+
+@override_settings(GALLERY_METRICS=True)
+class HotPathMetricsTests(MetricsTestsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        date = datetime.date(2023, 1, 1)
+        self.album = Album.objects.create(
+            category="default", dirpath="album", date=date
+        )
+        AlbumAccessPolicy.objects.create(album=self.album, public=True)
+        self.photo = Photo.objects.create(album=self.album, filename="original.jpg")
+
+    def test_storage(self):
+        with self.settings(GALLERY_PHOTO_STORAGE=MemoryStorage()):
+            storage = get_storage("photo")
+            storage.save("photo.jpg", io.BytesIO(b"photo"))
+            storage.exists("photo.jpg")
+        seconds = metrics.STORAGE_SECONDS
+        self.assertEqual(seconds.get_count(storage="photo", method="save"), 1)
+        self.assertEqual(seconds.get_count(storage="photo", method="exists"), 1)
+
+    def test_resize(self):
+        make_image(self.photo.image_name, 48, 36, get_storage("photo"))
+        with self.settings(GALLERY_RESIZE_PRESETS={"thumb": (16, 16, True)}):
+            self.photo.resized_url("thumb")
+        make_resized(self.photo, 16, 16, True)
+        self.assertEqual(metrics.RESIZE_SECONDS.get_count(preset="thumb"), 1)
+        self.assertEqual(metrics.RESIZE_CACHE_LOOKUPS.get(result="miss"), 1)
+        self.assertEqual(metrics.RESIZE_CACHE_LOOKUPS.get(result="hit"), 1)
+        self.assertEqual(metrics.THUMBNAIL_SECONDS.get_count(phase="decode"), 1)
+        self.assertEqual(metrics.THUMBNAIL_SECONDS.get_count(phase="encode"), 1)
+
+    def test_access_control(self):
+        list(Album.objects.allowed_for_user(AnonymousUser()))
+        Photo.objects.allowed_for_user(AnonymousUser()).count()
+        list(Album.objects.all())
+        seconds = metrics.ACCESS_CONTROL_SECONDS
+        self.assertEqual(seconds.get_count(model="album"), 1)
+        self.assertEqual(seconds.get_count(model="photo"), 1)
+
+    def test_export(self):
+        storage = MemoryStorage()
+        storage.save("photo.jpg", io.BytesIO(b"photo"))
+        save_archive("album.zip", [("photo.jpg", "photo.jpg")], storage, storage)
+        self.assertEqual(metrics.EXPORT_SECONDS.get_count(mode="build"), 1)
+        self.assertEqual(metrics.EXPORT_BYTES.get_count(mode="build"), 1)
@@ -0,0 +1,99 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import resolve, reverse
+from django.views.generic import YearArchiveView
+
+from . import views
+from .admin import PhotoAdmin
+from .benchmarks.fixtures import generate_gallery
+from .benchmarks.queryplans import get_sample_urls
+from .middleware import QueryBudgetExceeded, get_query_budget, query_budget
+from .resizers.pillow import pending_resized_names
+from .search import get_search_backend
+
+
+@override_settings(GALLERY_QUERY_BUDGETS=True)
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        with override_settings(
+            PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+        ):
+            generate_gallery(2000, log=lambda message: None)
+        get_search_backend().rebuild()
+
+    def setUp(self):
+        super().setUp()
+        # Photos of the synthetic gallery have no files to resize.
+        patcher = mock.patch("gallery.resizers.pillow.get_executor")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(pending_resized_names.clear)
+
+    def test_views_within_budget(self):
+        for username in [None, "user1", "user0"]:
+            with self.subTest(username=username):
+                urls = get_sample_urls(self.client, username)
+                album_pk, photo_pk = [
+                    int(url.strip("/").split("/")[-1]) for url in urls[3:5]
+                ]
+                urls += [
+                    reverse("gallery:latest"),
+                    reverse("gallery:photo-original", args=[photo_pk]),
+                ]
+                for url in urls:
+                    self.client.get(url)
+                with self.settings(GALLERY_EXPORT_MODE="stream"):
+                    self.client.get(reverse("gallery:album-export", args=[album_pk]))
+                self.client.logout()
+
+    def test_budget_exceeded(self):
+        url = get_sample_urls(self.client, None)[2]
+        with mock.patch.object(views.GalleryYearView, "query_budget", 1):
+            with self.assertRaises(QueryBudgetExceeded) as context:
+                self.client.get(url)
+        message = str(context.exception)
+        self.assertIn("exceeding its budget of 1.", message)
+        self.assertNotIn("Duplicate queries:", message)
+
+    def test_budget_exceeded_duplicate_queries(self):
+        url = get_sample_urls(self.client, None)[2]
+        # Django's implementation prefetches related objects of adjacent years.
+        with mock.patch.multiple(
+            views.GalleryYearView,
+            get_next_year=YearArchiveView.get_next_year,
+            get_previous_year=YearArchiveView.get_previous_year,
+        ):
+            with self.assertRaises(QueryBudgetExceeded) as context:
+                self.client.get(url)
+        self.assertIn("Duplicate queries:", str(context.exception))
+
+    def test_disabled(self):
+        url = get_sample_urls(self.client, None)[2]
+        with mock.patch.object(views.GalleryYearView, "query_budget", 1):
+            with self.settings(GALLERY_QUERY_BUDGETS=False):
+                self.client.get(url)
+
+
+class GetQueryBudgetTests(TestCase):
+    def test_function_based_view(self):
+        @query_budget(3)
+        def view(request):
+            pass  # pragma: no cover
+
+        self.assertEqual(get_query_budget(view), 3)
+
+    def test_class_based_view(self):
+        view = views.PhotoView.as_view()
+        self.assertEqual(get_query_budget(view), views.PhotoView.query_budget)
+
+    def test_admin_views(self):
+        changelist_url = reverse("admin:gallery_photo_changelist")
+        change_url = reverse("admin:gallery_photo_change", args=[1])
+        self.assertEqual(
+            get_query_budget(resolve(changelist_url).func),
+            PhotoAdmin.changelist_query_budget,
+        )
+        self.assertIsNone(get_query_budget(resolve(change_url).func))
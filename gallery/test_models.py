@@ -1,9 +1,22 @@
 import datetime
+import hashlib
+import io
+from unittest import mock
 
 from django.contrib.auth.models import Group, User
+from django.db import DatabaseError
 from django.test import TestCase
 
-from .models import Album, AlbumAccessPolicy, Photo, PhotoAccessPolicy
+from .management.commands import scanphotos
+from .management.commands.scanphotos import hash_photos
+from .models import (
+    Album,
+    AlbumAccessPolicy,
+    Photo,
+    PhotoAccessPolicy,
+    PhotoDateSummary,
+)
+from .storages import get_storage
 
 
 class AccessPolicyTests(TestCase):
@@ -159,3 +172,88 @@ class AccessPolicyTests(TestCase):
         PhotoAccessPolicy.objects.create(photo=self.photo, public=False)
         self.assertPhotoNotAllowedFor(self.user)
         self.assertPhotoNotAllowedFor(self.other)
+
+
+class PhotoDateSummaryTests(TestCase):
+    def test_refresh(self):
+        album = Album.objects.create(
+            category="default", dirpath="foo", date=datetime.date(2019, 1, 1)
+        )
+        for filename, date in [
+            ("a", datetime.datetime(2019, 1, 1, 12)),
+            ("b", datetime.datetime(2019, 1, 2, 12)),
+            ("c", datetime.datetime(2019, 3, 1, 12)),
+            ("d", None),
+        ]:
+            Photo.objects.create(album=album, filename=filename, date=date)
+        PhotoDateSummary.objects.refresh()
+        self.assertEqual(
+            list(PhotoDateSummary.objects.values_list("year", "month", "count")),
+            [(None, None, 1), (2019, 1, 2), (2019, 3, 1)],
+        )
+
+    def test_refresh_atomic(self):
+        PhotoDateSummary.objects.create(year=2019, month=1, count=1)
+        with mock.patch.object(
+            PhotoDateSummary.objects, "bulk_create", side_effect=DatabaseError
+        ):
+            with self.assertRaises(DatabaseError):
+                PhotoDateSummary.objects.refresh()
+        self.assertEqual(
+            list(PhotoDateSummary.objects.values_list("year", "month", "count")),
+            [(2019, 1, 1)],
+        )
+
+
+class ContentHashTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        album = Album.objects.create(
+            category="default", dirpath="foo", date=datetime.date(2019, 1, 1)
+        )
+        self.photos = [
+            Photo.objects.create(album=album, filename=filename)
+            for filename in ["a", "b", "c"]
+        ]
+        for photo, data in zip(self.photos, [b"a", b"b", b"a"]):
+            get_storage("photo").save(photo.image_name, io.BytesIO(data))
+
+    def get_content_hashes(self):
+        return list(Photo.objects.order_by("filename").values_list("content_hash"))
+
+    def test_hash_photos(self):
+        command = mock.Mock(full_sync=False)
+        hash_photos(command, batch_size=2)
+        hash_a = hashlib.sha256(b"a").hexdigest()
+        hash_b = hashlib.sha256(b"b").hexdigest()
+        self.assertEqual(self.get_content_hashes(), [(hash_a,), (hash_b,), (hash_a,)])
+
+    def test_hash_photos_incrementally(self):
+        command = mock.Mock(full_sync=False)
+        hash_photos(command)
+        photo = self.photos[1]
+        get_storage("photo").delete(photo.image_name)
+        get_storage("photo").save(photo.image_name, io.BytesIO(b"c"))
+        hash_photos(command)
+        hash_b = hashlib.sha256(b"b").hexdigest()
+        self.assertEqual(self.get_content_hashes()[1], (hash_b,))
+        command.full_sync = True
+        hash_photos(command)
+        hash_c = hashlib.sha256(b"c").hexdigest()
+        self.assertEqual(self.get_content_hashes()[1], (hash_c,))
+
+    def test_hash_photos_storage_error(self):
+        command = mock.Mock(full_sync=False)
+        failing_name = self.photos[1].image_name
+
+        def get_content_hash(storage, name):
+            if name == failing_name:
+                raise KeyError(name)
+            return original_get_content_hash(storage, name)
+
+        original_get_content_hash = scanphotos.get_content_hash
+        with mock.patch.object(scanphotos, "get_content_hash", get_content_hash):
+            hash_photos(command)
+        hash_a = hashlib.sha256(b"a").hexdigest()
+        self.assertEqual(self.get_content_hashes(), [(hash_a,), ("",), (hash_a,)])
+        command.write_err.assert_called_once()
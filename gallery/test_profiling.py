@@ -0,0 +1,118 @@
+import datetime
+import marshal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .models import Album, AlbumAccessPolicy, Photo
+from .profiling import get_phases, get_token, list_profiles
+from .storages import get_storage
+from .test_storages import MemoryStorage
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        override = self.settings(GALLERY_PROFILE_STORAGE=MemoryStorage())
+        override.enable()
+        self.addCleanup(override.disable)
+        today = datetime.date.today()
+        self.album = Album.objects.create(
+            category="default", dirpath="album", date=today
+        )
+        AlbumAccessPolicy.objects.create(album=self.album, public=True, inherit=True)
+        Photo.objects.create(album=self.album, filename="original.jpg")
+
+    def get_profile_names(self):
+        _, filenames = get_storage("profile").listdir("")
+        return filenames
+
+    def test_disabled(self):
+        self.client.get(reverse("gallery:index"))
+        self.assertEqual(self.get_profile_names(), [])
+
+    @override_settings(GALLERY_PROFILING_RATE=1)
+    def test_rate(self):
+        self.client.get(reverse("gallery:index"))
+        [profile] = list_profiles()
+        self.assertEqual(profile["path"], "/")
+        self.assertEqual(profile["status"], 200)
+        self.assertEqual(profile["user"], "")
+        self.assertEqual(set(profile["phases"]), set(get_phases()))
+        self.assertGreater(profile["phases"]["access control"], 0)
+        self.assertGreater(profile["phases"]["previews"], 0)
+        self.assertGreater(profile["phases"]["templates"], 0)
+        self.assertLess(profile["phases"]["templates"], profile["duration"])
+
+    @override_settings(GALLERY_PROFILING_RATE=1)
+    def test_utc_name(self):
+        self.client.get(reverse("gallery:index"))
+        [profile] = list_profiles()
+        name_date = datetime.datetime.strptime(
+            profile["name"][:15], "%Y%m%d-%H%M%S"
+        ).replace(tzinfo=datetime.timezone.utc)
+        date = datetime.datetime.fromisoformat(profile["date"])
+        self.assertLess(abs(date - name_date), datetime.timedelta(seconds=5))
+
+    @override_settings(GALLERY_PROFILING_RATE=1, GALLERY_PROFILING_RETENTION=2)
+    def test_retention(self):
+        url = reverse("gallery:index")
+        for _ in range(3):
+            self.client.get(url)
+        self.assertEqual(len(list_profiles()), 2)
+        self.assertEqual(len(self.get_profile_names()), 4)
+
+    @override_settings(GALLERY_PROFILING_RATE=1, GALLERY_PROFILING_RETENTION=None)
+    def test_no_retention(self):
+        url = reverse("gallery:index")
+        for _ in range(3):
+            self.client.get(url)
+        self.assertEqual(len(list_profiles()), 3)
+
+    @override_settings(GALLERY_PROFILING_RATE=1)
+    def test_other_views(self):
+        self.client.get(reverse("admin:index"))
+        self.assertEqual(self.get_profile_names(), [])
+
+    @override_settings(GALLERY_PROFILING_HEADER=True)
+    def test_header(self):
+        url = reverse("gallery:index")
+        self.client.get(url)
+        self.client.get(url, HTTP_X_GALLERY_PROFILE="invalid")
+        self.assertEqual(self.get_profile_names(), [])
+        self.client.get(url, HTTP_X_GALLERY_PROFILE=get_token())
+        self.assertEqual(len(list_profiles()), 1)
+
+    def test_header_disabled(self):
+        url = reverse("gallery:index")
+        self.client.get(url, HTTP_X_GALLERY_PROFILE=get_token())
+        self.assertEqual(self.get_profile_names(), [])
+
+    @override_settings(GALLERY_PROFILING_RATE=1)
+    def test_admin(self):
+        self.client.get(reverse("gallery:album", args=[self.album.pk]))
+        [profile] = list_profiles()
+
+        user = User.objects.create_user("user", "user@gallery", "pass")
+        self.client.force_login(user)
+        response = self.client.get(reverse("admin:gallery_profiles"))
+        self.assertEqual(response.status_code, 302)
+
+        user.is_staff = user.is_superuser = True
+        user.save()
+        response = self.client.get(reverse("admin:gallery_profiles"))
+        self.assertContains(response, f"/album/{self.album.pk}/")
+
+        url = reverse("admin:gallery_profile", args=[profile["name"]])
+        response = self.client.get(url)
+        self.assertEqual(
+            response["Content-Disposition"],
+            f'attachment; filename="{profile["name"]}.prof"',
+        )
+        stats = marshal.loads(b"".join(response.streaming_content))
+        self.assertIsInstance(stats, dict)
+
+        url = reverse("admin:gallery_profile", args=["missing"])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
@@ -39,6 +39,7 @@ LOGGING = {
 }
 
 MIDDLEWARE = [
+    "gallery.middleware.QueryBudgetMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -46,6 +47,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "gallery.middleware.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "gallery.test_urls"
@@ -83,3 +85,7 @@ THUMBOR_SECURITY_KEY = "thumbor-security-key"
 GALLERY_PHOTO_STORAGE = "gallery.test_storages.MemoryStorage"
 
 GALLERY_CACHE_STORAGE = "gallery.test_storages.MemoryStorage"
+
+GALLERY_PROFILE_STORAGE = "gallery.test_storages.MemoryStorage"
+
+GALLERY_RESIZE_PRESETS = {"thumb": (128, 128, True)}
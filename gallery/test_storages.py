@@ -1,11 +1,26 @@
+import collections
 import io
+import mmap
+import os
+import random
+import tempfile
+import threading
+import time
 import urllib.parse
+from unittest import mock
 
 from django.core.exceptions import ImproperlyConfigured
-from django.core.files.storage import Storage
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage
 from django.test import TestCase
 
-from .storages import get_storage
+from .storages import (
+    CachingStorage,
+    TieredStorage,
+    get_local_path,
+    get_storage,
+    read_mapped,
+)
 
 
 class MemoryStorage(Storage):  # pragma: no cover
@@ -41,11 +56,16 @@ class MemoryStorage(Storage):  # pragma: no cover
         return name in self.files
 
     def listdir(self, name):
+        prefix = name.rstrip("/") + "/" if name else ""
         dirs, files = [], []
         for filename in sorted(self.files):
-            filename = filename[len(name) :]
+            if not filename.startswith(prefix):
+                continue
+            filename = filename[len(prefix) :]
             if "/" in filename:
-                dirs.append(filename.partition("/")[0])
+                dirname = filename.partition("/")[0]
+                if dirname not in dirs:
+                    dirs.append(dirname)
             else:
                 files.append(filename)
         return dirs, files
@@ -57,6 +77,92 @@ class MemoryStorage(Storage):  # pragma: no cover
         return "/url/of/" + urllib.parse.quote(name)
 
 
+class SimulatedStorage:
+    """
+    Wrap a storage to simulate a remote object store.
+
+    Each call to ``listdir``, ``open``, ``exists``, ``save``, and ``delete``
+    waits for ``latency`` seconds plus a random delay of up to ``jitter``
+    seconds. When ``bandwidth`` is set, reading and writing files also waits
+    for their size divided by ``bandwidth``, in bytes per second.
+
+    ``calls`` counts calls by method. ``bytes_read`` and ``bytes_written``
+    count transferred bytes.
+
+    Like remote storages, it doesn't provide a ``path()`` method. Other
+    methods are delegated to the wrapped storage.
+
+    """
+
+    def __init__(self, storage, latency=0, bandwidth=None, jitter=0, seed=0):
+        self.storage = storage
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def call(self, method):
+        with self.lock:
+            self.calls[method] += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        time.sleep(delay)
+
+    def transfer(self, size, direction):
+        with self.lock:
+            setattr(self, direction, getattr(self, direction) + size)
+        if self.bandwidth is not None:
+            time.sleep(size / self.bandwidth)
+
+    def path(self, name):
+        raise NotImplementedError("This backend doesn't support absolute paths.")
+
+    def listdir(self, path):
+        self.call("listdir")
+        return self.storage.listdir(path)
+
+    def open(self, name, mode="rb"):
+        self.call("open")
+        return SimulatedFile(self.storage.open(name, mode), self)
+
+    def exists(self, name):
+        self.call("exists")
+        return self.storage.exists(name)
+
+    def save(self, name, content, max_length=None):
+        self.call("save")
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        self.transfer(content.size, "bytes_written")
+        return self.storage.save(name, content, max_length)
+
+    def delete(self, name):
+        self.call("delete")
+        self.storage.delete(name)
+
+
+class SimulatedFile(File):
+    """
+    File opened by ``SimulatedStorage``, limiting the bandwidth of reads.
+
+    """
+
+    def __init__(self, file, storage):
+        super().__init__(file, getattr(file, "name", None))
+        self.storage = storage
+
+    def read(self, *args):
+        data = self.file.read(*args)
+        self.storage.transfer(len(data), "bytes_read")
+        return data
+
+
 class StoragesTest(TestCase):
     def test_get_storage(self):
         with self.settings(GALLERY_FOO_STORAGE="gallery.test_storages.MemoryStorage"):
@@ -72,3 +178,182 @@ class StoragesTest(TestCase):
     def test_get_storage_unconfigured(self):
         with self.assertRaises(ImproperlyConfigured):
             get_storage("foo")
+
+    def test_get_storage_with_caching(self):
+        with self.settings(
+            GALLERY_FOO_STORAGE="gallery.test_storages.MemoryStorage",
+            GALLERY_STORAGE_CACHING={"foo": {"TIMEOUT": 10, "MAX_ENTRIES": 100}},
+        ):
+            foo_storage = get_storage("foo")
+        self.assertIsInstance(foo_storage, CachingStorage)
+        self.assertIsInstance(foo_storage.storage, MemoryStorage)
+        self.assertEqual(foo_storage.timeout, 10)
+        self.assertEqual(foo_storage.max_entries, 100)
+
+    def test_read_mapped_local_file(self):
+        with tempfile.TemporaryDirectory() as location:
+            storage = FileSystemStorage(location)
+            storage.save("album/photo.jpg", io.BytesIO(b"photo"))
+            storage.save("album/empty.jpg", io.BytesIO(b""))
+            data = read_mapped(storage, "album/photo.jpg")
+            self.assertIsInstance(data, mmap.mmap)
+            self.assertEqual(data[:], b"photo")
+            data.close()
+            self.assertEqual(read_mapped(storage, "album/empty.jpg"), b"")
+
+    def test_read_mapped_remote_file(self):
+        storage = MemoryStorage()
+        storage.save("album/photo.jpg", io.BytesIO(b"photo"))
+        self.assertIsNone(get_local_path(storage, "album/photo.jpg"))
+        self.assertEqual(read_mapped(storage, "album/photo.jpg"), b"photo")
+
+
+class CachingStorageTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.wrapped = MemoryStorage()
+        self.wrapped.save("album/photo.jpg", io.BytesIO(b"photo"))
+        self.storage = CachingStorage(self.wrapped, timeout=60, max_entries=3)
+
+    def test_cache_results(self):
+        with mock.patch.object(self.wrapped, "url", wraps=self.wrapped.url) as url:
+            self.assertEqual(
+                self.storage.url("album/photo.jpg"), "/url/of/album/photo.jpg"
+            )
+            self.assertEqual(
+                self.storage.url("album/photo.jpg"), "/url/of/album/photo.jpg"
+            )
+        self.assertEqual(url.call_count, 1)
+        self.assertEqual((self.storage.hits, self.storage.misses), (1, 1))
+
+    def test_dont_cache_missing_files(self):
+        self.assertFalse(self.storage.exists("album/other.jpg"))
+        self.wrapped.save("album/other.jpg", io.BytesIO(b"other"))
+        self.assertTrue(self.storage.exists("album/other.jpg"))
+
+    def test_invalidate_on_save_and_delete(self):
+        self.assertTrue(self.storage.exists("album/photo.jpg"))
+        self.assertEqual(self.storage.listdir("album"), ([], ["photo.jpg"]))
+        self.storage.delete("album/photo.jpg")
+        self.assertFalse(self.storage.exists("album/photo.jpg"))
+        self.assertEqual(self.storage.listdir("album"), ([], []))
+        self.storage.save("album/photo.jpg", io.BytesIO(b"photo"))
+        self.assertTrue(self.storage.exists("album/photo.jpg"))
+        self.assertEqual(self.storage.listdir("")[0], ["album"])
+
+    def test_timeout(self):
+        self.storage.timeout = 0.01
+        self.storage.url("album/photo.jpg")
+        time.sleep(0.02)
+        self.storage.url("album/photo.jpg")
+        self.assertEqual((self.storage.hits, self.storage.misses), (0, 2))
+
+    def test_max_entries(self):
+        for index in range(4):
+            self.storage.url(f"album/photo{index}.jpg")
+        self.storage.url("album/photo0.jpg")
+        self.storage.url("album/photo3.jpg")
+        self.assertEqual((self.storage.hits, self.storage.misses), (1, 5))
+
+    def test_delegate_other_methods(self):
+        with self.storage.open("album/photo.jpg") as photo:
+            self.assertEqual(photo.read(), b"photo")
+        self.assertEqual(self.storage.size("album/photo.jpg"), 5)
+
+
+class TieredStorageTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.shared = MemoryStorage()
+        self.shared.save("album/photo.jpg", io.BytesIO(b"photo"))
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.location = temp_dir.name
+        self.storage = TieredStorage(self.shared, self.location, max_size=10)
+
+    def local_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(dirpath, filename), self.location)
+            for dirpath, _, filenames in os.walk(self.location)
+            for filename in filenames
+        )
+
+    def read(self, name):
+        with self.storage.open(name) as file:
+            return file.read()
+
+    def test_read_fills_local_tier(self):
+        self.assertEqual(self.read("album/photo.jpg"), b"photo")
+        self.assertEqual(self.local_files(), ["album/photo.jpg"])
+        self.shared.delete("album/photo.jpg")
+        self.assertEqual(self.read("album/photo.jpg"), b"photo")
+        self.assertEqual((self.storage.hits, self.storage.misses), (1, 1))
+
+    def test_write_to_both_tiers(self):
+        self.storage.save("album/other.jpg", io.BytesIO(b"other"))
+        self.assertEqual(self.shared.files["album/other.jpg"], b"other")
+        self.assertEqual(self.local_files(), ["album/other.jpg"])
+        self.assertEqual(self.read("album/other.jpg"), b"other")
+        self.assertEqual((self.storage.hits, self.storage.misses), (1, 0))
+
+    def test_evict_least_recently_used(self):
+        self.storage.save("album/1.jpg", io.BytesIO(b"1111"))
+        self.storage.save("album/2.jpg", io.BytesIO(b"2222"))
+        # Make 1.jpg more recently used than 2.jpg.
+        os.utime(os.path.join(self.location, "album/2.jpg"), (0, 0))
+        self.read("album/1.jpg")
+        self.storage.save("album/3.jpg", io.BytesIO(b"3333"))
+        self.assertEqual(self.local_files(), ["album/1.jpg", "album/3.jpg"])
+        self.assertEqual(self.read("album/2.jpg"), b"2222")
+
+    def test_delete_from_both_tiers(self):
+        self.read("album/photo.jpg")
+        self.storage.delete("album/photo.jpg")
+        self.assertFalse(self.storage.exists("album/photo.jpg"))
+        self.assertEqual(self.local_files(), [])
+
+    def test_path(self):
+        path = self.storage.path("album/photo.jpg")
+        self.assertEqual(path, os.path.join(self.location, "album/photo.jpg"))
+        with open(path, "rb") as file:
+            self.assertEqual(file.read(), b"photo")
+
+
+class SimulatedStorageTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.memory_storage = MemoryStorage()
+        self.memory_storage.save("album/photo.jpg", io.BytesIO(b"photo" * 1000))
+
+    def test_count_calls(self):
+        storage = SimulatedStorage(self.memory_storage)
+        storage.save("album/other.jpg", io.BytesIO(b"other"))
+        self.assertTrue(storage.exists("album/other.jpg"))
+        self.assertEqual(storage.listdir("album"), ([], ["other.jpg", "photo.jpg"]))
+        with storage.open("album/photo.jpg") as file:
+            self.assertEqual(file.read(), b"photo" * 1000)
+        storage.delete("album/other.jpg")
+        self.assertEqual(
+            storage.calls,
+            {"save": 1, "exists": 1, "listdir": 1, "open": 1, "delete": 1},
+        )
+        self.assertEqual((storage.bytes_read, storage.bytes_written), (5000, 5))
+        self.assertEqual(storage.url("album/photo.jpg"), "/url/of/album/photo.jpg")
+
+    def test_latency(self):
+        storage = SimulatedStorage(self.memory_storage, latency=0.02, jitter=0.01)
+        t = time.perf_counter()
+        for _ in range(3):
+            storage.exists("album/photo.jpg")
+        self.assertGreaterEqual(time.perf_counter() - t, 0.06)
+
+    def test_bandwidth(self):
+        storage = SimulatedStorage(self.memory_storage, bandwidth=100_000)
+        t = time.perf_counter()
+        with storage.open("album/photo.jpg") as file:
+            file.read()
+        self.assertGreaterEqual(time.perf_counter() - t, 0.05)
+
+    def test_no_path(self):
+        storage = SimulatedStorage(FileSystemStorage(tempfile.gettempdir()))
+        self.assertIsNone(get_local_path(storage, "album/photo.jpg"))
@@ -1,14 +1,30 @@
 import datetime
+import hmac
+import io
+import re
+import time
 import zipfile
+from unittest import mock
 
-from django.contrib.auth.models import Permission, User
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.middleware.csrf import get_token
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
 
+from . import views
+from .caching import get_cache
+from .exports import get_job, get_job_zip_name, run_job
 from .models import Album, AlbumAccessPolicy, Photo
 from .resizers.pillow import get_resized_name
 from .resizers.test_pillow import make_image
+from .signing import get_expires, get_signature
 from .storages import get_storage
+from .test_storages import MemoryStorage
 
 
 class ViewsTestsMixin:
@@ -44,6 +60,126 @@ class ViewsTestsMixin:
         with zipfile.ZipFile(get_storage("cache").open(export_file)) as archive:
             self.assertEqual(archive.namelist(), ["original.jpg"])
 
+    def test_album_export_view_streaming(self):
+        url = reverse("gallery:album-export", args=[self.album.pk])
+        with self.settings(
+            GALLERY_CACHE_STORAGE=MemoryStorage(), GALLERY_EXPORT_MODE="stream"
+        ):
+            self.make_image()
+            response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        data = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist(), ["original.jpg"])
+
+    def test_album_export_view_streaming_cached(self):
+        url = reverse("gallery:album-export", args=[self.album.pk])
+        with self.settings(
+            GALLERY_CACHE_STORAGE=MemoryStorage(),
+            GALLERY_EXPORT_MODE="stream",
+            GALLERY_EXPORT_CACHE_STREAMS=True,
+        ):
+            self.make_image()
+            response = self.client.get(url)
+            b"".join(response.streaming_content)
+            response = self.client.get(url)
+        self.assertTrue(response["Location"].startswith("/url/of/export/"))
+
+    def test_album_export_view_background(self):
+        url = reverse("gallery:album-export", args=[self.album.pk])
+        with self.settings(
+            GALLERY_CACHE_STORAGE=MemoryStorage(), GALLERY_EXPORT_MODE="background"
+        ):
+            self.make_image()
+            response = self.client.get(url)
+            status_url = response["Location"]
+            self.assertTrue(status_url.startswith("/export/status/"))
+            for _ in range(100):
+                response = self.client.get(status_url)
+                if "zip_url" in response.context and response.context["zip_url"]:
+                    break
+                time.sleep(0.05)
+            self.assertTemplateUsed(response, "gallery/album_export.html")
+            export_file = response.context["zip_url"][len("/url/of/") :]
+            with zipfile.ZipFile(get_storage("cache").open(export_file)) as archive:
+                self.assertEqual(archive.namelist(), ["original.jpg"])
+
+    @mock.patch("gallery.exports.get_executor")
+    def test_album_export_view_background_resized(self, get_executor):
+        self.photo.content_hash = "0123abcd" * 8
+        self.photo.save()
+        url = reverse("gallery:album-export", args=[self.album.pk])
+        with self.settings(
+            GALLERY_CACHE_STORAGE=MemoryStorage(),
+            GALLERY_EXPORT_MODE="background",
+            GALLERY_RESIZE_PRESETS={"small": (24, 24, False)},
+        ):
+            self.make_image()
+            response = self.client.get(url, {"preset": "small"})
+            job_id = response["Location"].split("/")[-2]
+            # Background jobs don't query the database.
+            with self.assertNumQueries(0):
+                run_job(*get_executor.return_value.submit.call_args[0][1:])
+            self.assertEqual(get_job(job_id)["status"], "done")
+            export_file = get_job_zip_name(job_id)
+            with zipfile.ZipFile(get_storage("cache").open(export_file)) as archive:
+                self.assertEqual(archive.namelist(), ["original.jpg"])
+                with Image.open(archive.open("original.jpg")) as image:
+                    self.assertEqual(image.size, (24, 18))
+            resized_name = get_resized_name(self.photo, 24, 24, False)
+            self.assertTrue(get_storage("cache").exists(resized_name))
+
+    def test_album_export_view_resized(self):
+        url = reverse("gallery:album-export", args=[self.album.pk])
+        with self.settings(
+            GALLERY_CACHE_STORAGE=MemoryStorage(),
+            GALLERY_RESIZE_PRESETS={"small": (24, 24, False)},
+        ):
+            self.make_image()
+            response = self.client.get(url, {"preset": "small"})
+            export_file = response["Location"][len("/url/of/") :]
+            with zipfile.ZipFile(get_storage("cache").open(export_file)) as archive:
+                self.assertEqual(archive.namelist(), ["original.jpg"])
+                with Image.open(archive.open("original.jpg")) as image:
+                    self.assertEqual(image.size, (24, 18))
+            # The resized version is reused for displaying the photo.
+            resized_name = get_resized_name(self.photo, 24, 24, False)
+            self.assertTrue(get_storage("cache").exists(resized_name))
+
+    def test_album_export_view_unknown_preset(self):
+        url = reverse("gallery:album-export", args=[self.album.pk])
+        response = self.client.get(url, {"preset": "unknown"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_photos_export_view(self):
+        other_album = Album.objects.create(
+            category="default", dirpath="other", date=datetime.date(2000, 1, 1)
+        )
+        Photo.objects.create(album=other_album, filename="other.jpg")
+        url = reverse("gallery:photos-export")
+        with self.settings(GALLERY_EXPORT_PREFETCH=2):
+            self.make_image()
+            response = self.client.get(url, {"year": self.album.date.year})
+            self.assertEqual(response["Content-Type"], "application/zip")
+            data = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist(), ["album/original.jpg"])
+
+    def test_photos_export_view_bad_request(self):
+        url = reverse("gallery:photos-export")
+        for params in [
+            {},
+            {"album": "abc"},
+            {"album": str(10**30)},
+            {"album": str(-(10**30))},
+            {"year": str(10**30)},
+            {"start": "2000-13-01"},
+            {"end": "0"},
+        ]:
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400)
+
     def test_photo_resized_view(self):
         with self.settings(GALLERY_RESIZE_PRESETS={"resized": (120, 120, False)}):
             self.make_image()
@@ -96,6 +232,15 @@ class ViewsWithPrivateAccessPolicyTests(ViewsTestsMixin, TestCase):
         self.album.access_policy.users.add(self.user)
         self.client.login(username="user", password="pass")
 
+    def test_photos_export_view_hides_private_albums(self):
+        self.make_image()
+        self.client.logout()
+        url = reverse("gallery:photos-export")
+        response = self.client.get(url, {"album": self.album.pk})
+        data = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist(), [])
+
     def test_hide_private_albums(self):
         self.client.logout()
         response = self.client.get(reverse("gallery:index"))
@@ -140,3 +285,223 @@ class ViewsWithPublicAccessPolicyTests(ViewsTestsMixin, TestCase):
         self.assertQuerysetEqual(response.context["latest"], [])
         response = self.client.get(reverse("gallery:index"))
         self.assertQuerysetEqual(response.context["latest"], [])
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        today = datetime.date.today()
+        self.album = Album.objects.create(
+            category="default", dirpath="holidays", date=today
+        )
+        AlbumAccessPolicy.objects.create(album=self.album, public=True, inherit=True)
+        self.photo = Photo.objects.create(album=self.album, filename="original.jpg")
+        self.user = User.objects.create_user("user", "user@gallery", "pass")
+
+    def test_anonymous_pages_are_cached(self):
+        url = reverse("gallery:album", args=[self.album.pk])
+        with self.settings(GALLERY_PAGE_CACHE_TIMEOUT=60):
+            response = self.client.get(url)
+            with self.assertNumQueries(0):
+                cached_response = self.client.get(url)
+        self.assertEqual(cached_response.content, response.content)
+
+    def test_cached_pages_keep_headers(self):
+        url = reverse("gallery:album", args=[self.album.pk])
+        render_to_response = views.AlbumView.render_to_response
+
+        def render_to_response_with_headers(self, context, **kwargs):
+            kwargs["content_type"] = "application/xhtml+xml"
+            response = render_to_response(self, context, **kwargs)
+            response["Content-Language"] = "en"
+            return response
+
+        with self.settings(GALLERY_PAGE_CACHE_TIMEOUT=60), mock.patch.object(
+            views.AlbumView, "render_to_response", render_to_response_with_headers
+        ):
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "application/xhtml+xml")
+        self.assertEqual(response["Content-Language"], "en")
+
+    def test_pages_with_csrf_token_are_not_cached(self):
+        url = reverse("gallery:album", args=[self.album.pk])
+        get_context_data = views.AlbumView.get_context_data
+
+        def get_context_data_with_csrf_token(self, **kwargs):
+            get_token(self.request)
+            return get_context_data(self, **kwargs)
+
+        with self.settings(GALLERY_PAGE_CACHE_TIMEOUT=60), mock.patch.object(
+            views.AlbumView, "get_context_data", get_context_data_with_csrf_token
+        ):
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+        self.assertGreater(len(queries), 0)
+
+    def test_scopes_are_isolated(self):
+        url = reverse("gallery:index")
+        with self.settings(GALLERY_PAGE_CACHE_TIMEOUT=60):
+            response = self.client.get(url)
+            self.assertContains(response, "holidays")
+            self.client.login(username="user", password="pass")
+            response = self.client.get(url)
+            self.assertNotContains(response, "holidays")
+
+    def test_access_policy_change_invalidates_cache(self):
+        url = reverse("gallery:index")
+        with self.settings(GALLERY_PAGE_CACHE_TIMEOUT=60):
+            response = self.client.get(url)
+            self.assertContains(response, "holidays")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.album.access_policy.public = False
+                self.album.access_policy.save()
+            response = self.client.get(url)
+            self.assertNotContains(response, "holidays")
+
+    def test_group_change_invalidates_cache(self):
+        url = reverse("gallery:album", args=[self.album.pk])
+        group = Group.objects.create(name="group")
+        policy = self.album.access_policy
+        policy.public = False
+        policy.save()
+        policy.groups.add(group)
+        self.client.login(username="user", password="pass")
+        with self.settings(GALLERY_PAGE_CACHE_TIMEOUT=60):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.groups.add(group)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        today = datetime.date.today()
+        self.album = Album.objects.create(
+            category="default", dirpath="album", date=today
+        )
+        AlbumAccessPolicy.objects.create(album=self.album, public=True, inherit=True)
+        self.photo = Photo.objects.create(album=self.album, filename="original.jpg")
+
+    def test_album_view(self):
+        url = reverse("gallery:album", args=[self.album.pk])
+        with self.settings(GALLERY_CONDITIONAL_GET=True):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_no_last_modified(self):
+        url = reverse("gallery:album", args=[self.album.pk])
+        with self.settings(GALLERY_CONDITIONAL_GET=True):
+            response = self.client.get(url)
+            self.assertNotIn("Last-Modified", response)
+            # Last-Modified couldn't account for changes of access.
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT"
+            )
+            self.assertEqual(response.status_code, 200)
+
+    def test_generation_change(self):
+        url = reverse("gallery:index")
+        with self.settings(GALLERY_CONDITIONAL_GET=True):
+            etag = self.client.get(url)["ETag"]
+            with self.captureOnCommitCallbacks(execute=True):
+                self.album.access_policy.delete()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+
+    def test_scope_change(self):
+        url = reverse("gallery:index")
+        with self.settings(GALLERY_CONDITIONAL_GET=True):
+            etag = self.client.get(url)["ETag"]
+            User.objects.create_user("user", "user@gallery", "pass")
+            self.client.login(username="user", password="pass")
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_photo_resized_view(self):
+        with self.settings(
+            GALLERY_CONDITIONAL_GET=True,
+            GALLERY_RESIZE_PRESETS={"resized": (120, 120, False)},
+        ):
+            make_image(self.photo.image_name, 48, 36, get_storage("photo"))
+            url = reverse("gallery:photo-resized", args=["resized", self.photo.pk])
+            etag = self.client.get(url)["ETag"]
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+
+@override_settings(GALLERY_SIGNED_URLS_TTL=3600)
+class SignedURLsTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        today = datetime.date.today()
+        self.album = Album.objects.create(
+            category="default", dirpath="album", date=today
+        )
+        AlbumAccessPolicy.objects.create(album=self.album, public=False, inherit=True)
+        self.photo = Photo.objects.create(album=self.album, filename="original.jpg")
+        self.user = User.objects.create_user("user", "user@gallery", "pass")
+        self.album.access_policy.users.add(self.user)
+        make_image(self.photo.image_name, 48, 36, get_storage("photo"))
+
+    def get_signed_url(self):
+        self.client.login(username="user", password="pass")
+        response = self.client.get(reverse("gallery:photo", args=[self.photo.pk]))
+        self.client.logout()
+        match = re.search(r'href="(/original/\d+/\?[^"]+)"', response.content.decode())
+        return match[1].replace("&amp;", "&")
+
+    def test_signed_url(self):
+        url = self.get_signed_url()
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertRedirects(
+            response, "/url/of/" + self.photo.image_name, fetch_redirect_response=False
+        )
+
+    def test_tampered_signature(self):
+        url = self.get_signed_url().replace("signature=", "signature=0")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_expired_signature(self):
+        url = self.get_signed_url()
+        with mock.patch("time.time", return_value=time.time() + 3 * 3600):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_unsigned_url(self):
+        url = reverse("gallery:photo-original", args=[self.photo.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_signature_key(self):
+        message = b"/original/1/:1000"
+        self.assertNotEqual(
+            get_signature("/original/1/", 1000),
+            hmac.new(settings.SECRET_KEY.encode(), message, "sha256").hexdigest(),
+        )
+        with self.settings(GALLERY_SIGNED_URLS_KEY="key"):
+            self.assertEqual(
+                get_signature("/original/1/", 1000),
+                hmac.new(b"key", message, "sha256").hexdigest(),
+            )
+
+    def test_invalid_ttl(self):
+        for ttl in [0, -1]:
+            with self.subTest(ttl=ttl), self.settings(GALLERY_SIGNED_URLS_TTL=ttl):
+                with self.assertRaises(ImproperlyConfigured):
+                    get_expires()
@@ -7,9 +7,16 @@ app_name = "gallery"
 urlpatterns = [
     path("", views.GalleryIndexView.as_view(), name="index"),
     path("latest/", views.latest_album, name="latest"),
+    path("metrics/", views.metrics, name="metrics"),
     path("year/<int:year>/", views.GalleryYearView.as_view(), name="year"),
     path("album/<int:pk>/", views.AlbumView.as_view(), name="album"),
     path("export/<int:pk>/", views.export_album, name="album-export"),
+    path("export/", views.export_photos, name="photos-export"),
+    path(
+        "export/status/<slug:job_id>/",
+        views.export_status,
+        name="album-export-status",
+    ),
     path("photo/<int:pk>/", views.PhotoView.as_view(), name="photo"),
     path("original/<int:pk>/", views.original_photo, name="photo-original"),
     path("resized/<slug:preset>/<int:pk>/", views.resized_photo, name="photo-resized"),
@@ -1,21 +1,89 @@
-import hashlib
-import os
+import datetime
+import functools
 import random
-import tempfile
-import zipfile
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.http import HttpResponseRedirect
-from django.shortcuts import get_object_or_404
+from django.db import connection, models
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_date
 from django.utils.functional import cached_property
+from django.utils.text import slugify
 from django.views.generic import ArchiveIndexView, DetailView, YearArchiveView
 
+from .caching import (
+    get_cache,
+    get_etag,
+    get_page_cache_key,
+    get_scope,
+    is_page_cacheable,
+)
+from .exports import (
+    get_entries,
+    get_export_name,
+    get_job,
+    get_job_zip_name,
+    get_manifest_name,
+    get_resized_entries,
+    get_resized_photos,
+    get_snapshot,
+    iter_selection_entries,
+    save_archive,
+    select_photos,
+    start_job,
+    stream_archive,
+    tee_to_storage,
+)
+from .metrics import is_enabled as metrics_enabled
+from .metrics import render as render_metrics
+from .middleware import query_budget
 from .models import Album, Photo
+from .search import get_search_backend
+from .signing import get_expires, get_ttl, has_valid_signature
 from .storages import get_storage
 
 
+def set_etag(response, etag):
+    response["ETag"] = etag
+    # ETags depend on the user.
+    patch_vary_headers(response, ["Cookie"])
+
+
+def conditional_photo_view(view):
+    """
+    Handle conditional requests for views serving photos, when enabled.
+
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not getattr(settings, "GALLERY_CONDITIONAL_GET", False):
+            return view(request, *args, **kwargs)
+        if has_valid_signature(request):
+            scope = "signed"
+        else:
+            can_view_all = request.user.has_perm("gallery.view")
+            scope = get_scope(request.user, can_view_all, show_public=False)
+        presets = getattr(settings, "GALLERY_RESIZE_PRESETS", {})
+        etag = get_etag(request, scope, presets)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        set_etag(response, etag)
+        return response
+
+    return wrapper
+
+
 class GalleryCommonMixin:
     allow_future = True
 
@@ -47,6 +115,52 @@ class GalleryCommonMixin:
         else:
             return True
 
+    def get(self, request, *args, **kwargs):
+        """
+        Handle conditional requests and caching of pages, when enabled.
+
+        ETags and cache keys are derived from the visibility scope and
+        the generation of the gallery. This happens before running queries
+        for building the page.
+
+        """
+        conditional = getattr(settings, "GALLERY_CONDITIONAL_GET", False)
+        timeout = getattr(settings, "GALLERY_PAGE_CACHE_TIMEOUT", None)
+        if not conditional and timeout is None:
+            return super().get(request, *args, **kwargs)
+        scope = get_scope(request.user, self.can_view_all, self.show_public)
+        # Pages contain signed URLs which change when they expire.
+        extra = [] if get_ttl() is None else [get_expires()]
+        etag = get_etag(request, scope, *extra)
+        response = None
+        if conditional:
+            response = get_conditional_response(request, etag=etag)
+        if response is None:
+            if timeout is None:
+                response = super().get(request, *args, **kwargs)
+            else:
+                response = self.get_cached_page(request, etag, timeout, *args, **kwargs)
+        if conditional:
+            set_etag(response, etag)
+        return response
+
+    def get_cached_page(self, request, etag, timeout, *args, **kwargs):
+        cache = get_cache()
+        key = get_page_cache_key(etag)
+        cached = cache.get(key)
+        if cached is not None:
+            content, headers = cached
+            return HttpResponse(content, headers=headers)
+        response = super().get(request, *args, **kwargs)
+
+        def cache_page(response):
+            if is_page_cacheable(request, response):
+                cached = response.content, dict(response.items())
+                cache.set(key, cached, timeout)
+
+        response.add_post_render_callback(cache_page)
+        return response
+
 
 class AlbumListMixin:
     """
@@ -83,11 +197,16 @@ class AlbumListWithPreviewMixin(AlbumListMixin):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        self.set_previews(context["object_list"])
+        context["title"] = getattr(settings, "GALLERY_TITLE", "Gallery")
+        return context
+
+    def set_previews(self, albums):
         user = self.request.user
         if not self.can_view_all and user.is_authenticated:
             # Avoid repeated queries - this is specific to django.contrib.auth
             user = User.objects.prefetch_related("groups").get(pk=user.pk)
-        for album in context["object_list"]:
+        for album in albums:
             if self.can_view_all:
                 photos = list(album.photo_set.all())
             else:
@@ -105,19 +224,18 @@ class AlbumListWithPreviewMixin(AlbumListMixin):
                 album.preview = [photos[index] for index in selection]
             else:
                 album.preview = list(photos)
-        context["title"] = getattr(settings, "GALLERY_TITLE", "Gallery")
-        return context
 
 
 class GalleryIndexView(GalleryCommonMixin, AlbumListWithPreviewMixin, ArchiveIndexView):
     allow_empty = True
     paginate_by = 20
+    query_budget = 20
 
     def get_queryset(self):
         qs = super().get_queryset()
         query = self.request.GET.get("q", "")
         if query:
-            qs = qs.filter(name__contains=query)
+            qs = get_search_backend().search_albums(qs, query)
         return qs
 
     def get_context_data(self, **kwargs):
@@ -131,11 +249,28 @@ class GalleryIndexView(GalleryCommonMixin, AlbumListWithPreviewMixin, ArchiveInd
 class GalleryYearView(GalleryCommonMixin, AlbumListWithPreviewMixin, YearArchiveView):
     make_object_list = True
     paginate_by = 20
+    query_budget = 24
+
+    # Django finds the next and previous years with get_queryset(), which
+    # prefetches photos and access policies of the first album it finds.
+
+    def get_next_year(self, date):
+        albums = self.get_queryset().prefetch_related(None)
+        albums = albums.filter(date__gte=datetime.date(date.year + 1, 1, 1))
+        album = albums.order_by("date").first()
+        return None if album is None else datetime.date(album.date.year, 1, 1)
+
+    def get_previous_year(self, date):
+        albums = self.get_queryset().prefetch_related(None)
+        albums = albums.filter(date__lt=datetime.date(date.year, 1, 1))
+        album = albums.order_by("-date").first()
+        return None if album is None else datetime.date(album.date.year, 1, 1)
 
 
 class AlbumView(GalleryCommonMixin, AlbumListMixin, DetailView):
     model = Album
     context_object_name = "album"
+    query_budget = 19
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -163,6 +298,7 @@ class AlbumView(GalleryCommonMixin, AlbumListMixin, DetailView):
 class PhotoView(GalleryCommonMixin, DetailView):
     model = Photo
     context_object_name = "photo"
+    query_budget = 9
 
     def get_queryset(self):
         if self.can_view_all:
@@ -188,6 +324,7 @@ class PhotoView(GalleryCommonMixin, DetailView):
         return context
 
 
+@query_budget(10)
 def export_album(request, pk):
     """
     Serve a zip archive containing an entire album.
@@ -199,50 +336,167 @@ def export_album(request, pk):
     else:
         photos = album.photo_set.allowed_for_user(request.user)
 
+    preset = request.GET.get("preset")
+    presets = getattr(settings, "GALLERY_RESIZE_PRESETS", {})
+    if preset is not None and preset not in presets:
+        raise Http404
+
     zip_storage = get_storage("cache")
-    image_storage = get_storage("photo")
-
-    hsh = hashlib.md5()
-    hsh.update(str(settings.SECRET_KEY).encode())
-    hsh.update(str(pk).encode())
-    for photo in photos:
-        hsh.update(str(photo.pk).encode())
-    zip_name = os.path.join("export", hsh.hexdigest() + ".zip")
-
-    if not zip_storage.exists(zip_name):
-        # Create the archive in a temporary file to avoid holding it in memory
-        with tempfile.TemporaryFile(suffix=".zip") as temp_zip:
-            with zipfile.ZipFile(temp_zip, "w") as archive:
-                for photo in photos:
-                    data = image_storage.open(photo.image_name).read()
-                    archive.writestr(photo.filename, data)
-            temp_zip.seek(0)
-            zip_storage.save(zip_name, temp_zip)
+    image_storage = get_storage("photo" if preset is None else "cache")
+
+    snapshot = get_snapshot(album, photos)
+    zip_name = get_export_name(pk, snapshot, preset)
+
+    if zip_storage.exists(zip_name):
+        return HttpResponseRedirect(zip_storage.url(zip_name))
+
+    manifest_name = get_manifest_name(pk, preset)
+    mode = getattr(settings, "GALLERY_EXPORT_MODE", "build")
+
+    if preset is None:
+        entries = get_entries(snapshot)
+    elif mode == "background":
+        # Let the background job create resized versions of photos, without
+        # querying the database.
+        photos = get_resized_photos(album, snapshot)
+        entries = functools.partial(get_resized_entries, photos, preset)
+    else:
+        entries = get_resized_entries(get_resized_photos(album, snapshot), preset)
+
+    if mode == "background":
+        job_id = start_job(zip_name, entries, image_storage, zip_storage, manifest_name)
+        return HttpResponseRedirect(
+            reverse("gallery:album-export-status", args=[job_id])
+        )
+
+    if mode == "stream":
+        chunks = stream_archive(entries, image_storage)
+        if getattr(settings, "GALLERY_EXPORT_CACHE_STREAMS", False):
+            chunks = tee_to_storage(chunks, zip_storage, zip_name)
+        response = StreamingHttpResponse(chunks, content_type="application/zip")
+        filename = slugify(album.display_name) or str(album.pk)
+        response["Content-Disposition"] = f'attachment; filename="{filename}.zip"'
+        return response
+
+    save_archive(zip_name, entries, image_storage, zip_storage, manifest_name)
 
     zip_url = zip_storage.url(zip_name)
     return HttpResponseRedirect(zip_url)
 
 
+def parse_date_param(value):
+    if value is None:
+        return None
+    date = parse_date(value)
+    if date is None:
+        raise ValueError(f"Invalid date: {value}")
+    return date
+
+
+def parse_pk_param(value):
+    pk = int(value)
+    internal_type = Album._meta.pk.get_internal_type()
+    min_value, max_value = connection.ops.integer_field_range(internal_type)
+    # Databases without declared ranges, like SQLite, store 64-bit integers.
+    if min_value is None:
+        min_value = -models.BigIntegerField.MAX_BIGINT - 1
+    if max_value is None:
+        max_value = models.BigIntegerField.MAX_BIGINT
+    if not min_value <= pk <= max_value:
+        raise ValueError(f"Out of range: {value}")
+    return pk
+
+
+def export_photos(request):
+    """
+    Stream a zip archive containing several albums.
+
+    Albums are selected with the ``album``, ``year``, ``start``, and ``end``
+    query string parameters.
+
+    """
+    album_pks = request.GET.getlist("album") or None
+    year = request.GET.get("year")
+    start = request.GET.get("start")
+    end = request.GET.get("end")
+    try:
+        if album_pks is not None:
+            album_pks = [parse_pk_param(pk) for pk in album_pks]
+        if year is not None:
+            year = int(year)
+            start = datetime.date(year, 1, 1)
+            end = datetime.date(year, 12, 31)
+        else:
+            start = parse_date_param(start)
+            end = parse_date_param(end)
+    except (OverflowError, ValueError):
+        return HttpResponseBadRequest()
+    # Don't export the entire gallery by accident.
+    if album_pks is None and start is None and end is None:
+        return HttpResponseBadRequest()
+
+    if request.user.has_perm("gallery.view"):
+        photos = Photo.objects.all()
+    else:
+        photos = Photo.objects.allowed_for_user(request.user)
+    photos = select_photos(photos, album_pks, start, end)
+
+    entries = iter_selection_entries(photos)
+    chunks = stream_archive(entries, get_storage("photo"))
+    response = StreamingHttpResponse(chunks, content_type="application/zip")
+    if year is not None:
+        filename = str(year)
+    else:
+        filename = "photos"
+    response["Content-Disposition"] = f'attachment; filename="{filename}.zip"'
+    return response
+
+
+def export_status(request, job_id):
+    """
+    Show the progress of a background export and link to the archive.
+
+    """
+    job = get_job(job_id)
+    zip_url = None
+    if job is None or job["status"] == "done":
+        zip_storage = get_storage("cache")
+        zip_name = get_job_zip_name(job_id)
+        if zip_storage.exists(zip_name):
+            zip_url = zip_storage.url(zip_name)
+        elif job is None:
+            raise Http404
+    context = {"job": job, "zip_url": zip_url}
+    return render(request, "gallery/album_export.html", context)
+
+
 def _get_photo_if_allowed(request, pk):
     qs = Photo.objects
-    if not request.user.has_perm("gallery.view"):
+    # A valid signature proves that access control was performed when the
+    # URL was generated. Then there's no need to do it again.
+    if not has_valid_signature(request) and not request.user.has_perm("gallery.view"):
         qs = qs.allowed_for_user(request.user)
     qs = qs.select_related("album")
     return get_object_or_404(qs, pk=pk)
 
 
+@query_budget(7)
+@conditional_photo_view
 def resized_photo(request, preset, pk):
     """Serve a resized photo."""
     photo = _get_photo_if_allowed(request, int(pk))
     return HttpResponseRedirect(photo.resized_url(preset))
 
 
+@query_budget(7)
+@conditional_photo_view
 def original_photo(request, pk):
     """Serve an original photo."""
     photo = _get_photo_if_allowed(request, int(pk))
     return HttpResponseRedirect(get_storage("photo").url(photo.image_name))
 
 
+@query_budget(7)
 def latest_album(request):
     if request.user.has_perm("gallery.view"):
         albums = Album.objects.all()
@@ -257,3 +511,16 @@ def latest_album(request):
         return HttpResponseRedirect(reverse("gallery:album", args=[pk]))
     else:
         return HttpResponseRedirect(reverse("gallery:index"))
+
+
+@query_budget(0)
+def metrics(request):
+    """
+    Serve metrics in the Prometheus text format.
+
+    """
+    if not metrics_enabled():
+        raise Http404
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )